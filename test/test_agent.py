@@ -0,0 +1,70 @@
+import sys
+import threading
+import time
+
+import pytest
+
+from tsdapiclient.agent import (AgentError, JobQueue, TransferAgent,
+                                agent_jobs, agent_submit)
+from tsdapiclient.batch import BatchRunner, make_job
+
+
+def test_job_queue(tmp_path):
+    queue = JobQueue(str(tmp_path / 'agent.db'))
+    low, high, other = queue.add([
+        make_job(0, {'upload': 'a'}),
+        make_job(0, {'upload': 'b', 'priority': 5}),
+        make_job(0, {'download': 'c'}),
+    ])
+    assert [job.index for job in queue.pending()] == [high, low, other]
+    queue.start(high)
+    queue.finish(low, 'failed')
+    # a restart makes interrupted jobs pending again
+    queue = JobQueue(str(tmp_path / 'agent.db'))
+    assert queue.recover() == 1
+    assert [job.index for job in queue.pending()] == [high, other]
+    assert [job['state'] for job in queue.jobs()] == ['failed', 'pending', 'pending']
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline
+        time.sleep(0.05)
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='requires Unix sockets')
+def test_transfer_agent(tmp_path, monkeypatch):
+    ran = []
+    def run_job(self, job):
+        ran.append(job.path)
+        if job.path == 'bad':
+            raise ValueError('failed')
+    monkeypatch.setattr(BatchRunner, '_run_job', run_job)
+    spool = tmp_path / 'spool'
+    spool.mkdir()
+    (spool / 'jobs.yaml').write_text('jobs:\n  - upload: one\n  - download: bad\n')
+    (spool / 'broken.yaml').write_text('jobs:\n  - nonsense: one\n')
+    path = str(tmp_path / 'agent.sock')
+    agent = TransferAgent(
+        'test', 'p11', {}, JobQueue(str(tmp_path / 'agent.db')),
+        spool_dir=str(spool), path=path,
+    )
+    thread = threading.Thread(target=agent.run, daemon=True)
+    thread.start()
+    try:
+        wait_for(lambda: (spool / 'accepted' / 'jobs.yaml').exists())
+        assert agent_submit('test', 'p11', {'upload': 'two'}, path=path) == 3
+        with pytest.raises(AgentError):
+            agent_submit('test', 'p11', {'upload': 'two', 'colour': 'red'}, path=path)
+        wait_for(lambda: len(agent_jobs('test', 'p11', ['done', 'failed'], path=path)) == 3)
+        jobs = agent_jobs('test', 'p11', path=path)
+        assert [(job['path'], job['state']) for job in jobs] == [
+            ('one', 'done'), ('bad', 'failed'), ('two', 'done'),
+        ]
+        assert (spool / 'accepted' / 'jobs.yaml').exists()
+        assert (spool / 'rejected' / 'broken.yaml').exists()
+    finally:
+        agent.stop()
+        thread.join()
+    assert sorted(ran) == ['bad', 'one', 'two']
@@ -0,0 +1,47 @@
+import base64
+import json
+import threading
+import time
+
+from tsdapiclient import authapi
+from tsdapiclient.authapi import TokenManager
+
+
+def jwt(**claims):
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip('=')
+    return f'header.{payload}.signature'
+
+
+def test_token_manager_single_flight(monkeypatch):
+    calls, persisted = [], []
+    def refresh_access_token(env, pnum, api_key, refresh_token):
+        calls.append(refresh_token)
+        time.sleep(0.2)
+        return jwt(name='import', exp=time.time() + 3600), jwt(counter=4)
+    monkeypatch.setattr(authapi, 'refresh_access_token', refresh_access_token)
+    monkeypatch.setattr(authapi, 'session_update', lambda *args: persisted.append(args))
+    old = jwt(name='import', exp=time.time() + 60)
+    tokens = TokenManager('test', 'p11', old, jwt(counter=5), api_key='key')
+    assert tokens.due()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(tokens.current())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len(set(results)) == 1 and results[0] != old
+    assert not tokens.due()
+    assert persisted == [('test', 'p11', 'import', results[0], tokens.refresh_token)]
+
+
+def test_token_manager_failed_refresh(monkeypatch):
+    monkeypatch.setattr(authapi, 'refresh_access_token', lambda *args: (None, None))
+    monkeypatch.setattr(authapi, 'session_update', lambda *args: None)
+    old = jwt(name='import', exp=time.time() + 60)
+    tokens = TokenManager('test', 'p11', old, jwt(counter=5))
+    assert tokens.current() == old
+    # the refresh token is dropped, so it is not retried for every request
+    assert tokens.refresh_token is None and not tokens.due()
+    # tokens without refresh tokens are not decoded
+    assert TokenManager('test', 'p11', 'not-a-jwt').current() == 'not-a-jwt'
@@ -0,0 +1,66 @@
+import pytest
+
+from tsdapiclient.batch import (BatchRunner, ManifestError, independent_lanes,
+                                load_manifest)
+
+
+def write(tmp_path, text):
+    path = tmp_path / 'manifest.yaml'
+    path.write_text(text)
+    return str(path)
+
+
+def test_load_manifest(tmp_path):
+    jobs, concurrency = load_manifest(write(tmp_path, """
+concurrency: 3
+defaults:
+  encrypt: true
+jobs:
+  - upload: data/
+    group: p11-special-group
+  - download_sync: exports
+    encrypt: false
+"""))
+    assert concurrency == 3
+    assert [(job.kind, job.path, job.direction) for job in jobs] == [
+        ('upload', 'data', 'upload'), ('download_sync', 'exports', 'download'),
+    ]
+    assert jobs[0].options['encrypt'] and not jobs[1].options['encrypt']
+    assert jobs[0].options['group'] == 'p11-special-group'
+    assert jobs[1].options['transfer_order'] == 'scan'
+    with pytest.raises(ManifestError, match='unknown options: colour'):
+        load_manifest(write(tmp_path, 'jobs:\n  - upload: a\n    colour: red\n'))
+    with pytest.raises(ManifestError, match='specify one of'):
+        load_manifest(write(tmp_path, 'jobs:\n  - upload: a\n    download: b\n'))
+
+
+def test_independent_lanes(tmp_path):
+    jobs, _ = load_manifest(write(tmp_path, """
+jobs:
+  - upload: a
+  - upload: b
+  - download_sync: a/sub
+  - upload: ab
+  - upload_sync: b
+"""))
+    lanes = independent_lanes(jobs)
+    assert [[job.index for job in lane] for lane in lanes] == [[0, 2], [1, 4], [3]]
+
+
+def test_batch_runner_continues_after_failures(tmp_path, monkeypatch):
+    jobs, _ = load_manifest(write(tmp_path, """
+jobs:
+  - upload: a
+  - upload: b
+  - upload: c
+"""))
+    ran = []
+    def run_job(self, job):
+        ran.append(job.path)
+        if job.path == 'b':
+            raise SystemExit('The request was unsuccesful. Exiting.')
+    monkeypatch.setattr(BatchRunner, '_run_job', run_job)
+    runner = BatchRunner('test', 'p11', jobs, tokens={}, concurrency=2)
+    assert not runner.run()
+    assert sorted(ran) == ['a', 'b', 'c']
+    assert [job.path for job in runner.failures] == ['b']
@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+pytest.importorskip('libnacl')
+
+from click.testing import CliRunner
+
+from tsdapiclient.benchmark import main
+
+
+def test_benchmark_output(tmp_path):
+    output = tmp_path / 'results.json'
+    result = CliRunner().invoke(main, [
+        '--total', '3000', '--chunk-sizes', '1000,1500', '--workers', '0,2',
+        '--repeat', '1', '--output', str(output),
+    ])
+    assert result.exit_code == 0, result.output
+    results = json.loads(output.read_text())
+    assert results['libsodium']
+    measured = [(r['benchmark'], r.get('chunk_size'), r.get('workers')) for r in results['results']]
+    assert measured == [
+        ('encrypt', 1000, None), ('decrypt', 1000, None), ('crypt_into', 1000, None),
+        ('crypt_chunks', 1000, 0), ('crypt_chunks', 1000, 2),
+        ('crypt_in_place', 1000, 0), ('crypt_in_place', 1000, 2),
+        ('encrypt', 1500, None), ('decrypt', 1500, None), ('crypt_into', 1500, None),
+        ('crypt_chunks', 1500, 0), ('crypt_chunks', 1500, 2),
+        ('crypt_in_place', 1500, 0), ('crypt_in_place', 1500, 2),
+        ('seal_header', None, None),
+        ('lazy_reader', 1000, None), ('lazy_reader', 1500, None),
+    ]
+    for r in results['results']:
+        assert r['amount'] == (1000 if r['benchmark'] == 'seal_header' else 3000)
+        assert r['seconds'] > 0 and r['peak_memory'] >= 0
+        if r.get('workers'):
+            assert r['speedup'] > 0
@@ -0,0 +1,39 @@
+import base64
+import json
+import sys
+import threading
+import time
+
+import pytest
+
+from tsdapiclient.broker import TokenBroker, broker_token, broker_token_manager
+
+
+def jwt(**claims):
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip('=')
+    return f'header.{payload}.signature'
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='requires Unix sockets')
+def test_broker(tmp_path):
+    calls = []
+    def authenticate(env, pnum, api_key, token_type):
+        calls.append((env, pnum, api_key, token_type))
+        return jwt(name=token_type, exp=time.time() + 3600, n=len(calls)), None
+    path = str(tmp_path / 'broker.sock')
+    server = TokenBroker(path, authenticate=authenticate).server()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        first = broker_token('test', 'p11', 'import', 'key', path=path)
+        assert broker_token('test', 'p11', 'import', 'key', path=path) == first
+        assert broker_token('test', 'p11', 'import', 'other-key', path=path) != first
+        assert len(calls) == 2
+        tokens = broker_token_manager('test', 'p11', 'import', 'key', path=path)
+        assert tokens.current() == first and tokens.refresh_token is None
+        assert tokens.refresh(force=True) == first
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert broker_token('test', 'p11', 'import', 'key', path=path) is None
+    assert broker_token('test', 'p11', 'import', 'key', path=str(tmp_path / 'none')) is None
@@ -0,0 +1,208 @@
+import base64
+import json
+import os
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+libnacl = pytest.importorskip('libnacl')
+
+from tsdapiclient import crypto
+
+
+class Response(object):
+
+    status_code = 200
+
+    def __init__(self, public_key):
+        self.text = json.dumps({'public_key': base64.b64encode(public_key).decode()})
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_DATA_HOME', str(tmp_path))
+    keys = [os.urandom(32), os.urandom(32)]
+    requests = []
+    class Server(object):
+        def get(self, url, headers):
+            requests.append(url)
+            return Response(keys[len(requests) - 1])
+    monkeypatch.setattr(crypto, 'http', Server())
+    return keys, requests
+
+
+def test_cached_public_key(server, monkeypatch):
+    keys, requests = server
+    first = crypto.nacl_get_server_public_key('test', 'p11', 'token')
+    assert first.pk == keys[0]
+    assert crypto.nacl_get_server_public_key('test', 'p11', 'token').pk == keys[0]
+    assert len(requests) == 1
+    crypto.invalidate_server_public_key('test', 'p11')
+    assert crypto.nacl_get_server_public_key('test', 'p11', 'token').pk == keys[1]
+    assert len(requests) == 2
+    assert crypto.read_cached_server_public_key('test', 'p11', ttl=0) is None
+
+
+def test_invalid_cached_public_key(server):
+    keys, requests = server
+    crypto.cache_server_public_key('test', 'p11', b'too short')
+    assert crypto.read_cached_server_public_key('test', 'p11') is None
+    assert crypto.nacl_get_server_public_key('test', 'p11', 'token').pk == keys[0]
+    assert len(requests) == 1
+
+
+@pytest.mark.parametrize('size', [1000, 3*1024*1024, 3*1024*1024 + 7])
+@pytest.mark.parametrize('read_ahead', [None, 0])
+def test_crypt_chunks(size, read_ahead):
+    nonce, key = crypto.nacl_gen_nonce(), crypto.nacl_gen_key()
+    chunks = [os.urandom(size) for _ in range(9)]
+    expected = [crypto.nacl_encrypt_data(chunk, nonce, key) for chunk in chunks]
+    crypted = crypto.nacl_crypt_chunks(chunks, nonce, key, workers=3, read_ahead=read_ahead)
+    assert list(crypted) == expected
+    crypted = crypto.nacl_crypt_chunks(expected, nonce, key, workers=3, read_ahead=read_ahead)
+    assert list(crypted) == chunks
+    assert list(crypto.nacl_crypt_chunks([], nonce, key)) == []
+
+
+def test_crypt_chunks_in_one_buffer():
+    nonce, key = crypto.nacl_gen_nonce(), crypto.nacl_gen_key()
+    chunks = [os.urandom(2*1024*1024) for _ in range(5)]
+    buffer = bytearray(len(chunks[0]))
+    def read():
+        for chunk in chunks:
+            buffer[:] = chunk
+            yield buffer
+    # without read-ahead, each chunk is taken after the last one was used
+    crypted = [
+        bytes(chunk) for chunk in crypto.nacl_crypt_chunks(read(), nonce, key, workers=4, read_ahead=0)
+    ]
+    assert crypted == [crypto.nacl_encrypt_data(chunk, nonce, key) for chunk in chunks]
+
+
+def test_crypto_workers():
+    assert crypto.crypto_workers(64*1024, workers=4) == 0
+    assert crypto.crypto_workers(4*1024*1024, workers=4) == 4
+    # large chunks are split among workers, rather than read ahead
+    assert crypto.crypto_workers(50*1024*1024, workers=4) == 4
+    assert crypto.crypto_read_ahead(4*1024*1024, workers=4) == 4
+    # the buffers of read_ahead + 1 chunks must fit CRYPTO_READ_AHEAD
+    assert crypto.crypto_read_ahead(16*1024*1024, workers=4) == 3
+    assert crypto.crypto_read_ahead(50*1024*1024, workers=4) == 0
+
+
+@pytest.mark.parametrize('read_ahead', [64*1024*1024, 1024*1024])
+def test_encrypted_lazy_reader(tmp_path, monkeypatch, read_ahead):
+    from tsdapiclient.fileapi import lazy_reader
+    monkeypatch.setattr(crypto, 'CRYPTO_READ_AHEAD', read_ahead)
+    chunksize = 1024*1024
+    # more chunks than buffers, which are read into again
+    data = os.urandom(9*chunksize + 7)
+    path = tmp_path / 'data'
+    path.write_bytes(data)
+    nonce, key = crypto.nacl_gen_nonce(), crypto.nacl_gen_key()
+    chunks = [
+        bytes(chunk) for chunk in lazy_reader(str(path), chunksize, public_key=True, nonce=nonce, key=key)
+    ]
+    assert [len(chunk) for chunk in chunks] == [chunksize] * 9 + [7]
+    assert b''.join(crypto.nacl_decrypt_data(chunk, nonce, key) for chunk in chunks) == data
+
+
+def test_crypt_into():
+    nonce, key = crypto.nacl_gen_nonce(), crypto.nacl_gen_key()
+    data = os.urandom(100000)
+    buffer = bytearray(data)
+    crypto.nacl_crypt_into(buffer, nonce, key)
+    assert buffer == crypto.nacl_encrypt_data(data, nonce, key)
+    # part of a larger buffer, leaving the rest as it was
+    buffer = bytearray(data)
+    crypto.nacl_crypt_into(memoryview(buffer)[10:1010], nonce, key)
+    assert buffer[10:1010] == crypto.nacl_encrypt_data(data[10:1010], nonce, key)
+    assert buffer[:10] == data[:10] and buffer[1010:] == data[1010:]
+    # in parts, at block boundaries
+    buffer = bytearray(data)
+    for start in range(0, len(data), 640):
+        crypto.nacl_crypt_into(memoryview(buffer)[start:start + 640], nonce, key, start // 64)
+    assert buffer == crypto.nacl_encrypt_data(data, nonce, key)
+    with pytest.raises(TypeError):
+        crypto.nacl_crypt_into(data, nonce, key)
+    chunks = [bytearray(data) for _ in range(3)]
+    assert [chunk is result for chunk, result in zip(chunks, crypto.nacl_crypt_chunks(chunks, nonce, key))] == [True]*3
+
+
+def test_frames():
+    from tsdapiclient.fileapi import _frames
+    chunks = [b'abc', b'', b'defgh', b'i']
+    assert list(_frames(chunks, 4)) == [b'abcd', b'efgh', b'i']
+    assert list(_frames(chunks, 3)) == [b'abc', b'def', b'ghi']
+    assert list(_frames([], 3)) == []
+
+
+class ExportHandler(BaseHTTPRequestHandler):
+
+    """Encrypts frames of Nacl-Chunksize, and sends them in uneven writes."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.server.data)))
+        self.send_header('Etag', 'etag')
+        self.end_headers()
+
+    def do_GET(self):
+        box = libnacl.sealed.SealedBox(self.server.secret_key)
+        nonce = box.decrypt(base64.b64decode(self.headers['Nacl-Nonce']))
+        key = box.decrypt(base64.b64decode(self.headers['Nacl-Key']))
+        size = int(self.headers['Nacl-Chunksize'])
+        self.server.frame_sizes.append(size)
+        data = self.server.data
+        body = b''.join(
+            crypto.nacl_encrypt_data(data[i:i + size], nonce, key)
+            for i in range(0, len(data), size)
+        )
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        for i in range(0, len(body), 777):
+            self.wfile.write(body[i:i + 777])
+            self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_encrypted_export_frames(tmp_path):
+    from tsdapiclient.fileapi import export_get
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ExportHandler)
+    server.secret_key = libnacl.public.SecretKey()
+    server.data = os.urandom(300001)
+    server.frame_sizes = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    try:
+        export_get(
+            'test', 'p11', 'data', 'token', chunksize=1000, nobar=True,
+            no_print_id=True, target_dir=str(tmp_path), dev_url=f'http://{host}:{port}/data',
+            public_key=libnacl.public.PublicKey(server.secret_key.pk), nacl_chunksize=64*1024,
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert server.frame_sizes == [64*1024]
+    assert (tmp_path / 'data').read_bytes() == server.data
+
+
+def test_encrypted_file_body_rewind(tmp_path):
+    from tsdapiclient.fileapi import FileBody
+    data = os.urandom(5*1024*1024)
+    path = tmp_path / 'data'
+    path.write_bytes(data)
+    nonce, key = crypto.nacl_gen_nonce(), crypto.nacl_gen_key()
+    body = FileBody(str(path), 1024*1024, public_key=True, nonce=nonce, key=key)
+    first = bytes(next(iter(body)))
+    body.rewind()
+    chunks = [bytes(chunk) for chunk in body]
+    assert chunks[0] == first
+    assert b''.join(crypto.nacl_decrypt_data(chunk, nonce, key) for chunk in chunks) == data
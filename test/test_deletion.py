@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+import requests
+
+from tsdapiclient.deletion import (BulkDeleter, DeletionError, collapse,
+                                   count_subtrees)
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.exceptions.HTTPError(response=response)
+
+
+def test_collapse():
+    target = ['d/a/1', 'd/a/2', 'd/a/b/3', 'd/c/4', 'd/c/5', 'd/6']
+    deletes = ['d/a/1', 'd/a/2', 'd/a/b/3', 'd/c/4', 'd/6']
+    assert collapse(deletes, count_subtrees(target), root='d') == ['d/a', 'd/c/4', 'd/6']
+    # the root itself is never collapsed
+    assert collapse(target, count_subtrees(target), root='d') == ['d/a', 'd/c', 'd/6']
+    assert collapse(deletes[3:], count_subtrees(target), root='d') == ['d/c/4', 'd/6']
+    # a directory keeps a new file while all of its old files are deleted
+    kept = {'d/a/b', 'd/a', 'd'}
+    assert collapse(deletes, count_subtrees(target), root='d', keep=kept) == deletes
+
+
+def test_bulk_deleter():
+    attempts = {}
+    lock = threading.Lock()
+    def delete(resource):
+        with lock:
+            attempts[resource] = attempts.get(resource, 0) + 1
+        if resource == 'flaky' and attempts[resource] < 3:
+            raise http_error(503)
+        if resource == 'forbidden':
+            raise http_error(403)
+        if resource == 'gone':
+            raise http_error(404)
+    done = []
+    deleter = BulkDeleter(
+        delete, workers=4, backoff=0, on_done=done.append, show_progress=False,
+    )
+    resources = [f'file{i}' for i in range(50)] + ['flaky']
+    assert sorted(deleter.run(resources)) == sorted(resources)
+    assert sorted(done) == sorted(resources)
+    assert attempts['flaky'] == 3
+    with pytest.raises(DeletionError):
+        deleter.run(['file0', 'forbidden'])
+    assert attempts['forbidden'] == 1
+    # resources which no longer exist count as deleted
+    assert deleter.run(['gone']) == ['gone']
+    assert attempts['gone'] == 1
@@ -0,0 +1,46 @@
+from tsdapiclient.ignore import IgnoreRules
+
+
+def test_prefixes_and_suffixes():
+    rules = IgnoreRules.from_options(prefixes='.git,build', suffixes='.pyc,.db')
+    assert rules.can_prune('.git')
+    assert rules.can_prune('build2')
+    assert rules.can_prune('build/sub')
+    assert not rules.can_prune('src')
+    assert not rules.can_prune('src/.git') # prefixes are relative to the root
+    assert not rules.ignores('build.txt') # prefixes only apply to directories
+    assert rules.ignores('src/module.pyc')
+    assert not rules.ignores('src/module.py')
+    assert not rules.can_prune('cache.db') # suffixes only apply to files
+
+
+def test_gitignore_patterns():
+    rules = IgnoreRules(patterns=['*.tmp', 'logs/', '/top.txt', 'docs/**/*.pdf', 'file?.[ch]'])
+    assert rules.ignores('a.tmp')
+    assert rules.ignores('deep/down/a.tmp')
+    assert rules.can_prune('logs')
+    assert rules.can_prune('sub/logs')
+    assert not rules.ignores('logs') # a file named logs
+    assert rules.ignores('top.txt')
+    assert not rules.ignores('sub/top.txt')
+    assert rules.ignores('docs/a.pdf')
+    assert rules.ignores('docs/x/y/a.pdf')
+    assert not rules.ignores('other/a.pdf')
+    assert rules.ignores('file1.c')
+    assert not rules.ignores('file10.c')
+
+
+def test_negation():
+    rules = IgnoreRules(patterns=['build/*', '!build/keep.txt', '*.log', '!important.log'])
+    assert not rules.can_prune('build')
+    assert rules.ignores('build/out.o')
+    assert not rules.ignores('build/keep.txt')
+    assert rules.ignores('debug.log')
+    assert not rules.ignores('important.log')
+
+
+def test_no_rules():
+    rules = IgnoreRules.from_options()
+    assert not rules
+    assert not rules.ignores('anything')
+    assert not rules.ignores('', is_dir=True)
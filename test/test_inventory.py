@@ -0,0 +1,90 @@
+import os
+import random
+
+import pytest
+
+from tsdapiclient import inventory
+from tsdapiclient.inventory import (CompactInventory, ExternalSorter,
+                                    diff_sorted, needs_transfer)
+
+
+def test_external_sorter_spills_and_merges():
+    entries = [(f'dir/file{i}', float(i), i) for i in range(5000)]
+    shuffled = entries[:]
+    random.shuffle(shuffled)
+    with ExternalSorter(memory_budget=300) as sorter:
+        sorter.extend(shuffled)
+        assert len(sorter.runs) > 1
+        assert list(sorter) == sorted(entries)
+    assert not sorter.runs
+
+
+def test_numeric_mtime_comparison():
+    # string comparison would consider '9.5' newer than '10.1'
+    assert not needs_transfer(('f', '9.5'), ('f', '10.1'), keep_updated=True)
+    assert needs_transfer(('f', '10.1'), ('f', '9.5'), keep_updated=True)
+    # formatting differences do not cause transfers
+    assert not needs_transfer(('f', 1700000000.25), ('f', '1700000000.2500002'))
+    assert needs_transfer(('f', 10.0, 5), ('f', '10.0', 6))
+    assert needs_transfer(('f', 'etag-a'), ('f', 'etag-b'))
+    assert needs_transfer(('f', 12.0), ('f', 'None'), keep_updated=True)
+
+
+def test_diff_sorted():
+    source = [('file1', 10), ('file2', 20), ('file3', 15), ('file4', 89)]
+    target = [('file0', 32), ('file1', 10), ('file2', 10), ('file3', 18)]
+    actions = list(diff_sorted(source, target))
+    assert actions == [
+        ('delete', 'file0'),
+        ('transfer', 'file2'),
+        ('transfer', 'file3'),
+        ('transfer', 'file4'),
+    ]
+    actions = list(diff_sorted(source, target, keep_missing=True, keep_updated=True))
+    assert actions == [('transfer', 'file2'), ('transfer', 'file4')]
+
+
+def test_compact_inventory():
+    inventory = CompactInventory().extend([
+        ('top/a/file1', 10.5, 3),
+        ('top/a/file2', None, None),
+        ('top/b', 'etag', 7),
+    ])
+    assert len(inventory) == 3
+    assert inventory.directories == ['top/a/', 'top/']
+    assert list(inventory) == [
+        ('top/a/file1', 10.5, 3),
+        ('top/a/file2', None, None),
+        ('top/b', 'etag', 7),
+    ]
+
+
+
+def test_compact_inventory_undecodable_names():
+    # as os.scandir returns names which are not valid UTF-8
+    path = 'top/' + os.fsdecode(b'caf\xe9.txt')
+    inventory = CompactInventory().extend([(path, 1.0, 2)])
+    assert list(inventory) == [(path, 1.0, 2)]
+    changes, missing = CompactInventory().diff(inventory)
+    assert (changes, missing) == ([], [path])
+
+
+@pytest.mark.parametrize('numpy_available', [True, False])
+def test_compact_inventory_diff(monkeypatch, numpy_available):
+    if numpy_available and not inventory.NUMPY_AVAILABLE:
+        pytest.skip('numpy not installed')
+    monkeypatch.setattr(inventory, 'NUMPY_AVAILABLE', numpy_available)
+    source = CompactInventory().extend([
+        ('d/file1', 10, 1), ('d/file2', '20', 1), ('d/file3', 15, 1),
+        ('d/file4', 89, 1), ('d/file5', 5, 1), ('d/file6', 'b', 1),
+    ])
+    target = CompactInventory().extend([
+        ('d/file0', 32, 1), ('d/file1', '10.0000001', 1), ('d/file2', 10, 1),
+        ('d/file3', 18, 1), ('d/file5', 5, 2), ('d/file6', 'a', 1),
+    ])
+    transfers, deletes = source.diff(target)
+    assert sorted(transfers) == ['d/file2', 'd/file3', 'd/file4', 'd/file5', 'd/file6']
+    assert deletes == ['d/file0']
+    transfers, deletes = source.diff(target, keep_missing=True, keep_updated=True)
+    assert sorted(transfers) == ['d/file2', 'd/file4', 'd/file5', 'd/file6']
+    assert deletes == []
@@ -0,0 +1,165 @@
+import os
+import socket
+import threading
+
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from tsdapiclient.deletion import BulkDeleter
+from tsdapiclient.fileapi import FileBody, _start_resumable
+from tsdapiclient.retry import RetryBudget, RetryPolicy, RetryingSession
+from tsdapiclient.tools import Retry
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    """Answers with the next of the server's statuses, and then 200."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding') != 'chunked':
+            return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        body = b''
+        while True:
+            size = int(self.rfile.readline(), 16)
+            body += self.rfile.read(size)
+            self.rfile.readline()
+            if not size:
+                return body
+
+    def respond(self):
+        self.server.requests.append((self.command, self.client_address, self.read_body()))
+        status, headers = self.server.statuses.pop(0) if self.server.statuses else (200, {})
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = respond
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.requests, server.statuses = [], []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    server.url = f'http://{host}:{port}/'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def policy(sleeps, **options):
+    return RetryPolicy(backoff=0.01, sleep=sleeps.append, **options)
+
+
+def test_retries_on_one_connection(server):
+    sleeps = []
+    server.statuses = [(503, {'Retry-After': '2'}), (504, {})]
+    session = RetryingSession(policy(sleeps))
+    resp = session.get(server.url)
+    assert resp.status_code == 200
+    assert len(server.requests) == 3
+    assert len({client for _, client, _ in server.requests}) == 1
+    assert sleeps[0] == 2 and 0 <= sleeps[1] <= 0.02
+
+
+def test_method_rules(server):
+    sleeps = []
+    session = RetryingSession(policy(sleeps))
+    server.statuses = [(500, {})]
+    assert session.post(server.url, data=b'x').status_code == 500
+    server.statuses = [(429, {'Retry-After': formatdate(usegmt=True)})]
+    assert session.post(server.url, data=b'x').status_code == 200
+    server.statuses = [(429, {'Retry-After': '3600'})]
+    assert session.post(server.url, data=b'x').status_code == 429
+    assert len(server.requests) == 4
+    # a generator body cannot be sent again
+    server.statuses = [(503, {})]
+    assert session.post(server.url, data=iter([b'x'])).status_code == 503
+    assert len(sleeps) == 1
+
+
+def test_retry_budget(server):
+    sleeps = []
+    session = RetryingSession(policy(sleeps, budget=RetryBudget(capacity=2, ratio=0)))
+    server.statuses = [(503, {})]*5
+    assert session.get(server.url).status_code == 503
+    assert len(server.requests) == 3
+
+
+def test_connection_errors():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    url = 'http://127.0.0.1:{0}/'.format(sock.getsockname()[1])
+    sock.close()
+    sleeps = []
+    session = RetryingSession(policy(sleeps, attempts=3))
+    with pytest.raises(requests.ConnectionError):
+        session.get(url)
+    assert len(sleeps) == 2
+    with pytest.raises(requests.ConnectionError):
+        session.post(url, data=b'x')
+    assert len(sleeps) == 2
+
+
+def test_retry_context(server):
+    sleeps = []
+    session = RetryingSession(policy(sleeps))
+    server.statuses = [(500, {}), (502, {})]
+    with Retry(session.patch, server.url, {}, b'chunk', counter=2, retry=True) as retriable:
+        assert retriable['resp'].status_code == 502
+    with Retry(session.patch, server.url, {}, b'chunk', retry=True) as retriable:
+        assert retriable['resp'].status_code == 200
+    # PATCH is not idempotent, unless the caller says so
+    server.statuses = [(500, {})]
+    with Retry(session.patch, server.url, {}, b'chunk') as retriable:
+        assert retriable['resp'].status_code == 500
+    assert [body for _, _, body in server.requests] == [b'chunk']*4
+
+
+def test_file_body(tmp_path, server):
+    data = os.urandom(10000)
+    path = tmp_path / 'data'
+    path.write_bytes(data)
+    body = FileBody(str(path), 1000, offset=500)
+    assert next(iter(body)) == data[500:1500]
+    body.rewind()
+    assert b''.join(body) == data[500:]
+    # a streamed upload, failing after it was sent, is sent again in full
+    server.statuses = [(503, {})]
+    session = RetryingSession(policy([]))
+    with Retry(session.put, server.url, {}, FileBody(str(path), 1000)) as retriable:
+        assert retriable['resp'].status_code == 200
+    assert [body for _, _, body in server.requests] == [data, data]
+
+
+def test_first_chunk_not_retried(tmp_path, server):
+    path = tmp_path / 'data'
+    path.write_bytes(os.urandom(1000))
+    # the first chunk may have started an upload, before its response was lost
+    server.statuses = [(500, {})]
+    session = RetryingSession(policy([]))
+    with pytest.raises(SystemExit):
+        _start_resumable('test', 'p11', str(path), 'token', 500, dev_url=server.url, session=session)
+    assert [method for method, _, _ in server.requests] == ['PATCH']
+
+
+def test_retried_delete(server):
+    # the first attempt deleted the resource, but its response was lost
+    server.statuses = [(500, {}), (404, {})]
+    session = RetryingSession(policy([]))
+    def delete(resource):
+        session.delete(server.url + resource).raise_for_status()
+    assert BulkDeleter(delete, show_progress=False).run(['file']) == ['file']
+    assert [method for method, _, _ in server.requests] == ['DELETE', 'DELETE']
@@ -0,0 +1,46 @@
+import pytest
+
+from tsdapiclient.scheduler import (TransferScheduler, read_throughput,
+                                    record_throughput)
+
+INFO = {
+    'a': (500, 1.0),
+    'b': (10, 3.0),
+    'c': (None, None),
+    'd': (2000, 2.0),
+    'e': (20, 4.0),
+    'f': (1500, 5.0),
+}
+RESOURCES = [(name, None) for name in INFO]
+
+
+def describe(resource):
+    return INFO[resource]
+
+
+@pytest.mark.parametrize('policy,expected', [
+    ('scan', 'abcdef'),
+    ('small-first', 'beafdc'),
+    ('largest-first', 'dfaebc'),
+    ('newest-first', 'febdac'),
+    ('mixed', 'fbeacd'),
+])
+def test_scheduler_order(policy, expected):
+    scheduler = TransferScheduler(policy, large_threshold=1000)
+    ordered = scheduler.order(RESOURCES, describe)
+    assert ''.join(name for name, _ in ordered) == expected
+
+
+def test_scheduler_plan(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_DATA_HOME', str(tmp_path))
+    assert read_throughput('test', 'p11', 'upload') is None
+    record_throughput('test', 'p11', 'upload', 1000*1000*100, 10)
+    throughput = read_throughput('test', 'p11', 'upload')
+    assert throughput == 1000*1000*10
+    plan = TransferScheduler('mixed', large_threshold=1000).plan(
+        RESOURCES, describe, deletes=2, throughput=throughput / 1000*1000,
+    )
+    assert '6 files, 4.03 KB (1 files of unknown size)' in plan
+    assert 'large lane: 2 files, 3.5 KB, small lane: 4 files, 530 bytes' in plan
+    assert '2 resources to delete' in plan
+    assert 'estimated time' in plan
@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+import time
+
+# modules which only actions that need them should import, checked
+# rather than import times, which vary between machines
+HEAVY_MODULES = [
+    'requests', 'rich', 'numpy', 'yaml', 'libnacl', 'humanfriendly',
+    'tsdapiclient.tools', 'tsdapiclient.authapi', 'tsdapiclient.fileapi',
+    'tsdapiclient.sync', 'tsdapiclient.batch',
+]
+STARTUP_RATIO = 3 # times the startup of a bare interpreter, at most, for tacl --help
+STARTUP_RUNS = 5 # runs per command, of which the fastest is compared
+
+
+def run(code, **env):
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        capture_output=True, text=True, check=True,
+        env=dict(os.environ, **env),
+    )
+    return result.stdout, result.stderr
+
+
+def loaded_after(code):
+    stdout, _ = run(f'{code}\nimport sys\nprint(" ".join(sys.modules))')
+    return [m for m in HEAVY_MODULES if m in stdout.split()]
+
+
+def test_light_startup():
+    assert loaded_after('import tsdapiclient.tacl') == []
+    for args in (['--version'], ['--guide', 'sync'], []):
+        assert loaded_after(
+            'from tsdapiclient.tacl import cli\n'
+            f'cli({args!r}, standalone_mode=False)'
+        ) == []
+    assert loaded_after(
+        'from tsdapiclient.tacl import get_dir_contents\n'
+        'get_dir_contents(None, [], "")'
+    ) == []
+
+
+def startup(*args):
+    """The fastest of STARTUP_RUNS runs of python with args, in seconds."""
+    timings = []
+    for _ in range(STARTUP_RUNS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], capture_output=True, check=True)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def test_startup_time():
+    # relative to a bare interpreter, on the same machine, so that
+    # only heavy imports, which take several times as long, fail it
+    baseline = startup('-c', 'pass')
+    assert startup('-m', 'tsdapiclient.tacl', '--help') < STARTUP_RATIO * baseline
+
+
+def test_no_config_on_import(tmp_path):
+    run(
+        'import tsdapiclient.configurer, tsdapiclient.session',
+        XDG_CONFIG_HOME=str(tmp_path),
+    )
+    assert not (tmp_path / 'tacl').exists()
@@ -0,0 +1,47 @@
+import multiprocessing
+import os
+import sys
+
+import pytest
+
+from tsdapiclient.store import YamlStore, store_for
+
+
+def increment(path, times):
+    store = YamlStore(path)
+    for _ in range(times):
+        store.update(lambda data: {'count': (data or {}).get('count', 0) + 1})
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='requires fcntl')
+def test_concurrent_updates(tmp_path):
+    path = str(tmp_path / 'session')
+    workers = [
+        multiprocessing.Process(target=increment, args=(path, 25)) for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert store_for(path).read() == {'count': 100}
+    assert oct(os.stat(path).st_mode & 0o777) == oct(0o600)
+    assert [name for name in os.listdir(tmp_path) if name.startswith('.')] == []
+
+
+def test_cached_reads(tmp_path):
+    path = tmp_path / 'config'
+    path.write_text('prod:\n  p11: key\n')
+    store = store_for(str(path))
+    data = store.read()
+    assert data == {'prod': {'p11': 'key'}}
+    # callers get copies
+    data['prod']['p11'] = 'changed'
+    signature = store.signature
+    assert store.read() == {'prod': {'p11': 'key'}}
+    assert store.signature == signature
+    # changes by other processes are seen
+    path.write_text('prod:\n  p11: new-key\n')
+    os.utime(path, ns=(0, 0))
+    assert store.read() == {'prod': {'p11': 'new-key'}}
+    with pytest.raises(FileNotFoundError):
+        store_for(str(tmp_path / 'missing')).read()
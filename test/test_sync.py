@@ -0,0 +1,205 @@
+import os
+import sqlite3
+
+import pytest
+import requests
+
+from tsdapiclient.sync import (CacheError, SerialDirectoryDownloadSynchroniser,
+                               SerialDirectoryUploader, SerialDirectoryUploadSynchroniser,
+                               UploadCache, shard_of)
+
+
+@pytest.fixture
+def data_home(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_DATA_HOME', str(tmp_path))
+    return tmp_path
+
+
+def test_cache_journal(data_home):
+    cache = UploadCache('test', 'p11')
+    cache.create(key='mydir')
+    cache.add_many(key='mydir', items=[(f"mydir/file'{i}", None) for i in range(5)])
+    first = cache.claim(key='mydir', limit=2, worker='a')
+    second = cache.claim(key='mydir', limit=2, worker='b')
+    assert [r[0] for r in first] == ["mydir/file'0", "mydir/file'1"]
+    assert [r[0] for r in second] == ["mydir/file'2", "mydir/file'3"]
+    cache.progress(key='mydir', item="mydir/file'2", upload_id='abc', offset=1000)
+    cache.complete(key='mydir', item="mydir/file'0")
+    cache.fail(key='mydir', item="mydir/file'1")
+    summary = cache.summary(key='mydir')
+    assert summary == {'pending': 1, 'in-flight': 2, 'done': 1, 'failed': 1, 'committed': 1000}
+    # simulate a new run, after a crash
+    cache = UploadCache('test', 'p11')
+    assert cache.requeue(key='mydir') == 3
+    assert len(cache.read(key='mydir')) == 4
+    claimed = cache.claim(key='mydir', limit=10)
+    assert ("mydir/file'2", None, 'abc', 1000) in claimed
+    assert cache.overview()[0][0] == 'mydir'
+
+
+def test_cache_migration(data_home):
+    cache = UploadCache('test', 'p11')
+    with cache.engine:
+        cache.engine.execute(
+            'create table "old"(resource_path text not null unique, \
+             created_at timestamp default current_timestamp, integrity_reference text)'
+        )
+        cache.engine.execute('insert into "old"(resource_path) values (?)', ('old/file',))
+    cache.create(key='old')
+    assert cache.claim(key='old') == [('old/file', None, None, 0)]
+
+
+def test_shared_queue(tmp_path):
+    node_a = UploadCache('test', 'p11', directory=str(tmp_path))
+    node_b = UploadCache('test', 'p11', directory=str(tmp_path))
+    node_a.create(key='mydir')
+    assert node_a.begin_plan(key='mydir', worker='a', lease=60) == 'plan'
+    assert node_b.begin_plan(key='mydir', worker='b', lease=60) == 'wait'
+    node_a.add_many(key='mydir', items=[(f'mydir/file{i}', None) for i in range(4)])
+    node_a.finish_plan(key='mydir', worker='a')
+    assert node_b.begin_plan(key='mydir', worker='b', lease=60) == 'ready'
+    assert len(node_a.claim(key='mydir', limit=2, worker='a', lease=60)) == 2
+    # b's claims expire, unless renewed
+    assert len(node_b.claim(key='mydir', limit=2, worker='b', lease=-1)) == 2
+    assert node_a.renew(key='mydir', worker='a', lease=60) == 2
+    assert node_a.recover(key='mydir') == 2
+    reclaimed = node_a.claim(key='mydir', limit=10, worker='a', lease=60)
+    assert [r[0] for r in reclaimed] == ['mydir/file2', 'mydir/file3']
+    for i in range(3):
+        node_a.complete(key='mydir', item=f'mydir/file{i}')
+    assert not node_a.finish(key='mydir')
+    node_a.complete(key='mydir', item='mydir/file3')
+    assert node_a.finish(key='mydir')
+    assert node_b.finish(key='mydir')
+    # the next run plans again
+    assert node_b.begin_plan(key='mydir', worker='b', lease=60) == 'plan'
+    assert node_a.overview() == []
+
+
+def test_shared_plan_takeover(tmp_path):
+    node_a = UploadCache('test', 'p11', directory=str(tmp_path))
+    node_a.create(key='mydir')
+    assert node_a.begin_plan(key='mydir', worker='a', lease=-1) == 'plan'
+    # a stopped planning, without renewing its lease
+    assert node_a.begin_plan(key='mydir', worker='b', lease=60) == 'plan'
+    with pytest.raises(CacheError):
+        node_a.finish_plan(key='mydir', worker='a')
+
+
+def test_shared_sync(tmp_path, data_home, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'mydir').mkdir()
+    for i in range(3):
+        (tmp_path / 'mydir' / f'file{i}').write_text('data')
+    (tmp_path / 'queue').mkdir()
+    transferred = []
+
+    class Uploader(SerialDirectoryUploader):
+        def _transfer(self, resource, integrity_reference=None, upload_id=None):
+            transferred.append((self.worker, resource))
+            return resource
+
+    uploader = Uploader('test', 'p11', 'mydir', 'token', queue_dir=str(tmp_path / 'queue'))
+    uploader.worker = 'a'
+    assert uploader.sync()
+    assert sorted(transferred) == [('a', f'mydir/file{i}') for i in range(3)]
+    # the queue is removed, once all work is done
+    assert uploader.transfer_cache.overview() == []
+
+
+def test_sharded_sync_lists(data_home):
+    source = [(f'mydir/sub/keep{i}', 10) for i in range(20)] + [('mydir/new', 20)]
+    target = [(f'mydir/sub/keep{i}', 10) for i in range(20)] + [('mydir/sub/old', 5)]
+    target += [(f'mydir/gone/file{i}', 5) for i in range(20)]
+    transfers, deletes = set(), set()
+    for k in (1, 2, 3):
+        syncer = SerialDirectoryUploadSynchroniser(
+            'test', 'p11', 'mydir', 'token', shard=(k, 3), sync_mtime=True, use_cache=False,
+        )
+        assert syncer.cache_key == f'mydir.shard-{k}-of-3'
+        shard_transfers, shard_deletes = syncer._find_sync_lists(source=source, target=target)
+        assert not transfers & {r for r, _ in shard_transfers}
+        assert not deletes & {r for r, _ in shard_deletes}
+        transfers.update(r for r, _ in shard_transfers)
+        deletes.update(r for r, _ in shard_deletes)
+    assert transfers == {'mydir/new'}
+    # directories with resources in several shards are not deleted as a whole
+    assert deletes == {'mydir/sub/old'} | {f'mydir/gone/file{i}' for i in range(20)}
+    assert shard_of('sub/keep1', 3) == shard_of('sub/keep1', 3)
+
+
+def test_sync_lists_keep_new(data_home):
+    # a directory keeps a new file while all of its old files are deleted
+    syncer = SerialDirectoryUploadSynchroniser('test', 'p11', 'mydir', 'token', use_cache=False)
+    transfers, deletes = syncer._find_sync_lists(
+        source=[('mydir/a/new', 10)], target=[('mydir/a/old', 10), ('mydir/b/old', 10)],
+    )
+    assert transfers == [('mydir/a/new', None)]
+    assert deletes == [('mydir/a/old', None), ('mydir/b', None)]
+
+
+def test_sync_lists_undecodable_names(tmp_path, data_home, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'mydir').mkdir()
+    (tmp_path / 'mydir' / 'ok.txt').write_text('data')
+    with open(os.path.join(b'mydir', b'caf\xe9.txt'), 'w') as f:
+        f.write('data')
+    name = 'mydir/' + os.fsdecode(b'caf\xe9.txt')
+    syncer = SerialDirectoryUploadSynchroniser('test', 'p11', 'mydir', 'token', use_cache=False)
+    transfers, deletes = syncer._find_sync_lists(
+        source=syncer._iter_local_resources('mydir'), target=[('mydir/ok.txt', None)],
+    )
+    assert transfers == [(name, None)]
+    assert deletes == []
+
+
+def test_sync_lists_keep_ignored(tmp_path, data_home, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'mydir' / 'a' / 'build').mkdir(parents=True)
+    (tmp_path / 'mydir' / 'a' / 'file.txt').write_text('data')
+    (tmp_path / 'mydir' / 'a' / 'build' / 'keep').write_text('data')
+    (tmp_path / 'ignore').write_text('build/\n')
+    syncer = SerialDirectoryDownloadSynchroniser(
+        'test', 'p11', 'mydir', 'token', ignore_file=str(tmp_path / 'ignore'), use_cache=False,
+    )
+    _, deletes = syncer._find_sync_lists(
+        source=[('mydir/other.txt', 10)], target=syncer._iter_local_resources('mydir'),
+    )
+    # not mydir/a, which still holds an ignored file
+    assert deletes == [('mydir/a/file.txt', None)]
+
+
+def test_resume_replays_deletes(tmp_path, data_home, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'mydir').mkdir()
+    deleted = []
+
+    class Synchroniser(SerialDirectoryUploadSynchroniser):
+        def _transfer(self, resource, integrity_reference=None, upload_id=None):
+            return resource
+        def _delete(self, resource, raise_errors=False):
+            deleted.append(resource)
+            # deleted before a crash, without the cache recording it
+            response = requests.Response()
+            response.status_code = 404
+            raise requests.exceptions.HTTPError(response=response)
+
+    syncer = Synchroniser('test', 'p11', 'mydir', 'token', use_cache=True)
+    syncer.transfer_cache.add_many(key=syncer.cache_key, items=[('mydir/new', None)])
+    syncer.delete_cache.add_many(key=syncer.cache_key, items=[('mydir/old', None)])
+    assert syncer.sync()
+    assert deleted == ['mydir/old']
+    assert syncer.delete_cache.overview() == []
+
+
+@pytest.mark.parametrize('directory', ['mydir', 'mydir/'])
+def test_local_resources_ignored(tmp_path, data_home, monkeypatch, directory):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'mydir' / 'sub').mkdir(parents=True)
+    (tmp_path / 'mydir' / 'sub' / 'a.log').write_text('data')
+    (tmp_path / 'mydir' / 'sub' / 'b.txt').write_text('data')
+    (tmp_path / 'ignore').write_text('sub/a.log\n')
+    syncer = SerialDirectoryUploader(
+        'test', 'p11', directory, 'token', ignore_file=str(tmp_path / 'ignore'), use_cache=False,
+    )
+    assert [r for r, _, _ in syncer._iter_local_resources(directory)] == ['mydir/sub/b.txt']
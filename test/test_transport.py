@@ -0,0 +1,54 @@
+import socket
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tsdapiclient.tools import has_api_connectivity
+from tsdapiclient.transport import Transport, configure, http
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.clients.append(self.client_address)
+        body = b'{}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+def test_shared_connections():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.clients = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    configure()
+    try:
+        assert has_api_connectivity(host, port=port, schema='http')
+        http.get(f'http://{host}:{port}/')
+        http.post(f'http://{host}:{port}/', data=b'data')
+        # the connectivity check, and the requests after it, use one connection
+        assert len(server.clients) == 3
+        assert len(set(server.clients)) == 1
+    finally:
+        configure()
+        server.shutdown()
+        server.server_close()
+
+
+def test_socket_options():
+    options = Transport(socket_buffer_size=1024*1024).socket_options()
+    assert (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) in options
+    assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in options
+    assert (socket.SOL_SOCKET, socket.SO_SNDBUF, 1024*1024) in options
+    options = Transport(nodelay=False, keepalive=False).socket_options()
+    assert not [option for option in options if option[1] in (socket.TCP_NODELAY, socket.SO_KEEPALIVE)]
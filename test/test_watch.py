@@ -0,0 +1,120 @@
+import sys
+import time
+
+import pytest
+
+from tsdapiclient.ignore import IgnoreRules
+from tsdapiclient.sync import SerialDirectoryUploadSynchroniser
+from tsdapiclient.watch import DirectoryWatcher, RemotePoller
+
+
+class FakeTransporter(object):
+
+    def __init__(self, directory, keep_missing=False):
+        self.directory = directory
+        self.keep_missing = keep_missing
+        self.ignore_rules = IgnoreRules.from_options(patterns='*.tmp,cache/')
+
+
+def drain(watcher):
+    for _ in range(5):
+        events = watcher.inotify.read(timeout=0.2)
+        if not events:
+            break
+        for wd, mask, _, name in events:
+            watcher._handle(wd, mask, name)
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='requires inotify')
+def test_watcher_collects_changes(tmp_path):
+    root = tmp_path / 'mydir'
+    (root / 'cache').mkdir(parents=True)
+    (root / 'old').write_text('old')
+    watcher = DirectoryWatcher(FakeTransporter(str(root)), settle=1)
+    watcher._watch_tree(watcher.root)
+    watcher.remote = {f'{root}/old'}
+    assert len(watcher.watches) == 1
+    (root / 'file1').write_text('data')
+    (root / 'file2.tmp').write_text('data')
+    (root / 'cache' / 'file3').write_text('data')
+    (root / 'sub').mkdir()
+    (root / 'sub' / 'file4').write_text('data')
+    (root / 'old').unlink()
+    # never transferred, so not deleted remotely
+    (root / 'file5.tmp').write_text('data')
+    (root / 'file5.tmp').rename(root / 'file5')
+    (root / 'file5').unlink()
+    drain(watcher)
+    now = time.monotonic()
+    assert watcher._ready(now) == []
+    assert watcher._ready(now + 1) == [f'{root}/file1', f'{root}/sub/file4']
+    assert watcher.deleted == {f'{root}/old'}
+    assert not watcher.changed
+    watcher.inotify.close()
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='requires inotify')
+def test_watcher_normalises_root(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_DATA_HOME', str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'mydir').mkdir()
+    (tmp_path / 'mydir' / 'old').write_text('old')
+    transporter = SerialDirectoryUploadSynchroniser('test', 'p11', './mydir', 'token', use_cache=False)
+    transporter.sync = lambda: True
+    watcher = DirectoryWatcher(transporter, settle=1)
+    watcher._watch_tree(watcher.root)
+    watcher._reconcile()
+    # event paths match those of the resources known to be remote
+    assert watcher.remote == {'mydir/old'}
+    (tmp_path / 'mydir' / 'old').unlink()
+    drain(watcher)
+    assert watcher.deleted == {'mydir/old'}
+    watcher.inotify.close()
+
+
+class FakeRemote(object):
+
+    integrity_reference_key = 'mtime'
+
+    def __init__(self, tree, directory='mydir'):
+        self.directory = directory
+        self.tree = tree
+        self.listed = []
+
+    def _list_remote_directory(self, path):
+        self.listed.append(path)
+        for name, value in self.tree[path].items():
+            ref = f'{path}/{name}'
+            if isinstance(value, dict):
+                yield ref, True, {'mtime': value['mtime']}
+            else:
+                yield ref, False, {'mtime': value, 'size': 1}
+
+
+def test_poller_snapshots():
+    tree = {
+        'mydir': {'file1': 1.0, 'sub': {'mtime': 5.0}, 'leaf': {'mtime': 6.0}},
+        'mydir/sub': {'file2': 2.0, 'deeper': {'mtime': 7.0}},
+        'mydir/sub/deeper': {'file3': 3.0},
+        'mydir/leaf': {'file4': 4.0},
+    }
+    remote = FakeRemote(tree)
+    poller = RemotePoller(remote)
+    assert RemotePoller(FakeRemote(tree, directory='./mydir/')).root == poller.root == 'mydir'
+    changed, removed = poller.poll()
+    assert sorted(changed) == [
+        'mydir/file1', 'mydir/leaf/file4', 'mydir/sub/deeper/file3', 'mydir/sub/file2'
+    ]
+    assert removed == []
+    # unchanged leaf directories are not listed again
+    remote.listed = []
+    assert poller.poll() == ([], [])
+    assert remote.listed == ['mydir', 'mydir/sub']
+    # changes deep in the tree are found via directory mtimes
+    tree['mydir/sub/deeper'] = {'file5': 8.0}
+    tree['mydir/sub']['deeper'] = {'mtime': 8.0}
+    tree['mydir']['file1'] = 9.0
+    del tree['mydir']['leaf']
+    changed, removed = poller.poll()
+    assert sorted(changed) == ['mydir/file1', 'mydir/sub/deeper/file5']
+    assert sorted(removed) == ['mydir/leaf/file4', 'mydir/sub/deeper/file3']
@@ -0,0 +1,355 @@
+"""A long-running transfer agent, with a persistent queue of jobs."""
+
+import json
+import os
+import socketserver
+import sqlite3
+import threading
+import time
+
+from typing import Callable, Optional
+
+import click
+
+try:
+    from tsdapiclient.crypto import nacl_get_server_public_key
+    LIBSODIUM_AVAILABLE = True
+except OSError:
+    LIBSODIUM_AVAILABLE = False
+
+from tsdapiclient.authapi import TokenManager
+from tsdapiclient.batch import (BatchJob, BatchRunner, ManifestError,
+                                load_manifest, make_job, paths_overlap)
+from tsdapiclient.broker import (peer_is_owner, token_is_valid,
+                                 unix_request, unix_server)
+from tsdapiclient.client_config import AGENT_CONCURRENCY
+from tsdapiclient.sync import sqlite_session
+from tsdapiclient.tools import debug_step, get_config_path, get_data_path
+
+AGENT_SPOOL_POLL = 5 # seconds between scans of the spool directory
+JOB_STATES = ['pending', 'running', 'done', 'failed']
+
+
+class AgentError(Exception):
+    pass
+
+
+def agent_socket_path(env: str, pnum: str) -> str:
+    return os.environ.get('TACL_AGENT_SOCKET') or f'{get_config_path()}/agent-{env}-{pnum}.sock'
+
+
+def agent_queue_path(env: str, pnum: str) -> str:
+    return f'{get_data_path(env, pnum)}/agent.db'
+
+
+class JobQueue(object):
+
+    """
+    Transfer jobs, kept in sqlite, so that they survive restarts.
+
+    Pending jobs are started in order of priority, highest first,
+    and otherwise in the order in which they were added. Jobs which
+    were running when the agent stopped are pending again, after
+    recover.
+
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.engine = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.engine.execute('pragma journal_mode=wal')
+        self.lock = threading.Lock()
+        with self.lock, sqlite_session(self.engine) as session:
+            session.execute(
+                """create table if not exists jobs(
+                    id integer primary key autoincrement,
+                    kind text not null,
+                    path text not null,
+                    options text not null,
+                    priority integer not null,
+                    state text not null default 'pending',
+                    error text,
+                    created real not null,
+                    updated real not null
+                )"""
+            )
+
+    def add(self, jobs: list) -> list:
+        """Add jobs, in one transaction, returning their ids."""
+        ids = []
+        now = time.time()
+        with self.lock, sqlite_session(self.engine) as session:
+            for job in jobs:
+                session.execute(
+                    'insert into jobs(kind, path, options, priority, created, updated) values (?, ?, ?, ?, ?, ?)',
+                    (job.kind, job.path, json.dumps(job.options), job.options['priority'], now, now),
+                )
+                ids.append(session.lastrowid)
+        return ids
+
+    def recover(self) -> int:
+        with self.lock, sqlite_session(self.engine) as session:
+            return session.execute(
+                "update jobs set state = 'pending', updated = ? where state = 'running'",
+                (time.time(),),
+            ).rowcount
+
+    def pending(self) -> list:
+        with self.lock, sqlite_session(self.engine) as session:
+            rows = session.execute(
+                "select id, kind, path, options from jobs where state = 'pending' order by priority desc, id"
+            ).fetchall()
+        return [BatchJob(job_id, kind, path, json.loads(options)) for job_id, kind, path, options in rows]
+
+    def _set_state(self, job_id: int, state: str, error: Optional[str] = None) -> None:
+        with self.lock, sqlite_session(self.engine) as session:
+            session.execute(
+                'update jobs set state = ?, error = ?, updated = ? where id = ?',
+                (state, error, time.time(), job_id),
+            )
+
+    def start(self, job_id: int) -> None:
+        self._set_state(job_id, 'running')
+
+    def finish(self, job_id: int, error: Optional[str] = None) -> None:
+        self._set_state(job_id, 'failed' if error else 'done', error)
+
+    def jobs(self, states: Optional[list] = None) -> list:
+        states = states or JOB_STATES
+        with self.lock, sqlite_session(self.engine) as session:
+            rows = session.execute(
+                f"""select id, kind, path, priority, state, error, created, updated from jobs
+                    where state in ({', '.join('?' for _ in states)}) order by id""",
+                states,
+            ).fetchall()
+        columns = ['id', 'kind', 'path', 'priority', 'state', 'error', 'created', 'updated']
+        return [dict(zip(columns, row)) for row in rows]
+
+
+class AgentTokens(object):
+
+    """
+    TokenManagers, per direction, obtained with authenticate when first
+    needed, and again, when they can no longer be refreshed.
+
+    """
+
+    def __init__(self, authenticate: Callable[[str], TokenManager]) -> None:
+        self.authenticate = authenticate
+        self.managers = {}
+        self.lock = threading.Lock()
+
+    def __getitem__(self, direction: str) -> TokenManager:
+        with self.lock:
+            manager = self.managers.get(direction)
+            if manager is None or not token_is_valid(manager.current()):
+                if manager:
+                    manager.stop()
+                debug_step(f'authenticating for {direction}s')
+                manager = self.managers[direction] = self.authenticate(direction).start()
+            return manager
+
+    def values(self) -> list:
+        with self.lock:
+            return list(self.managers.values())
+
+
+class _AgentHandler(socketserver.StreamRequestHandler):
+
+    """One JSON request per line, answered by one JSON response per line."""
+
+    def handle(self) -> None:
+        if not peer_is_owner(self.request):
+            debug_step('refusing connection from another user')
+            return
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request.get('op') == 'submit':
+                    response = {'id': self.server.agent.submit(request['job'])}
+                elif request.get('op') == 'jobs':
+                    response = {'jobs': self.server.agent.queue.jobs(request.get('states'))}
+                else:
+                    raise AgentError(f'unknown operation: {request.get("op")}')
+            except Exception as e:
+                response = {'error': str(e) or e.__class__.__name__}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class TransferAgent(BatchRunner):
+
+    """
+    Keep running, with warm connections and tokens, and run transfer
+    jobs as they are submitted, over a Unix socket (see agent_submit),
+    or as manifests in a spool directory.
+
+    Jobs are described as in batch manifests, and run in the agent's
+    working directory, up to concurrency at a time, with jobs on
+    overlapping local paths never running at the same time. Jobs are
+    kept in a JobQueue, so jobs interrupted by a restart run again,
+    resuming where their transfers allow it.
+
+    Spooled manifests, named *.yaml or *.yml, are moved to accepted/
+    or rejected/ in the spool directory once read - write them under
+    a name starting with a dot, and rename them when complete. If the
+    agent stops after queuing the jobs of a manifest, but before moving
+    it, they are queued again.
+
+    """
+
+    def __init__(
+        self,
+        env: str,
+        pnum: str,
+        tokens: AgentTokens,
+        queue: JobQueue,
+        concurrency: int = AGENT_CONCURRENCY,
+        spool_dir: Optional[str] = None,
+        path: Optional[str] = None,
+    ) -> None:
+        super().__init__(env, pnum, [], tokens, concurrency=concurrency)
+        self.queue = queue
+        self.spool_dir = spool_dir
+        self.path = path or agent_socket_path(env, pnum)
+        self.changed = threading.Condition()
+        self.running = {}
+        self.stopped = threading.Event()
+
+    def submit(self, entry: dict) -> int:
+        """Queue a job, given as a manifest entry, returning its id."""
+        job = make_job(0, entry)
+        with self.changed:
+            job_id, = self.queue.add([job])
+            self.changed.notify_all()
+        click.echo(f'queued job {job_id}: {job}')
+        return job_id
+
+    def scan_spool(self) -> None:
+        for name in sorted(os.listdir(self.spool_dir)):
+            path = os.path.join(self.spool_dir, name)
+            if name.startswith('.') or not name.endswith(('.yaml', '.yml')) or not os.path.isfile(path):
+                continue
+            try:
+                jobs, _ = load_manifest(path)
+            except ManifestError as e:
+                click.echo(f'rejected {path}: {e}')
+                self._move(path, 'rejected')
+                continue
+            with self.changed:
+                ids = self.queue.add(jobs)
+                self.changed.notify_all()
+            click.echo(f'queued jobs {", ".join(map(str, ids))} from {path}')
+            self._move(path, 'accepted')
+
+    def _move(self, path: str, outcome: str) -> None:
+        directory = os.path.join(self.spool_dir, outcome)
+        os.makedirs(directory, exist_ok=True)
+        os.replace(path, os.path.join(directory, os.path.basename(path)))
+
+    def _next_job(self) -> Optional[BatchJob]:
+        for job in self.queue.pending():
+            if not any(paths_overlap(job.local_path, path) for path in self.running.values()):
+                self.queue.start(job.index)
+                self.running[job.index] = job.local_path
+                return job
+        return None
+
+    def _work(self) -> None:
+        while not self.stopped.is_set():
+            with self.changed:
+                job = self._next_job()
+                if not job:
+                    self.changed.wait()
+                    continue
+            click.echo(f'starting job {job.index}: {job}')
+            error = None
+            try:
+                self._run_job(job)
+            except (Exception, SystemExit) as e:
+                error = str(e) or e.__class__.__name__
+            with self.changed:
+                self.queue.finish(job.index, error)
+                del self.running[job.index]
+                self.changed.notify_all()
+            if error:
+                click.echo(f'failed job {job.index}: {job}: {error}')
+            else:
+                click.echo(f'finished job {job.index}: {job}')
+
+    def _run_job(self, job: BatchJob) -> None:
+        if job.options['encrypt']:
+            # fetched per job, from the key cache, so a rotated key is picked up
+            if not LIBSODIUM_AVAILABLE:
+                raise AgentError('libsodium system dependency missing - end-to-end encryption not available')
+            self.public_key = nacl_get_server_public_key.__wrapped__(
+                self.env, self.pnum, self.tokens[job.direction].current(),
+            )
+        super()._run_job(job)
+
+    def run(self) -> bool:
+        recovered = self.queue.recover()
+        if recovered:
+            click.echo(f'recovered {recovered} interrupted jobs')
+        server = unix_server(self.path, _AgentHandler)
+        server.agent = self
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        for _ in range(self.concurrency):
+            threading.Thread(target=self._work, daemon=True).start()
+        click.echo(f'agent listening on {self.path}')
+        try:
+            while not self.stopped.is_set():
+                if self.spool_dir:
+                    self.scan_spool()
+                self.stopped.wait(AGENT_SPOOL_POLL)
+        finally:
+            self.stop()
+            server.shutdown()
+            server.server_close()
+            os.unlink(self.path)
+            for tokens in self.tokens.values():
+                tokens.stop()
+        return True
+
+    def stop(self) -> None:
+        """Stop taking jobs, letting running jobs finish, if the process continues."""
+        self.stopped.set()
+        with self.changed:
+            self.changed.notify_all()
+
+
+def agent_submit(
+    env: str,
+    pnum: str,
+    job: dict,
+    path: Optional[str] = None,
+) -> int:
+    """
+    Queue a job with a running agent, returning its id. The job is
+    given as in batch manifests, e.g. {'upload': 'results.csv', 'priority': 1},
+    with paths relative to the agent's working directory.
+
+    """
+    response = _agent_request(env, pnum, {'op': 'submit', 'job': job}, path)
+    return response['id']
+
+
+def agent_jobs(
+    env: str,
+    pnum: str,
+    states: Optional[list] = None,
+    path: Optional[str] = None,
+) -> list:
+    """Get the jobs of a running agent, optionally only those in states."""
+    response = _agent_request(env, pnum, {'op': 'jobs', 'states': states}, path)
+    return response['jobs']
+
+
+def _agent_request(env: str, pnum: str, request: dict, path: Optional[str]) -> dict:
+    path = path or agent_socket_path(env, pnum)
+    try:
+        response = unix_request(path, request)
+    except (OSError, ValueError) as e:
+        raise AgentError(f'agent not available at {path}: {e}') from e
+    if response.get('error'):
+        raise AgentError(response['error'])
+    return response
@@ -1,9 +1,9 @@
 """Module for the TSD Auth API."""
 
 import json
-from typing import Optional
+import threading
+from typing import Callable, Optional
 from uuid import UUID
-import requests
 import time
 
 from datetime import datetime, timedelta
@@ -18,6 +18,10 @@ from tsdapiclient.tools import (
     get_claims,
     HELP_URL,
 )
+from tsdapiclient.transport import http
+
+REFRESH_BEFORE = 5*60 # seconds before expiry, from which tokens are refreshed
+REFRESH_AFTER = 10*60 # seconds after expiry, until which refresh is tried
 
 @handle_request_errors
 def get_jwt_basic_auth(
@@ -33,7 +37,7 @@ def get_jwt_basic_auth(
     url = f'{auth_api_url(env, pnum, "basic")}?type={token_type}'
     try:
         debug_step(f"POST {url}")
-        resp = requests.post(url, headers=headers)
+        resp = http.post(url, headers=headers)
     except Exception as e:
         raise AuthnError from e
     if resp.status_code in [200, 201]:
@@ -62,7 +66,7 @@ def get_jwt_instance_auth(
         request_body = {"id": str(link_id)}
         if secret_challenge:
             request_body["secret_challenge"] = secret_challenge
-        resp = requests.post(url, headers=headers, data=json.dumps(request_body))
+        resp = http.post(url, headers=headers, data=json.dumps(request_body))
     except Exception as e:
         raise AuthnError from e
     if resp.status_code in [200, 201]:
@@ -98,7 +102,7 @@ def get_jwt_two_factor_auth(
     }
     url = f'{auth_api_url(env, pnum, auth_method=auth_method)}?type={token_type}'
     try:
-        resp = requests.post(url, data=json.dumps(data), headers=headers)
+        resp = http.post(url, data=json.dumps(data), headers=headers)
     except Exception as e:
         raise AuthnError from e
     if resp.status_code in [200, 201]:
@@ -122,7 +126,7 @@ def refresh_access_token(
     url = f'{auth_api_url(env, pnum, auth_method="refresh")}'
     try:
         debug_step('refreshing token')
-        resp = requests.post(url, data=json.dumps(data), headers=headers)
+        resp = http.post(url, data=json.dumps(data), headers=headers)
     except Exception as e:
         raise AuthnError from e
     if resp.status_code in [200, 201]:
@@ -192,8 +196,189 @@ def maybe_refresh(
             if access and not refresh:
                 session_update(env, pnum, token_type, access, refresh)
                 debug_step('refreshes remaining: 0')
-                tokens = {'access_token': access}
+                return {'access_token': access}
             else:
                 session_update(env, pnum, token_type, access_token, refresh)
                 debug_step('could not refresh, using existing access token')
                 return {'access_token': access_token}
+
+
+class TokenManager(object):
+
+    """
+    An access token, and its refresh token, shared by many
+    requests, and possibly by several threads.
+
+    Claims are decoded once per token, so checking whether a refresh
+    is due, before each request, is cheap. Tokens are refreshed in
+    the same window as with maybe_refresh, and concurrent callers
+    share a single refresh request, so that parallel workers do
+    not each use up the refresh token's counter. Refreshed tokens
+    are persisted with session_update.
+
+    Instead of a refresh token, a source can be given: a callable
+    returning a new access token, e.g. from a token broker.
+
+    Optionally, tokens are refreshed ahead of time, in the
+    background, after start, until stop is called:
+
+        with TokenManager(env, pnum, token, refresh_token, api_key).start() as tokens:
+            upload(..., token_manager=tokens)
+
+    """
+
+    def __init__(
+        self,
+        env: str,
+        pnum: str,
+        access_token: Optional[str],
+        refresh_token: Optional[str] = None,
+        api_key: Optional[str] = None,
+        refresh_target: Optional[int] = None,
+        before: int = REFRESH_BEFORE,
+        after: int = REFRESH_AFTER,
+        persist: bool = True,
+        source: Optional[Callable[[], Optional[str]]] = None,
+    ) -> None:
+        self.env = env
+        self.pnum = pnum
+        self.api_key = api_key
+        self.source = source
+        self.before = before
+        self.after = after
+        self.persist = persist
+        self.lock = threading.Lock()
+        self.refreshed = threading.Condition(self.lock)
+        self.refreshing = False
+        self.timer = None
+        self.running = False
+        self._set(access_token, refresh_token, refresh_target)
+
+    def _set(
+        self,
+        access_token: Optional[str],
+        refresh_token: Optional[str],
+        refresh_target: Optional[int] = None,
+    ) -> None:
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        # tokens which cannot be refreshed are never decoded
+        renewable = refresh_token or self.source
+        claims = get_claims(access_token) if access_token and renewable else {}
+        self.token_type = claims.get('name')
+        self.refresh_target = refresh_target or claims.get('exp')
+
+    def as_dict(self) -> dict:
+        return {'access_token': self.access_token, 'refresh_token': self.refresh_token}
+
+    def due(self, now: Optional[float] = None) -> bool:
+        if not (self.refresh_token or self.source) or not self.refresh_target:
+            return False
+        now = time.time() if now is None else now
+        return self.refresh_target - self.before <= now <= self.refresh_target + self.after
+
+    def current(self) -> Optional[str]:
+        """
+        Get the access token, refreshing it first, if due.
+
+        """
+        if self.due():
+            self.refresh()
+        return self.access_token
+
+    def update(self, tokens: Optional[dict]) -> None:
+        """
+        Adopt tokens obtained elsewhere, e.g. returned by a function
+        called without this token manager.
+
+        """
+        with self.lock:
+            if tokens and tokens.get('access_token') and tokens.get('access_token') != self.access_token:
+                self._set(tokens.get('access_token'), tokens.get('refresh_token'))
+
+    def refresh(self, force: bool = False) -> Optional[str]:
+        """
+        Refresh the access token, if due, or if forced. Callers
+        arriving while a refresh is in flight wait for its result.
+
+        When the refresh token is exhausted, or the refresh fails,
+        the current access token is kept, without a refresh token,
+        as with maybe_refresh.
+
+        """
+        with self.lock:
+            if self.refreshing:
+                while self.refreshing:
+                    self.refreshed.wait()
+                return self.access_token
+            if not (self.refresh_token or self.source) or not (force or self.due()):
+                return self.access_token
+            self.refreshing = True
+            refresh_token = self.refresh_token
+        access, refresh = None, None
+        try:
+            if self.source:
+                access = self.source()
+            else:
+                access, refresh = refresh_access_token(self.env, self.pnum, self.api_key, refresh_token)
+        finally:
+            with self.lock:
+                token_type = self.token_type
+                if access:
+                    self._set(access, refresh)
+                    if not self.source:
+                        debug_step(
+                            f"refreshes remaining: {get_claims(refresh).get('counter') if refresh else 0}"
+                        )
+                elif self.source:
+                    debug_step('could not get a new token, using existing access token')
+                else:
+                    debug_step('could not refresh, using existing access token')
+                    self.refresh_token = None
+                self.refreshing = False
+                self.refreshed.notify_all()
+        if self.persist:
+            session_update(
+                self.env, self.pnum, token_type, self.access_token, self.refresh_token,
+            )
+        return self.access_token
+
+    def start(self) -> "TokenManager":
+        """
+        Refresh tokens in the background, as soon as they are due.
+
+        """
+        self.running = True
+        self._schedule()
+        return self
+
+    def stop(self) -> None:
+        self.running = False
+        if self.timer:
+            self.timer.cancel()
+
+    def _schedule(self) -> None:
+        with self.lock:
+            if not self.running or not (self.refresh_token or self.source) or not self.refresh_target:
+                return
+            now = time.time()
+            if now > self.refresh_target + self.after:
+                return
+            self.timer = threading.Timer(
+                max(0, self.refresh_target - self.before - now), self._refresh_in_background,
+            )
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _refresh_in_background(self) -> None:
+        try:
+            self.refresh()
+        except (Exception, SystemExit) as e:
+            debug_step(f'background token refresh failed: {e}')
+        self._schedule()
+
+    def __enter__(self) -> "TokenManager":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.stop()
@@ -0,0 +1,303 @@
+"""Run many transfers, described in a manifest, in one process."""
+
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import click
+import yaml
+
+from tsdapiclient.authapi import TokenManager
+from tsdapiclient.client_config import CHUNK_SIZE, CHUNK_THRESHOLD
+from tsdapiclient.fileapi import (streamfile, initiate_resumable,
+                                  export_get, export_head)
+from tsdapiclient.sync import (SerialDirectoryUploader, SerialDirectoryDownloader,
+                               SerialDirectoryUploadSynchroniser,
+                               SerialDirectoryDownloadSynchroniser)
+from tsdapiclient.tools import (as_bytes, debug_step,
+                                construct_correct_remote_path,
+                                select_group, resolve_remote_path)
+from tsdapiclient.transport import shared_session
+
+JOB_TYPES = ['upload', 'download', 'upload_sync', 'download_sync']
+JOB_OPTIONS = {
+    'group': None,
+    'remote_path': None,
+    'ignore_prefixes': None,
+    'ignore_suffixes': None,
+    'ignore_patterns': None,
+    'ignore_file': None,
+    'transfer_order': 'scan',
+    'cache': None, # default: on for upload/download, off for sync
+    'keep_missing': False,
+    'keep_updated': False,
+    'encrypt': False,
+    'chunk_size': CHUNK_SIZE,
+    'resumable_threshold': CHUNK_THRESHOLD,
+    'priority': 0, # jobs with higher priorities are started first
+}
+BATCH_CONCURRENCY = 1
+
+
+class ManifestError(Exception):
+    pass
+
+
+class BatchJob(object):
+
+    """A single upload, download, or sync, from a manifest."""
+
+    def __init__(self, index: int, kind: str, path: str, options: dict) -> None:
+        self.index = index
+        self.kind = kind
+        self.path = path
+        self.options = options
+
+    @property
+    def direction(self) -> str:
+        return 'upload' if self.kind.startswith('upload') else 'download'
+
+    @property
+    def local_path(self) -> str:
+        return os.path.normpath(os.path.abspath(self.path))
+
+    def __repr__(self) -> str:
+        return f'{self.kind}: {self.path}'
+
+
+def load_manifest(path: str) -> tuple:
+    """
+    Read and validate a batch manifest, e.g.:
+
+        concurrency: 4
+        defaults:
+          group: p11-member-group
+          encrypt: true
+        jobs:
+          - upload: results.csv
+          - upload_sync: instrument-data
+            keep_missing: true
+          - download: report.pdf
+            remote_path: /reports
+          - download_sync: exports
+
+    Returns
+    -------
+    tuple, (list of BatchJob, concurrency)
+
+    """
+    try:
+        with open(path) as f:
+            manifest = yaml.safe_load(f)
+    except (OSError, yaml.YAMLError) as e:
+        raise ManifestError(f'could not read manifest {path}: {e}') from e
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('jobs'), list):
+        raise ManifestError(f'{path}: a list of jobs is required')
+    unknown = set(manifest) - {'jobs', 'defaults', 'concurrency'}
+    if unknown:
+        raise ManifestError(f'{path}: unknown keys: {", ".join(sorted(unknown))}')
+    defaults = dict(JOB_OPTIONS)
+    defaults.update(_check_options(manifest.get('defaults') or {}, 'defaults'))
+    jobs = [make_job(index, entry, defaults) for index, entry in enumerate(manifest['jobs'])]
+    try:
+        concurrency = int(manifest.get('concurrency', BATCH_CONCURRENCY))
+    except (TypeError, ValueError) as e:
+        raise ManifestError(f'{path}: concurrency must be a number') from e
+    return jobs, max(1, concurrency)
+
+
+def make_job(index: int, entry: dict, defaults: dict = JOB_OPTIONS) -> BatchJob:
+    """
+    Make a job from a manifest entry, e.g. {'upload': 'results.csv', 'encrypt': True},
+    with options not in the entry taken from defaults.
+
+    """
+    if not isinstance(entry, dict):
+        raise ManifestError(f'job {index}: expected a mapping')
+    kinds = [kind for kind in JOB_TYPES if kind in entry]
+    if len(kinds) != 1:
+        raise ManifestError(f'job {index}: specify one of {", ".join(JOB_TYPES)}')
+    kind = kinds[0]
+    options = dict(defaults)
+    options.update(_check_options(
+        {k: v for k, v in entry.items() if k != kind}, f'job {index}'
+    ))
+    if not isinstance(options['priority'], int):
+        raise ManifestError(f'job {index}: priority must be a whole number')
+    job_path = construct_correct_remote_path(str(entry[kind]).rstrip('/'))
+    return BatchJob(index, kind, job_path, options)
+
+
+def _check_options(options: dict, where: str) -> dict:
+    unknown = set(options) - set(JOB_OPTIONS)
+    if unknown:
+        raise ManifestError(f'{where}: unknown options: {", ".join(sorted(unknown))}')
+    return options
+
+
+def independent_lanes(jobs: list) -> list:
+    """
+    Group jobs whose local paths overlap (the same path, or one inside
+    the other), so that they run one after the other, in manifest order.
+    Jobs in different lanes are independent, and can run concurrently.
+
+    """
+    lanes = []
+    for job in jobs:
+        overlapping = [
+            lane for lane in lanes
+            if any(paths_overlap(job.local_path, other.local_path) for other in lane)
+        ]
+        merged = [job]
+        for lane in overlapping:
+            lanes.remove(lane)
+            merged = lane + merged
+        lanes.append(sorted(merged, key=lambda j: j.index))
+    return sorted(lanes, key=lambda lane: lane[0].index)
+
+
+def paths_overlap(a: str, b: str) -> bool:
+    return a == b or a.startswith(f'{b}{os.sep}') or b.startswith(f'{a}{os.sep}')
+
+
+class BatchRunner(object):
+
+    """
+    Run the jobs of a manifest, with shared tokens, the shared
+    connection pool, and a single public key fetch for encrypted
+    transfers. With a concurrency above POOL_MAXSIZE / 2, configure
+    the shared transport with a larger pool_maxsize.
+
+    Independent jobs run concurrently, up to concurrency at a time.
+    Tokens, given as a TokenManager per direction, are shared by all
+    jobs, and refreshed in the background, while the batch runs.
+
+    A failed job does not stop the batch: failures are reported,
+    once all jobs have run.
+
+    """
+
+    def __init__(
+        self,
+        env: str,
+        pnum: str,
+        jobs: list,
+        tokens: dict,
+        public_key: Optional["libnacl.public.PublicKey"] = None,
+        concurrency: int = BATCH_CONCURRENCY,
+    ) -> None:
+        self.env = env
+        self.pnum = pnum
+        self.jobs = jobs
+        self.tokens = tokens
+        self.public_key = public_key
+        self.concurrency = concurrency
+        self.session = shared_session()
+        self.failures = {}
+
+    def run(self) -> bool:
+        # lanes with high priority jobs first, otherwise in manifest order
+        lanes = sorted(
+            independent_lanes(self.jobs),
+            key=lambda lane: -max(job.options['priority'] for job in lane),
+        )
+        debug_step(f'running {len(self.jobs)} jobs in {len(lanes)} independent lanes')
+        for tokens in self.tokens.values():
+            tokens.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                for future in [executor.submit(self._run_lane, lane) for lane in lanes]:
+                    future.result()
+        finally:
+            for tokens in self.tokens.values():
+                tokens.stop()
+        click.echo(f'batch complete: {len(self.jobs) - len(self.failures)} of {len(self.jobs)} jobs succeeded')
+        for job, error in sorted(self.failures.items(), key=lambda f: f[0].index):
+            click.echo(f'failed: {job}: {error}')
+        return not self.failures
+
+    def _run_lane(self, lane: list) -> None:
+        for job in lane:
+            click.echo(f'starting job {job.index}: {job}')
+            try:
+                self._run_job(job)
+            except (Exception, SystemExit) as e:
+                self.failures[job] = e
+
+    def _run_job(self, job: BatchJob) -> None:
+        tokens = self.tokens[job.direction]
+        token = tokens.current()
+        options = job.options
+        public_key = self.public_key if options['encrypt'] else None
+        group = select_group(self.pnum, token, options['group'])
+        remote_path = resolve_remote_path(token, options['remote_path'])
+        directory_options = dict(
+            prefixes=options['ignore_prefixes'],
+            suffixes=options['ignore_suffixes'],
+            patterns=options['ignore_patterns'],
+            ignore_file=options['ignore_file'],
+            transfer_order=options['transfer_order'],
+            public_key=public_key,
+            remote_path=remote_path,
+            session=self.session,
+            token_manager=tokens,
+        )
+        chunk_size = as_bytes(options['chunk_size'])
+        chunk_threshold = as_bytes(options['resumable_threshold'])
+        transporter = None
+        if job.kind == 'upload' and os.path.isfile(job.path):
+            if os.stat(job.path).st_size > chunk_threshold:
+                initiate_resumable(
+                    self.env, self.pnum, job.path, token, chunksize=chunk_size,
+                    group=group, verify=True, session=self.session, token_manager=tokens,
+                    public_key=public_key, remote_path=remote_path,
+                )
+            else:
+                streamfile(
+                    self.env, self.pnum, job.path, token, group=group, session=self.session,
+                    public_key=public_key, remote_path=remote_path, token_manager=tokens,
+                )
+        elif job.kind == 'upload':
+            transporter = SerialDirectoryUploader(
+                self.env, self.pnum, job.path, token, group,
+                use_cache=options['cache'] is not False,
+                chunk_size=chunk_size, chunk_threshold=chunk_threshold,
+                **directory_options,
+            )
+        elif job.kind == 'upload_sync':
+            transporter = SerialDirectoryUploadSynchroniser(
+                self.env, self.pnum, job.path, token, group,
+                use_cache=bool(options['cache']), sync_mtime=True,
+                keep_missing=options['keep_missing'], keep_updated=options['keep_updated'],
+                remote_key='import', chunk_size=chunk_size, chunk_threshold=chunk_threshold,
+                **directory_options,
+            )
+        else:
+            resp = export_head(
+                self.env, self.pnum, job.path, token, session=self.session,
+                remote_path=remote_path,
+            )
+            is_dir = resp.headers.get('Content-Type') == 'directory'
+            if job.kind == 'download_sync':
+                if not is_dir:
+                    raise ValueError('directory sync does not apply to files')
+                transporter = SerialDirectoryDownloadSynchroniser(
+                    self.env, self.pnum, job.path, token,
+                    use_cache=bool(options['cache']), sync_mtime=True,
+                    keep_missing=options['keep_missing'], keep_updated=options['keep_updated'],
+                    remote_key='export', **directory_options,
+                )
+            elif is_dir:
+                transporter = SerialDirectoryDownloader(
+                    self.env, self.pnum, job.path, token,
+                    use_cache=options['cache'] is not False, remote_key='export',
+                    **directory_options,
+                )
+            else:
+                export_get(
+                    self.env, self.pnum, job.path, token, session=self.session,
+                    public_key=public_key, remote_path=remote_path, token_manager=tokens,
+                )
+        if transporter:
+            transporter.sync()
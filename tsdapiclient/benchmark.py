@@ -0,0 +1,250 @@
+"""
+Offline benchmarks of end-to-end encryption, to compare changes to the
+crypto path, and to choose chunk sizes for --encrypt:
+
+    python -m tsdapiclient.benchmark --output results.json
+
+"""
+
+import ctypes
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from typing import Callable, Optional
+
+import click
+import libnacl
+import libnacl.public
+
+from tsdapiclient import __version__
+from tsdapiclient.crypto import (CRYPTO_WORKERS, nacl_crypt_chunks,
+                                 nacl_crypt_into, nacl_decrypt_data,
+                                 nacl_encrypt_data, nacl_encrypt_header,
+                                 nacl_gen_key, nacl_gen_nonce)
+from tsdapiclient.fileapi import lazy_reader
+
+BENCHMARK_TOTAL = 64*1024*1024 # bytes, processed per measurement
+BENCHMARK_CHUNK_SIZES = [64*1024, 1024*1024, 4*1024*1024, 16*1024*1024] # bytes
+BENCHMARK_REPEAT = 3 # runs per measurement, of which the fastest is reported
+BENCHMARK_HEADERS = 1000 # headers sealed per measurement
+
+MB = 1000*1000
+
+
+def measure(
+    run: Callable[[], int],
+    repeat: int = BENCHMARK_REPEAT,
+    memory: bool = True,
+) -> dict:
+    """
+    Time run, which returns the number of bytes, or operations, it
+    processed, reporting the fastest of repeat runs.
+
+    Wall time shows throughput, and process CPU time how much of it
+    each core provides - the two differ when work runs on threads.
+    Peak memory is measured by another run, with tracemalloc, which
+    would distort the timings.
+
+    """
+    best = None
+    for _ in range(repeat):
+        wall, cpu = time.perf_counter(), time.process_time()
+        amount = run()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        if best is None or wall < best[0]:
+            best = (wall, cpu)
+    wall, cpu = best
+    result = {
+        'amount': amount,
+        'seconds': wall,
+        'cpu_seconds': cpu,
+        'per_second': amount / wall if wall else None,
+        'per_cpu_second': amount / cpu if cpu else None,
+    }
+    if memory:
+        tracemalloc.start()
+        try:
+            run()
+            result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def _data_result(name: str, measured: dict, **parameters: int) -> dict:
+    result = {'benchmark': name, **parameters, **measured}
+    result['mb_per_second'] = measured['per_second'] and measured['per_second'] / MB
+    result['mb_per_cpu_second'] = measured['per_cpu_second'] and measured['per_cpu_second'] / MB
+    return result
+
+
+def bench_data(
+    total: int = BENCHMARK_TOTAL,
+    chunk_sizes: list = BENCHMARK_CHUNK_SIZES,
+    worker_counts: Optional[list] = None,
+    repeat: int = BENCHMARK_REPEAT,
+) -> list:
+    """
+    Measure nacl_encrypt_data, nacl_decrypt_data, nacl_crypt_into,
+    and nacl_crypt_chunks, over total bytes, in chunks of each size.
+    nacl_crypt_chunks is measured both with new buffers per chunk, and
+    read ahead, and with a single buffer, as lazy_reader uses for large
+    chunks, with speedup relative to no workers, if that was measured.
+
+    """
+    worker_counts = worker_counts if worker_counts is not None else sorted({0, CRYPTO_WORKERS})
+    nonce, key = nacl_gen_nonce(), nacl_gen_key()
+    results = []
+    for chunk_size in chunk_sizes:
+        count = max(1, total // chunk_size)
+        chunk = os.urandom(chunk_size)
+        encrypted = nacl_encrypt_data(chunk, nonce, key)
+        buffer = bytearray(chunk)
+        def copying(crypt: Callable, data: bytes) -> Callable[[], int]:
+            def run() -> int:
+                for _ in range(count):
+                    crypt(data, nonce, key)
+                return count * chunk_size
+            return run
+        def in_place() -> int:
+            for _ in range(count):
+                nacl_crypt_into(buffer, nonce, key)
+            return count * chunk_size
+        for name, run in (
+            ('encrypt', copying(nacl_encrypt_data, chunk)),
+            ('decrypt', copying(nacl_decrypt_data, encrypted)),
+            ('crypt_into', in_place),
+        ):
+            click.echo(f'{name}: {chunk_size} bytes per chunk', err=True)
+            results.append(_data_result(name, measure(run, repeat), chunk_size=chunk_size))
+        for name, read_ahead in (('crypt_chunks', None), ('crypt_in_place', 0)):
+            baseline = None
+            for workers in worker_counts:
+                def pipeline() -> int:
+                    if read_ahead is None:
+                        # new buffers per chunk
+                        chunks = (bytearray(chunk) for _ in range(count))
+                    else:
+                        chunks = (buffer for _ in range(count))
+                    return sum(len(data) for data in nacl_crypt_chunks(
+                        chunks, nonce, key, workers=workers, read_ahead=read_ahead,
+                    ))
+                click.echo(f'{name}: {chunk_size} bytes per chunk, {workers} workers', err=True)
+                result = _data_result(name, measure(pipeline, repeat), chunk_size=chunk_size, workers=workers)
+                if workers == 0:
+                    baseline = result['per_second']
+                elif baseline and result['per_second']:
+                    result['speedup'] = result['per_second'] / baseline
+                results.append(result)
+    return results
+
+
+def bench_headers(count: int = BENCHMARK_HEADERS, repeat: int = BENCHMARK_REPEAT) -> list:
+    """Measure sealing nonces and keys, as done once per transfer."""
+    public_key = libnacl.public.PublicKey(libnacl.public.SecretKey().pk)
+    header = nacl_gen_key()
+    def run() -> int:
+        for _ in range(count):
+            nacl_encrypt_header(public_key, header)
+        return count
+    click.echo('seal_header', err=True)
+    return [{'benchmark': 'seal_header', **measure(run, repeat)}]
+
+
+def bench_lazy_reader(
+    total: int = BENCHMARK_TOTAL,
+    chunk_sizes: list = BENCHMARK_CHUNK_SIZES,
+    repeat: int = BENCHMARK_REPEAT,
+    directory: Optional[str] = None,
+) -> list:
+    """
+    Measure reading, and encrypting, a file of total bytes with
+    lazy_reader, as for an encrypted upload, without sending it.
+    The file is likely to be in the page cache, so this shows the
+    cost of the client, rather than of the disk.
+
+    """
+    public_key = libnacl.public.PublicKey(libnacl.public.SecretKey().pk)
+    results = []
+    with tempfile.NamedTemporaryFile(dir=directory) as f:
+        remaining = total
+        while remaining:
+            written = f.write(os.urandom(min(remaining, MB)))
+            remaining -= written
+        f.flush()
+        for chunk_size in chunk_sizes:
+            def run() -> int:
+                return sum(len(data) for data, *_ in lazy_reader(f.name, chunk_size, public_key=public_key))
+            click.echo(f'lazy_reader: {chunk_size} bytes per chunk', err=True)
+            results.append(_data_result('lazy_reader', measure(run, repeat), chunk_size=chunk_size))
+    return results
+
+
+def _libsodium_version() -> str:
+    version = libnacl.nacl.sodium_version_string
+    version.restype = ctypes.c_char_p
+    return version().decode('utf-8')
+
+
+def run_benchmarks(
+    total: int = BENCHMARK_TOTAL,
+    chunk_sizes: list = BENCHMARK_CHUNK_SIZES,
+    worker_counts: Optional[list] = None,
+    repeat: int = BENCHMARK_REPEAT,
+    headers: int = BENCHMARK_HEADERS,
+) -> dict:
+    """Run all benchmarks, returning the results, and the environment they ran in."""
+    return {
+        'tacl_version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'libsodium': _libsodium_version(),
+        'cpu_count': os.cpu_count(),
+        'created': time.time(),
+        'results': (
+            bench_data(total, chunk_sizes, worker_counts, repeat)
+            + bench_headers(headers, repeat)
+            + bench_lazy_reader(total, chunk_sizes, repeat)
+        ),
+    }
+
+
+def _sizes(ctx: click.Context, param: click.Parameter, value: Optional[str]) -> Optional[list]:
+    if value is None:
+        return None
+    try:
+        return [int(item) for item in value.split(',')]
+    except ValueError:
+        raise click.BadParameter('expected comma-separated integers')
+
+
+@click.command()
+@click.option('--total', type=int, default=BENCHMARK_TOTAL, help='bytes processed per measurement')
+@click.option('--chunk-sizes', callback=_sizes, help='comma-separated chunk sizes, in bytes')
+@click.option('--workers', callback=_sizes, help='comma-separated numbers of crypto threads')
+@click.option('--repeat', type=int, default=BENCHMARK_REPEAT, help='runs per measurement')
+@click.option('--output', type=click.Path(dir_okay=False), help='write JSON here, instead of stdout')
+def main(
+    total: int,
+    chunk_sizes: Optional[list],
+    workers: Optional[list],
+    repeat: int,
+    output: Optional[str],
+) -> None:
+    results = run_benchmarks(total, chunk_sizes or BENCHMARK_CHUNK_SIZES, workers, repeat)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        click.echo()
+
+
+if __name__ == '__main__':
+    main()
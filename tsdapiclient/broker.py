@@ -0,0 +1,228 @@
+"""A local token broker, shared by tacl processes, over a Unix socket."""
+
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from typing import Callable, Optional
+
+from tsdapiclient.authapi import get_jwt_basic_auth, TokenManager
+from tsdapiclient.tools import debug_step, get_claims, get_config_path
+
+BROKER_TIMEOUT = 5 # seconds, for clients
+MIN_VALIDITY = 60 # seconds, that a token handed out must still be valid
+
+
+class BrokerError(Exception):
+    pass
+
+
+def broker_socket_path() -> str:
+    return os.environ.get('TACL_BROKER_SOCKET') or f'{get_config_path()}/broker.sock'
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+
+    """One JSON request per line, answered by one JSON response per line."""
+
+    def handle(self) -> None:
+        if not self.server.broker.authorised(self.request):
+            debug_step('refusing connection from another user')
+            return
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = {
+                    'access_token': self.server.broker.token(
+                        request['env'],
+                        request['pnum'],
+                        request['token_type'],
+                        request['api_key'],
+                    )
+                }
+            except Exception as e:
+                response = {'error': str(e) or e.__class__.__name__}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class TokenBroker(object):
+
+    """
+    Hold tokens per env, pnum, token type, and API key, and hand out
+    valid access tokens to local tacl processes, and library users.
+
+    Tokens are obtained with basic auth, the first time they are
+    requested, and refreshed in the background, by one TokenManager
+    each, so that clients neither authenticate, nor use up refresh
+    tokens. Clients never receive refresh tokens.
+
+    The socket is only accessible to the user running the broker,
+    and on Linux, connections from other users are refused.
+
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        authenticate: Optional[Callable[[str, str, str, str], tuple]] = None,
+    ) -> None:
+        self.path = path or broker_socket_path()
+        self.authenticate = authenticate or get_jwt_basic_auth.__wrapped__
+        self.managers = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def token(self, env: str, pnum: str, token_type: str, api_key: str) -> str:
+        key = (env, pnum, token_type, hashlib.sha256(api_key.encode('utf-8')).hexdigest())
+        with self.lock:
+            key_lock = self.locks.setdefault(key, threading.Lock())
+        # concurrent requests for the same tokens authenticate once
+        with key_lock:
+            manager = self.managers.get(key)
+            if manager:
+                token = manager.current()
+                if token_is_valid(token):
+                    return token
+                manager.stop()
+            debug_step(f'authenticating: {env}, {pnum}, {token_type}')
+            access, refresh = self.authenticate(env, pnum, api_key, token_type)
+            if not access:
+                raise BrokerError('authentication failed')
+            self.managers[key] = TokenManager(
+                env, pnum, access, refresh, api_key=api_key, persist=False,
+            ).start()
+            return access
+
+    def authorised(self, connection: socket.socket) -> bool:
+        return peer_is_owner(connection)
+
+    def server(self) -> socketserver.BaseServer:
+        server = unix_server(self.path, _BrokerHandler)
+        server.broker = self
+        return server
+
+    def serve(self) -> None:
+        server = self.server()
+        debug_step(f'token broker listening on {self.path}')
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.unlink(self.path)
+            for manager in self.managers.values():
+                manager.stop()
+
+
+def token_is_valid(token: Optional[str]) -> bool:
+    return bool(token) and get_claims(token).get('exp', 0) - time.time() > MIN_VALIDITY
+
+
+def peer_is_owner(connection: socket.socket) -> bool:
+    """Whether a Unix socket connection is from the current user, where this can be told."""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return True
+    creds = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    _, uid, _ = struct.unpack('3i', creds)
+    return uid == os.getuid()
+
+
+def unix_server(
+    path: str,
+    handler: type,
+) -> socketserver.BaseServer:
+    """
+    Bind a Unix socket, only accessible to the current user,
+    replacing a stale one, left by a server which did not exit cleanly.
+
+    """
+    if os.path.exists(path):
+        if broker_available(path):
+            raise BrokerError(f'already running: {path}')
+        os.unlink(path)
+    umask = os.umask(0o077)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(path, handler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    return server
+
+
+def unix_request(path: str, request: dict) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(BROKER_TIMEOUT)
+        sock.connect(path)
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as f:
+            return json.loads(f.readline())
+
+
+def broker_available(path: Optional[str] = None) -> bool:
+    path = path or broker_socket_path()
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return False
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(BROKER_TIMEOUT)
+            sock.connect(path)
+        return True
+    except OSError:
+        return False
+
+
+def broker_token(
+    env: str,
+    pnum: str,
+    token_type: str,
+    api_key: str,
+    path: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Get an access token from a running broker, or None,
+    if no broker is running, or it could not provide one.
+
+    """
+    path = path or broker_socket_path()
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return None
+    try:
+        response = unix_request(
+            path, {'env': env, 'pnum': pnum, 'token_type': token_type, 'api_key': api_key},
+        )
+    except (OSError, ValueError) as e:
+        debug_step(f'token broker not available: {e}')
+        return None
+    if response.get('error'):
+        debug_step(f'token broker error: {response.get("error")}')
+        return None
+    return response.get('access_token')
+
+
+def broker_token_manager(
+    env: str,
+    pnum: str,
+    token_type: str,
+    api_key: str,
+    path: Optional[str] = None,
+) -> Optional[TokenManager]:
+    """
+    Get a TokenManager which gets its tokens from a running broker,
+    also when they are due for renewal, or None, if there is no broker.
+
+    """
+    token = broker_token(env, pnum, token_type, api_key, path=path)
+    if not token:
+        return None
+    debug_step('using tokens from the token broker')
+    return TokenManager(
+        env,
+        pnum,
+        token,
+        persist=False,
+        source=lambda: broker_token(env, pnum, token_type, api_key, path=path),
+    )
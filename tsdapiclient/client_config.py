@@ -16,5 +16,12 @@ ENV = {
     'ec-test': EC_TEST,
     'dev': DEV,
 }
+HELP_URL = 'https://www.uio.no/english/services/it/research/sensitive-data/contact/index.html'
+EDUCLOUD_CONTACT_URL = "https://www.uio.no/english/services/it/research/platforms/edu-research/help/contact-us.html"
 CHUNK_THRESHOLD = '1gb'
 CHUNK_SIZE = '50mb'
+SCHEDULING_POLICIES = ['scan', 'small-first', 'largest-first', 'newest-first', 'mixed']
+WATCH_SETTLE = 5 # seconds without changes before a file is transferred
+RECONCILE_INTERVAL = 3600 # seconds between full syncs
+POLL_INTERVAL = 30 # seconds between remote polls, when changes are seen
+AGENT_CONCURRENCY = 2 # jobs run at the same time by the transfer agent
@@ -4,72 +4,63 @@
 import datetime
 import os
 
-import yaml
-from rich.console import Console
-from rich.syntax import Syntax
-from rich.table import Table
-from rich.text import Text
+from typing import Optional
 
+from tsdapiclient.store import store_for
 from tsdapiclient.tools import get_config_path, get_claims, check_if_key_has_expired
 
-TACL_CONFIG = get_config_path() + '/config'
 
+def config_file() -> str:
+    return get_config_path() + '/config'
 
-def read_config(filename: str = TACL_CONFIG) -> dict:
+
+def __getattr__(name: str) -> str:
+    # the path is resolved on first use, not on import
+    if name == 'TACL_CONFIG':
+        return config_file()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def config_default() -> dict:
+    return {'test': {}, 'prod': {}, 'alt': {}, 'ec-prod': {}, 'ec-test': {}}
+
+
+def read_config(filename: Optional[str] = None) -> dict:
     try:
-        with open(filename, 'r') as f:
-            config = yaml.load(f, Loader=yaml.Loader)
-        return config
+        return store_for(filename or config_file()).read()
     except FileNotFoundError:
         return None
 
 
-def write_config(data: dict, filename: str = TACL_CONFIG) -> None:
-    with open(filename, 'w') as f:
-        f.write(yaml.dump(data, Dumper=yaml.Dumper))
+def write_config(data: dict, filename: Optional[str] = None) -> None:
+    store_for(filename or config_file()).write(data)
 
 
 def update_config(env: str, key: str, val: str) -> None:
     if env not in ['test', 'prod', 'alt', 'ec-prod', 'ec-test']:
         raise Exception('Unrecognised environment: {0}'.format(env))
-    try:
-        config = read_config(TACL_CONFIG)
-    except IOError:
-        config = {'test': {}, 'prod': {}, 'alt': {}, 'ec-prod': {}, 'ec-test': {}}
-    try:
-        if config and config.get(env):
-            curr_env = config[env]
-            new_env = curr_env.copy()
-        else:
-            new_env = {}
-        if config:
-            new_config = config.copy()
-            if 'alt' not in new_config.keys():
-                new_config['alt'] = {}
-        else:
-            new_config = {'test': {}, 'prod': {}, 'alt': {}, 'ec-prod': {}, 'ec-test': {}}
-        if not new_env.get(key):
-            print('updating {0}'.format(key))
-            new_config[env].update({key:val})
-        elif key in ['api_key', 'pass']:
-            print('updating {0}'.format(key))
-            new_config[env].update({key:val})
-        elif key in ['client_id', 'email', 'client_name']:
+    def update(config: dict) -> dict:
+        new_config = config if config else config_default()
+        if 'alt' not in new_config.keys():
+            new_config['alt'] = {}
+        new_env = new_config.setdefault(env, {})
+        if new_env.get(key) and key in ['client_id', 'email', 'client_name']:
             print('trying to modify {0} - not allowed'.format(key))
             print('if you want to do that, delete your current config')
             print('and register again')
-            write_config(config, TACL_CONFIG)
-            return
-        else:
-            print('updating {0}'.format(key))
-            new_config[env].update({key:val})
-        write_config(new_config, TACL_CONFIG)
-    except IOError:
-        new_config = {}
-        write_config(new_config)
-
-def print_config(filename: str = TACL_CONFIG) -> None:
+            return config
+        print('updating {0}'.format(key))
+        new_env.update({key:val})
+        return new_config
+    store_for(config_file()).update(update)
+
+def print_config(filename: Optional[str] = None) -> None:
     """Print configuration overview and config file path/contents."""
+    from rich.console import Console
+    from rich.syntax import Syntax
+    from rich.table import Table
+    from rich.text import Text
+    filename = filename or config_file()
     console = Console()
     config = read_config(filename=filename)
     if not os.path.exists(filename):
@@ -102,17 +93,15 @@ def print_config(filename: str = TACL_CONFIG) -> None:
         console.print(syntax)
 
 
-def delete_config(filename: str = TACL_CONFIG) -> None:
+def delete_config(filename: Optional[str] = None) -> None:
     try:
-        with open(filename, 'w+') as f:
-            f.write(yaml.dump({'test': {}, 'prod': {}, 'alt': {}, 'ec-prod': {}, 'ec-test': {}}, Dumper=yaml.Dumper))
+        write_config(config_default(), filename)
     except FileNotFoundError:
         print("No config found")
 
 def print_config_tsd_2fa_key(env: str, pnum: str) -> None:
-    try:
-        with open(TACL_CONFIG, 'r') as f:
-            cf = yaml.load(f, Loader=yaml.Loader)
-            print(cf[env][pnum])
-    except FileNotFoundError:
+    cf = read_config()
+    if cf is None:
         print("No config found")
+    else:
+        print(cf[env][pnum])
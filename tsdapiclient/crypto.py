@@ -2,24 +2,174 @@
 """Wrapper functions to encapsulate libsodium and API details."""
 
 import base64
+import ctypes
 import json
+import os
+import tempfile
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional, Union
 
 import libnacl
 import libnacl.sealed
 import libnacl.public
 import libnacl.utils
-import requests
 
 from tsdapiclient.exc import AuthzError
-from tsdapiclient.tools import HOSTS, debug_step, handle_request_errors
+from tsdapiclient.tools import HOSTS, debug_step, get_data_path, handle_request_errors
+from tsdapiclient.transport import http
+
+PUBLIC_KEY_TTL = 24*60*60 # seconds, for which a cached server public key is used
+CRYPTO_WORKERS = min(4, os.cpu_count() or 1) # threads encrypting, or decrypting, chunks at once
+CRYPTO_PARALLEL_MIN_CHUNK = 1024*1024 # bytes, smaller chunks are processed inline
+CRYPTO_READ_AHEAD = 64*1024*1024 # bytes, at most, of chunks read ahead, to encrypt on workers
+CRYPTO_BLOCK_BYTES = 64 # bytes, of the stream per counter value, at which chunks are split
 
 
 def nacl_encrypt_data(data: bytes, nonce: bytes, key: bytes) -> bytes:
-    return libnacl.crypto_stream_xor(data, nonce, key)
+    # libnacl only accepts bytes, and not e.g. the bytearrays of lazy_reader
+    return libnacl.crypto_stream_xor(bytes(data), nonce, key)
 
 
 def nacl_decrypt_data(data: bytes, nonce: bytes, key: bytes) -> bytes:
-    return libnacl.crypto_stream_xor(data, nonce, key)
+    return libnacl.crypto_stream_xor(bytes(data), nonce, key)
+
+
+def nacl_crypt_into(
+    buffer: Union[bytearray, memoryview],
+    nonce: bytes,
+    key: bytes,
+    block: int = 0,
+) -> None:
+    """
+    Encrypt, or decrypt, buffer in place, with the same result as
+    nacl_encrypt_data, but without allocating a copy. The buffer can
+    be any writable, contiguous, bytes-like object, e.g. a bytearray,
+    or a memoryview of part of one.
+
+    Given block, the buffer is processed as the part of a stream
+    starting at block * CRYPTO_BLOCK_BYTES, so that the parts of
+    a chunk can be processed separately, e.g. on several threads.
+
+    """
+    view = memoryview(buffer).cast('B')
+    if view.readonly:
+        raise TypeError('cannot encrypt a read-only buffer in place')
+    if len(key) != libnacl.crypto_stream_KEYBYTES:
+        raise ValueError('Invalid secret key')
+    if len(nonce) != libnacl.crypto_stream_NONCEBYTES:
+        raise ValueError('Invalid nonce')
+    # libsodium allows the message and ciphertext to be the same memory
+    data = (ctypes.c_char * view.nbytes).from_buffer(view)
+    if libnacl.nacl.crypto_stream_xsalsa20_xor_ic(
+        data, data, ctypes.c_ulonglong(view.nbytes), nonce, ctypes.c_uint64(block), key,
+    ):
+        raise ValueError('Failed to init stream')
+
+
+def _crypt_chunk(chunk: Union[bytes, bytearray], nonce: bytes, key: bytes) -> Union[bytes, bytearray]:
+    if isinstance(chunk, (bytearray, memoryview)) and not memoryview(chunk).readonly:
+        nacl_crypt_into(chunk, nonce, key)
+        return chunk
+    return nacl_encrypt_data(chunk, nonce, key)
+
+
+def _split(chunk: Union[bytes, bytearray, memoryview], parts: int) -> Iterator[tuple]:
+    """Split chunk into (view, block) parts, at block boundaries, see nacl_crypt_into."""
+    view = memoryview(chunk).cast('B')
+    blocks = -(-len(view) // CRYPTO_BLOCK_BYTES)
+    per_part = -(-blocks // parts)
+    for block in range(0, blocks, per_part):
+        yield view[block * CRYPTO_BLOCK_BYTES:(block + per_part) * CRYPTO_BLOCK_BYTES], block
+
+
+def crypto_workers(chunksize: int, workers: int = CRYPTO_WORKERS) -> int:
+    """
+    The number of workers with which to encrypt chunks of chunksize,
+    none for chunks which are too small to be worth it.
+
+    """
+    return 0 if chunksize < CRYPTO_PARALLEL_MIN_CHUNK else workers
+
+
+def crypto_read_ahead(chunksize: int, workers: int = CRYPTO_WORKERS) -> int:
+    """
+    The number of chunks of chunksize to read ahead of the caller,
+    in buffers of the caller's, which need one more than that (see
+    nacl_crypt_chunks), such that all of them fit CRYPTO_READ_AHEAD.
+
+    """
+    return max(0, min(workers, CRYPTO_READ_AHEAD // chunksize - 1))
+
+
+def nacl_crypt_chunks(
+    chunks: Iterable[Union[bytes, bytearray]],
+    nonce: bytes,
+    key: bytes,
+    workers: int = CRYPTO_WORKERS,
+    read_ahead: Optional[int] = None,
+) -> Iterator[bytes]:
+    """
+    Encrypt, or decrypt, chunks, each as a stream of its own (as with
+    nacl_encrypt_data), yielding them in order.
+
+    libsodium releases the GIL, so with workers, each chunk is split
+    into workers parts, processed at the same time, on a thread pool,
+    and up to read_ahead chunks (by default workers) are processed
+    while the caller reads, or sends, others. Chunks smaller than
+    CRYPTO_PARALLEL_MIN_CHUNK are not worth the hand-off, and are
+    processed inline.
+
+    Writable chunks, e.g. bytearrays, are processed in place, and
+    yielded as such, so callers which read into buffers of their own
+    need no memory beyond them. Other chunks are yielded as copies.
+    When a chunk is yielded, the next read_ahead chunks have been
+    taken from chunks, and the one after them is taken when the caller
+    asks for it, so callers reusing buffers need read_ahead + 1 of
+    them, see crypto_read_ahead.
+
+    """
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        return
+    if not workers or len(first) < CRYPTO_PARALLEL_MIN_CHUNK:
+        yield _crypt_chunk(first, nonce, key)
+        for chunk in chunks:
+            yield _crypt_chunk(chunk, nonce, key)
+        return
+    read_ahead = workers if read_ahead is None else read_ahead
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit(chunk: Union[bytes, bytearray, memoryview]) -> tuple:
+            if memoryview(chunk).readonly:
+                chunk = bytearray(chunk)
+            return chunk, [
+                executor.submit(nacl_crypt_into, part, nonce, key, block)
+                for part, block in _split(chunk, workers)
+            ]
+        def done(chunk: Union[bytearray, memoryview], futures: list) -> Union[bytearray, memoryview]:
+            for future in futures:
+                future.result()
+            return chunk
+        try:
+            pending.append(submit(first))
+            while True:
+                # at most read_ahead chunks beyond the caller's, to bound memory
+                if len(pending) > read_ahead:
+                    yield done(*pending.popleft())
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                pending.append(submit(chunk))
+            while pending:
+                yield done(*pending.popleft())
+        finally:
+            for _, futures in pending:
+                for future in futures:
+                    future.cancel()
 
 
 def nacl_gen_nonce() -> bytes:
@@ -30,18 +180,82 @@ def nacl_gen_key() -> bytes:
     return libnacl.utils.salsa_key()
 
 
+def _public_key_file(env: str, pnum: str) -> str:
+    return f'{get_data_path(env, pnum)}/server-public-key.json'
+
+
+def read_cached_server_public_key(
+    env: str,
+    pnum: str,
+    ttl: float = PUBLIC_KEY_TTL,
+) -> Optional[bytes]:
+    """
+    Get the server's public key, as cached by nacl_get_server_public_key,
+    or None, if it is not cached, expired, or invalid.
+
+    """
+    try:
+        with open(_public_key_file(env, pnum), 'r') as f:
+            cached = json.load(f)
+        age = time.time() - cached['fetched']
+        public_key = base64.b64decode(cached['public_key'], validate=True)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        debug_step(f'no usable cached public key: {e}')
+        return None
+    if not 0 <= age < ttl or len(public_key) != libnacl.crypto_box_PUBLICKEYBYTES:
+        return None
+    return public_key
+
+
+def cache_server_public_key(env: str, pnum: str, public_key: bytes) -> None:
+    path = _public_key_file(env, pnum)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.server-public-key.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                'public_key': base64.b64encode(public_key).decode('utf-8'),
+                'fetched': time.time(),
+            }, f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def invalidate_server_public_key(env: str, pnum: str) -> None:
+    """Forget the cached public key, e.g. after the server rejected data."""
+    debug_step('forgetting cached public key')
+    try:
+        os.unlink(_public_key_file(env, pnum))
+    except FileNotFoundError:
+        pass
+
+
 @handle_request_errors
-def nacl_get_server_public_key(env: str, pnum: str, token: str) -> bytes:
+def nacl_get_server_public_key(
+    env: str,
+    pnum: str,
+    token: str,
+    use_cache: bool = True,
+) -> bytes:
+    if use_cache:
+        public_key = read_cached_server_public_key(env, pnum)
+        if public_key:
+            debug_step('using cached public key')
+            return libnacl.public.PublicKey(public_key)
     host = HOSTS.get(env)
     debug_step('getting public key')
-    resp = requests.get(
+    resp = http.get(
         f'https://{host}/v1/{pnum}/files/crypto/key',
         headers={'Authorization': f'Bearer {token}'},
     )
     if resp.status_code != 200:
         raise AuthzError
     encoded_public_key = json.loads(resp.text).get('public_key')
-    return libnacl.public.PublicKey(base64.b64decode(encoded_public_key))
+    public_key = base64.b64decode(encoded_public_key)
+    if use_cache:
+        cache_server_public_key(env, pnum, public_key)
+    return libnacl.public.PublicKey(public_key)
 
 
 def nacl_encrypt_header(public_key: bytes, header: bytes) -> bytes:
@@ -0,0 +1,218 @@
+"""Bulk, concurrent deletion of resources."""
+
+import threading
+import time
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Collection, Iterable, Iterator, Optional
+
+from requests.exceptions import ConnectionError, HTTPError, Timeout
+from rich.progress import Progress
+
+from tsdapiclient.tools import debug_step
+
+DELETE_WORKERS = 8
+DELETE_RETRIES = 3
+DELETE_BACKOFF = 1 # seconds, doubled for each retry
+
+
+class DeletionError(Exception):
+    pass
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Whether a failed delete is worth retrying: connection problems,
+    timeouts, and server errors, but not e.g. 403 or 404.
+
+    """
+    if isinstance(error, HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        return status is None or status >= 500 or status == 429
+    return isinstance(error, (ConnectionError, Timeout))
+
+
+def is_missing(error: Exception) -> bool:
+    """
+    Whether a delete failed because the resource does not exist,
+    e.g. because an earlier attempt, whose response was lost,
+    or an interrupted run, already deleted it.
+
+    """
+    return (
+        isinstance(error, HTTPError)
+        and error.response is not None
+        and error.response.status_code == 404
+    )
+
+
+def ancestors(path: str) -> Iterator[str]:
+    directory = path.rpartition('/')[0]
+    while directory:
+        yield directory
+        directory = directory.rpartition('/')[0]
+
+
+def count_subtrees(paths: Iterable[str]) -> Counter:
+    """
+    Count the number of paths below each directory.
+
+    """
+    counts = Counter()
+    for path in paths:
+        counts.update(ancestors(path))
+    return counts
+
+
+def collapse(
+    resources: Iterable[str],
+    totals: Counter,
+    root: Optional[str] = None,
+    keep: Collection[str] = (),
+) -> list:
+    """
+    Replace deletes of all resources in a directory with
+    a single delete of the directory itself.
+
+    Parameters
+    ----------
+    resources: paths to delete
+    totals: the number of resources below each directory, before deletion,
+            as returned by count_subtrees
+    root: only directories below root are collapsed
+    keep: directories which must not be removed, e.g. those with
+          resources which are about to be transferred into them
+
+    Returns
+    -------
+    list, of paths, where the top-most removed directories
+    replace the resources they contained
+
+    """
+    resources = list(resources)
+    removed = count_subtrees(resources)
+    below = f'{root.rstrip("/")}/' if root else ''
+    complete = {
+        directory for directory, count in removed.items()
+        if count == totals.get(directory) and directory.startswith(below)
+        and directory not in keep
+    }
+    if not complete:
+        return resources
+    collapsed, seen = [], set()
+    for path in resources:
+        top = None
+        for directory in ancestors(path):
+            if directory in complete:
+                top = directory
+        if top is None:
+            collapsed.append(path)
+        elif top not in seen:
+            seen.add(top)
+            collapsed.append(top)
+    debug_step(f'collapsed {len(resources)} deletes into {len(collapsed)}')
+    return collapsed
+
+
+class BulkDeleter(object):
+
+    """
+    Delete many resources, with bounded concurrency, and retries.
+
+    The delete callable is invoked with a resource, from worker
+    threads, and must raise an exception on failure - functions
+    decorated with handle_request_errors exit instead, so pass
+    their __wrapped__ attribute. Failures for which is_retryable
+    is True are retried, with exponential backoff. Resources which
+    no longer exist (see is_missing) count as deleted. Once all
+    resources have been processed, a DeletionError is raised
+    if any of them could not be deleted.
+
+    An optional on_done callable is invoked, from the calling
+    thread, for each successfully deleted resource, e.g.
+    to record progress in a request cache.
+
+    """
+
+    def __init__(
+        self,
+        delete: Callable[[str], object],
+        workers: int = DELETE_WORKERS,
+        retries: int = DELETE_RETRIES,
+        backoff: float = DELETE_BACKOFF,
+        on_done: Optional[Callable[[str], None]] = None,
+        show_progress: bool = True,
+    ) -> None:
+        self.delete = delete
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.backoff = backoff
+        self.on_done = on_done
+        self.show_progress = show_progress
+        self.stopped = threading.Event()
+
+    def _delete(self, resource: str) -> str:
+        attempt = 0
+        while True:
+            try:
+                self.delete(resource)
+                return resource
+            except Exception as e:
+                if is_missing(e):
+                    debug_step(f'already deleted: {resource}')
+                    return resource
+                attempt += 1
+                if attempt > self.retries or not is_retryable(e) or self.stopped.is_set():
+                    raise
+                debug_step(f'retrying delete of {resource} ({attempt}/{self.retries}): {e}')
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def run(self, resources: Iterable[str]) -> list:
+        """
+        Delete resources, returning the list of deleted resources.
+
+        """
+        resources = list(resources)
+        if not resources:
+            return []
+        deleted, failed = [], {}
+        progress = Progress(disable=not self.show_progress)
+        task = progress.add_task('deleting', total=len(resources))
+        with progress, ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {}
+            queue = iter(resources)
+            try:
+                while True:
+                    # keep at most two resources per worker queued
+                    for resource in queue:
+                        pending[executor.submit(self._delete, resource)] = resource
+                        if len(pending) >= self.workers * 2:
+                            break
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        resource = pending.pop(future)
+                        progress.advance(task)
+                        try:
+                            future.result()
+                        except Exception as e:
+                            failed[resource] = e
+                            continue
+                        deleted.append(resource)
+                        if self.on_done:
+                            self.on_done(resource)
+            except BaseException:
+                self.stopped.set()
+                for future in pending:
+                    future.cancel()
+                raise
+        if failed:
+            for resource, error in failed.items():
+                debug_step(f'could not delete {resource}: {error}')
+            raise DeletionError(
+                f'could not delete {len(failed)} of {len(resources)} resources, '
+                f'e.g. {next(iter(failed))}: {next(iter(failed.values()))}'
+            )
+        return deleted
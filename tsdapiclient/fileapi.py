@@ -7,7 +7,7 @@ import os
 import pathlib
 
 from functools import cmp_to_key
-from typing import Optional, Union, Any, Iterable
+from typing import Optional, Union, Any, Iterable, Callable
 from urllib.parse import quote, unquote
 
 import humanfriendly
@@ -25,22 +25,30 @@ try:
         nacl_encrypt_header,
         nacl_encode_header,
         nacl_decrypt_data,
+        nacl_crypt_chunks,
+        crypto_workers,
+        crypto_read_ahead,
+        invalidate_server_public_key,
     )
     LIBSODIUM_AVAILABLE = True
 except OSError:
     LIBSODIUM_AVAILABLE = False
 
-from tsdapiclient.authapi import maybe_refresh
+from tsdapiclient.authapi import TokenManager
 from tsdapiclient.client_config import ENV, API_VERSION
+from tsdapiclient.deletion import BulkDeleter, DeletionError, DELETE_WORKERS
 from tsdapiclient.tools import (
     handle_request_errors,
     debug_step,
     HELP_URL,
     file_api_url,
     HOSTS,
-    get_claims,
     Retry,
 )
+from tsdapiclient.transport import http
+
+NACL_CHUNKSIZE = 4*1024*1024 # bytes, per encrypted frame of downloads, independent of reads
+
 
 class Bar:
     """Simple progress bar.
@@ -137,6 +145,22 @@ def upload_resource_name(filename: str, is_dir: bool, group: Optional[str] = Non
     return str(resource)
 
 
+def _check_encrypted_response(
+    env: str,
+    pnum: str,
+    resp: requests.Response,
+    public_key: Optional["libnacl.public.PublicKey"],
+) -> None:
+    """
+    Forget the cached server public key, if the server rejected
+    a request with encrypted data, e.g. after a key rotation,
+    so that the next transfer fetches the current key.
+
+    """
+    if public_key and resp.status_code == 400:
+        invalidate_server_public_key(env, pnum)
+
+
 def lazy_reader(
     filename: str,
     chunksize: int,
@@ -163,6 +187,11 @@ def lazy_reader(
     so callers can get that information. 2) If the caller does provide
     a nonce and key, then only bytes are returned.
 
+    Encrypted chunks are memoryviews of a few buffers, which are read
+    into again, later, so callers must send, or copy, each chunk before
+    taking the next. At most max(chunksize, CRYPTO_READ_AHEAD) bytes
+    of them are held, see crypto_read_ahead.
+
     """
     enc_nonce, enc_key = None, None
     if public_key and not (nonce and key):
@@ -186,29 +215,105 @@ def lazy_reader(
             f.seek(next_offset)
         if with_progress:
             bar = _init_progress_bar(1, chunksize, filename)
-        while True:
-            if with_progress:
-                try:
-                    bar.next()
-                except ZeroDivisionError:
-                    pass
-            data = f.read(chunksize)
-            if not data:
+        if public_key:
+            workers = crypto_workers(chunksize)
+            read_ahead = crypto_read_ahead(chunksize, workers)
+            # one buffer per chunk in flight, see nacl_crypt_chunks
+            ring = read_ahead + 1
+        buffers = []
+        def read_chunks() -> Iterable[bytes]:
+            read = 0
+            while True:
                 if with_progress:
-                    bar.finish()
-                break
-            else:
+                    try:
+                        bar.next()
+                    except ZeroDivisionError:
+                        pass
                 if public_key:
-                    data = nacl_encrypt_data(data, nonce, key)
-                    if enc_nonce and enc_key:
-                        yield data, enc_nonce, enc_key, chunksize
-                    else:
-                        yield data
+                    # encrypted in place by nacl_crypt_chunks
+                    if read < ring:
+                        buffers.append(bytearray(chunksize))
+                    buffer = buffers[read % ring]
+                    data = memoryview(buffer)[:f.readinto(buffer)]
+                    read += 1
+                else:
+                    data = f.read(chunksize)
+                if not data:
+                    if with_progress:
+                        bar.finish()
+                    break
+                yield data
+        if public_key:
+            # encrypted on a thread pool, ahead of the caller sending them
+            for data in nacl_crypt_chunks(
+                read_chunks(), nonce, key, workers=workers, read_ahead=read_ahead,
+            ):
+                if enc_nonce and enc_key:
+                    yield data, enc_nonce, enc_key, chunksize
+                else:
+                    yield data
+        else:
+            for data in read_chunks():
+                if nonce and key:
+                    yield data
                 else:
-                    if nonce and key:
-                        yield data
-                    else:
-                        yield data, enc_nonce, enc_key, chunksize
+                    yield data, enc_nonce, enc_key, chunksize
+
+
+class FileBody(object):
+
+    """
+    The body of a streamed upload: a file, read, and optionally encrypted,
+    with lazy_reader, as it is sent. Like a file, it continues where
+    it was, if iterated again, until rewound, so that a request which
+    failed part way, can be retried from the start (see retry.replayable).
+
+    With public_key, the nonce and key, sent in the request's headers,
+    must be given. Each chunk is encrypted as a stream of its own, so
+    sending it again, with the same nonce and key, sends the same data.
+
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        chunksize: int,
+        offset: int = 0,
+        with_progress: bool = False,
+        public_key: Optional["libnacl.public.PublicKey"] = None,
+        nonce: Optional[bytes] = None,
+        key: Optional[bytes] = None,
+    ) -> None:
+        if public_key and not (nonce and key):
+            raise ValueError('encrypted bodies need a nonce and key')
+        self.filename = filename
+        self.chunksize = chunksize
+        self.offset = offset
+        self.with_progress = with_progress
+        self.public_key = public_key
+        self.nonce = nonce
+        self.key = key
+        self.reader = None
+
+    def __iter__(self) -> Iterable[bytes]:
+        if self.reader is None:
+            self.reader = lazy_reader(
+                self.filename,
+                self.chunksize,
+                next_offset=self.offset,
+                with_progress=self.with_progress,
+                public_key=self.public_key,
+                # so the lazy_reader knows to return bytes only
+                nonce=self.nonce or True,
+                key=self.key or True,
+            )
+        return self.reader
+
+    def rewind(self) -> None:
+        """Start again from offset, closing the file, and stopping encryption."""
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
 
 
 @handle_request_errors
@@ -221,12 +326,13 @@ def streamfile(
     group: Optional[str] = None,
     backend: str = 'files',
     is_dir: bool = False,
-    session: Any = requests,
+    session: Any = http,
     set_mtime: bool = False,
     public_key: Optional["libnacl.public.PublicKey"] = None,
     api_key: Optional[str] = None,
     refresh_token: Optional[str] = None,
     refresh_target: Optional[int] = None,
+    token_manager: Optional[TokenManager] = None,
     remote_path: Optional[str] = None
 ) -> dict:
     """
@@ -250,10 +356,14 @@ def streamfile(
     api_key: client specific JWT allowing token refresh
     refresh_token: a JWT with which to obtain a new access token
     refresh_target: time around which to refresh (within a default range)
+    token_manager: shared tokens, used instead of token, api_key,
+                   refresh_token, and refresh_target
 
     """
-    tokens = maybe_refresh(env, pnum, api_key, token, refresh_token, refresh_target)
-    token = tokens.get('access_token') if tokens else token
+    manager = token_manager or TokenManager(
+        env, pnum, token, refresh_token, api_key=api_key, refresh_target=refresh_target,
+    )
+    token = manager.current()
     resource = upload_resource_name(filename, is_dir, group=group, remote_path=remote_path)
     endpoint=f"stream/{resource}?group={group}"
     url = f'{file_api_url(env, pnum, backend, endpoint=endpoint)}'
@@ -271,13 +381,12 @@ def streamfile(
         headers['Nacl-Key'] = nacl_encode_header(enc_key)
         headers['Nacl-Chunksize'] = str(chunksize)
     else:
-        # so the lazy_reader knows to return bytes only
-        nonce, key = True, True
+        nonce, key = None, None
     with Retry(
         session.put,
         url,
         headers,
-        lazy_reader(
+        FileBody(
             filename,
             chunksize,
             with_progress=True,
@@ -286,11 +395,10 @@ def streamfile(
             key=key,
         ),
     ) as retriable:
-        if retriable.get("new_session"):
-            session = retriable.get("new_session")
         resp = retriable.get("resp")
+        _check_encrypted_response(env, pnum, resp, public_key)
         resp.raise_for_status()
-    return {'response': resp, 'tokens': tokens, 'session': session}
+    return {'response': resp, 'tokens': manager.as_dict(), 'session': session}
 
 
 def print_export_list(data: dict) -> None:
@@ -310,7 +418,7 @@ def import_list(
     pnum: str,
     token: str,
     backend: str = 'files',
-    session: Any = requests,
+    session: Any = http,
     directory: Optional[str] = None,
     page: Optional[str] = None,
     group: Optional[str] = None,
@@ -356,7 +464,7 @@ def survey_list(
     pnum: str,
     token: str,
     backend: str = 'survey',
-    session: Any = requests,
+    session: Any = http,
     directory: Optional[str] = None,
     page: Optional[str] = None,
     group: Optional[str] = None,
@@ -396,15 +504,18 @@ def import_delete(
     pnum: str,
     token: str,
     filename: str,
-    session: Any = requests,
+    session: Any = http,
     group: Optional[str] = None,
     api_key: Optional[str] = None,
     refresh_token: Optional[str] = None,
     refresh_target: Optional[int] = None,
+    token_manager: Optional[TokenManager] = None,
     remote_path: Optional[str] = None,
 ) -> requests.Response:
-    tokens = maybe_refresh(env, pnum, api_key, token, refresh_token, refresh_target)
-    token = tokens.get("access_token") if tokens else token
+    manager = token_manager or TokenManager(
+        env, pnum, token, refresh_token, api_key=api_key, refresh_target=refresh_target,
+    )
+    token = manager.current()
     if remote_path:
         endpoint = f'stream/{group}{quote(remote_path)}{quote(filename)}'
     else:
@@ -414,7 +525,7 @@ def import_delete(
     print(f'deleting: {filename}')
     resp = session.delete(url, headers=headers)
     resp.raise_for_status()
-    return {'response': resp, 'tokens': tokens}
+    return {'response': resp, 'tokens': manager.as_dict()}
 
 @handle_request_errors
 def export_delete(
@@ -422,15 +533,18 @@ def export_delete(
     pnum: str,
     token: str,
     filename: str,
-    session: Any = requests,
+    session: Any = http,
     group: Optional[str] = None,
     api_key: Optional[str] = None,
     refresh_token: Optional[str] = None,
     refresh_target: Optional[int] = None,
+    token_manager: Optional[TokenManager] = None,
     remote_path: Optional[str] = None,
 ) -> requests.Response:
-    tokens = maybe_refresh(env, pnum, api_key, token, refresh_token, refresh_target)
-    token = tokens.get("access_token") if tokens else token
+    manager = token_manager or TokenManager(
+        env, pnum, token, refresh_token, api_key=api_key, refresh_target=refresh_target,
+    )
+    token = manager.current()
     if remote_path:
         endpoint = f'export{quote(remote_path)}{quote(filename)}'
     else:
@@ -440,7 +554,7 @@ def export_delete(
     print(f'deleting: {filename}')
     resp = session.delete(url, headers=headers)
     resp.raise_for_status()
-    return {'response': resp, 'tokens': tokens}
+    return {'response': resp, 'tokens': manager.as_dict()}
 
 
 @handle_request_errors
@@ -449,7 +563,7 @@ def export_list(
     pnum: str,
     token: str,
     backend: str = 'files',
-    session: Any = requests,
+    session: Any = http,
     directory: Optional[str] = None,
     page: Optional[str] = None,
     group: Optional[str] = None,
@@ -511,7 +625,7 @@ def export_head(
     filename: str,
     token: str,
     backend: str = 'files',
-    session: Any = requests,
+    session: Any = http,
     remote_path: Optional[str] = None,
 ) -> requests.Response:
     headers = {'Authorization': 'Bearer {0}'.format(token), "Accept-Encoding": "*"}
@@ -524,6 +638,29 @@ def export_head(
     return resp
 
 
+def _frames(chunks: Iterable[bytes], size: int) -> Iterable[bytearray]:
+    """
+    Copy chunks, as received, into buffers of exactly size bytes,
+    except the last, which can be shorter. Each buffer is new, so it
+    can be decrypted in place, and kept, while the next is filled.
+
+    """
+    frame, filled = bytearray(size), 0
+    for chunk in chunks:
+        view = memoryview(chunk)
+        while view:
+            n = min(size - filled, len(view))
+            frame[filled:filled + n] = view[:n]
+            filled += n
+            view = view[n:]
+            if filled == size:
+                yield frame
+                frame, filled = bytearray(size), 0
+    if filled:
+        del frame[filled:]
+        yield frame
+
+
 @handle_request_errors
 def export_get(
     env: str,
@@ -534,7 +671,7 @@ def export_get(
     etag: Optional[str] = None,
     dev_url: Optional[str] = None,
     backend: str = 'files',
-    session: Any = requests,
+    session: Any = http,
     no_print_id: bool = False,
     set_mtime: bool = False,
     nobar: bool = False,
@@ -542,8 +679,10 @@ def export_get(
     api_key: Optional[str] = None,
     refresh_token: Optional[str] = None,
     refresh_target: Optional[int] = None,
+    token_manager: Optional[TokenManager] = None,
     public_key: Optional["libnacl.public.PublicKey"] = None,
     remote_path: Optional[str] = None,
+    nacl_chunksize: int = NACL_CHUNKSIZE,
 ) -> dict:
     """
     Download a file to the current directory.
@@ -554,7 +693,7 @@ def export_get(
     pnum: project number
     filename: filename to download
     token: JWT
-    chunksize: bytes per iteration
+    chunksize: bytes per read from the network
     etag: content reference for remote resource
     dev_url: development url
     backend: API backend
@@ -566,11 +705,17 @@ def export_get(
     api_key: client specific JWT allowing token refresh
     refresh_token: a JWT with which to obtain a new access token
     refresh_target: time around which to refresh (within a default range)
+    token_manager: shared tokens, used instead of token, api_key,
+                   refresh_token, and refresh_target
     public_key: encrypt/decrypt data on-the-fly
+    nacl_chunksize: bytes per encrypted frame, when using public_key,
+                    which are buffered from reads, of any size
 
     """
-    tokens = maybe_refresh(env, pnum, api_key, token, refresh_token, refresh_target)
-    token = tokens.get("access_token") if tokens else token
+    manager = token_manager or TokenManager(
+        env, pnum, token, refresh_token, api_key=api_key, refresh_target=refresh_target,
+    )
+    token = manager.current()
     filemode = 'wb'
     current_file_size = None
     headers = {'Authorization': f'Bearer {token}', "Accept-Encoding": "*"}
@@ -627,17 +772,25 @@ def export_get(
         enc_key = nacl_encrypt_header(public_key, key)
         headers['Nacl-Nonce'] = nacl_encode_header(enc_nonce)
         headers['Nacl-Key'] = nacl_encode_header(enc_key)
-        headers['Nacl-Chunksize'] = str(chunksize)
+        headers['Nacl-Chunksize'] = str(nacl_chunksize)
     with session.get(url, headers=headers, stream=True) as r:
+        _check_encrypted_response(env, pnum, r, public_key)
         r.raise_for_status()
         with open(unquote(filename), filemode) as f:
-            for chunk in r.iter_content(chunk_size=chunksize):
-                if chunk:
-                    if public_key:
-                        chunk = nacl_decrypt_data(chunk, nonce, key)
-                    f.write(chunk)
-                    if not nobar:
-                        bar.next()
+            def received() -> Iterable[bytes]:
+                for chunk in r.iter_content(chunk_size=chunksize):
+                    if chunk:
+                        if not nobar:
+                            bar.next()
+                        yield chunk
+            chunks = received()
+            if public_key:
+                # the server encrypts frames of nacl_chunksize, whatever the
+                # read size, decrypted in place, on a thread pool, while the
+                # next frames are received
+                chunks = nacl_crypt_chunks(_frames(chunks, nacl_chunksize), nonce, key)
+            for chunk in chunks:
+                f.write(chunk)
             if not nobar:
                 bar.next()
     if not nobar:
@@ -656,7 +809,7 @@ def export_get(
         except OSError:
             print(f'{err}: {filename} - {err_consequence}')
             print('issue due to local operating system problem')
-    return {'filename': filename, 'tokens': tokens}
+    return {'filename': filename, 'tokens': manager.as_dict()}
 
 
 def _resumable_url(
@@ -728,10 +881,11 @@ def get_resumable(
     backend: str = 'files',
     is_dir: bool = False,
     key: Optional[str] = None,
-    session: Any = requests,
+    session: Any = http,
     api_key: Optional[str] = None,
     refresh_token: Optional[str] = None,
     refresh_target: Optional[int] = None,
+    token_manager: Optional[TokenManager] = None,
     remote_path: Optional[str] = None,
 ) -> dict:
     """
@@ -758,12 +912,14 @@ def get_resumable(
     elif not upload_id and is_dir and key:
         url = '{0}?key={1}'.format(url, quote(key, safe=''))
     debug_step(f'fetching resumables info, using: {url}')
-    tokens = maybe_refresh(env, pnum, api_key, token, refresh_token, refresh_target)
-    token = tokens.get("access_token") if tokens else token
+    manager = token_manager or TokenManager(
+        env, pnum, token, refresh_token, api_key=api_key, refresh_target=refresh_target,
+    )
+    token = manager.current()
     headers = {'Authorization': f'Bearer {token}'}
     resp = session.get(url, headers=headers)
     data = json.loads(resp.text)
-    return {'overview': data, 'tokens': tokens}
+    return {'overview': data, 'tokens': manager.as_dict()}
 
 
 def initiate_resumable(
@@ -780,13 +936,15 @@ def initiate_resumable(
     stop_at: Optional[int] = None,
     backend: str = 'files',
     is_dir: bool = False,
-    session: Any = requests,
+    session: Any = http,
     set_mtime: bool = False,
     public_key: Optional["libnacl.public.PublicKey"] = None,
     api_key: Optional[str] = None,
     refresh_token: Optional[str] = None,
     refresh_target: Optional[int] = None,
+    token_manager: Optional[TokenManager] = None,
     remote_path: Optional[str] = None,
+    on_chunk: Optional[Callable[[str, int], None]] = None,
 ) -> dict:
     """
     Performs a resumable upload, either by resuming a partial one,
@@ -816,9 +974,16 @@ def initiate_resumable(
     api_key: client specific JWT allowing token refresh
     refresh_token: a JWT with which to obtain a new access token
     refresh_target: time around which to refresh (within a default range)
+    token_manager: shared tokens, used instead of token, api_key,
+                   refresh_token, and refresh_target
+    on_chunk: called with the upload id, and the number of bytes
+              committed, after each chunk
 
     """
     to_resume = False
+    manager = token_manager or TokenManager(
+        env, pnum, token, refresh_token, api_key=api_key, refresh_target=refresh_target,
+    )
     if not new:
         key = _resumable_key(is_dir, filename)
         data = get_resumable(
@@ -832,18 +997,15 @@ def initiate_resumable(
             is_dir=is_dir,
             key=key,
             session=session,
-            api_key=api_key,
-            refresh_token=refresh_token,
-            refresh_target=refresh_target,
+            token_manager=manager,
             remote_path=remote_path,
         )
-        if data.get('tokens'):
-            tokens = data.get('tokens')
-            token = tokens.get("access_token")
-            refresh_token = tokens.get("refresh_token")
-            refresh_target = get_claims(token).get('exp')
         if not data.get('overview', {}).get('id'):
-            pass
+            if is_dir and upload_id:
+                # a stale id from a directory transfer cache,
+                # the upload has completed, or been deleted
+                debug_step(f'resumable {upload_id} not found, starting a new upload')
+                upload_id = None
         else:
             to_resume = data.get('overview')
     if dev_url:
@@ -866,10 +1028,9 @@ def initiate_resumable(
                 session=session,
                 set_mtime=set_mtime,
                 public_key=public_key,
-                api_key=api_key,
-                refresh_token=refresh_token,
-                refresh_target=refresh_target,
+                token_manager=manager,
                 remote_path=remote_path,
+                on_chunk=on_chunk,
             )
         except Exception as e:
             print(e)
@@ -890,10 +1051,9 @@ def initiate_resumable(
             session=session,
             set_mtime=set_mtime,
             public_key=public_key,
-            api_key=api_key,
-            refresh_token=refresh_token,
-            refresh_target=refresh_target,
+            token_manager=manager,
             remote_path=remote_path,
+            on_chunk=on_chunk,
         )
 
 
@@ -904,14 +1064,17 @@ def _complete_resumable(
     token: str,
     url: str,
     bar: Bar,
-    session: Any = requests,
+    session: Any = http,
     mtime: Optional[str] = None,
     api_key: Optional[str] = None,
     refresh_token: Optional[str] = None,
     refresh_target: Optional[int] = None,
+    token_manager: Optional[TokenManager] = None,
 ) -> dict:
-    tokens = maybe_refresh(env, pnum, api_key, token, refresh_token, refresh_target)
-    token = tokens.get("access_token") if tokens else token
+    manager = token_manager or TokenManager(
+        env, pnum, token, refresh_token, api_key=api_key, refresh_target=refresh_target,
+    )
+    token = manager.current()
     headers = {'Authorization': f'Bearer {token}'}
     if mtime:
         headers['Modified-Time'] = mtime
@@ -920,7 +1083,7 @@ def _complete_resumable(
     resp.raise_for_status()
     bar.finish()
     debug_step('finished')
-    return {'response': json.loads(resp.text), 'tokens': tokens}
+    return {'response': json.loads(resp.text), 'tokens': manager.as_dict()}
 
 
 @handle_request_errors
@@ -936,32 +1099,33 @@ def _start_resumable(
     stop_at: Optional[int] = None,
     backend: str = 'files',
     is_dir: bool = False,
-    session: Any = requests,
+    session: Any = http,
     set_mtime: bool = False,
     public_key: Optional["libnacl.public.PublicKey"] = None,
     api_key: Optional[str] = None,
     refresh_token: Optional[str] = None,
     refresh_target: Optional[int] = None,
+    token_manager: Optional[TokenManager] = None,
     remote_path: Optional[str] = None,
+    on_chunk: Optional[Callable[[str, int], None]] = None,
 ) -> dict:
     """
     Start a new resumable upload, reding a file, chunk-by-chunk
     and performing a PATCH request per chunk.
 
     """
+    manager = token_manager or TokenManager(
+        env, pnum, token, refresh_token, api_key=api_key, refresh_target=refresh_target,
+    )
     url = _resumable_url(env, pnum, filename, dev_url, backend, is_dir, group=group, remote_path=remote_path)
-    headers = {'Authorization': f'Bearer {token}'}
+    headers = {}
     current_mtime = os.stat(filename).st_mtime if set_mtime else None
     if set_mtime:
         headers['Modified-Time'] = str(current_mtime)
     chunk_num = 1
+    offset = 0
     for chunk, enc_nonce, enc_key, ch_size in lazy_reader(filename, chunksize, public_key=public_key):
-        tokens = maybe_refresh(env, pnum, api_key, token, refresh_token, refresh_target)
-        if tokens:
-            token = tokens.get("access_token")
-            refresh_token = tokens.get("refresh_token")
-            refresh_target = get_claims(token).get('exp')
-            headers['Authorization'] = f'Bearer {token}'
+        headers['Authorization'] = f'Bearer {manager.current()}'
         if public_key:
             headers['Content-Type'] = 'application/octet-stream+nacl'
             headers['Nacl-Nonce'] = nacl_encode_header(enc_nonce)
@@ -972,10 +1136,12 @@ def _start_resumable(
         else:
             parmaterised_url = '{0}?chunk={1}&id={2}'.format(url, str(chunk_num), upload_id)
         debug_step(f'sending chunk {chunk_num}, using {parmaterised_url}')
-        with Retry(session.patch, parmaterised_url, headers, chunk) as retriable:
-            if retriable.get("new_session"):
-                session = retriable.get("new_session")
+        # chunks of an upload which exists are sent again, while the
+        # first, which starts one, is retried only if it was declined
+        retry = True if upload_id else None
+        with Retry(session.patch, parmaterised_url, headers, chunk, retry=retry) as retriable:
             resp = retriable.get("resp")
+            _check_encrypted_response(env, pnum, resp, public_key)
             resp.raise_for_status()
             data = json.loads(resp.text)
         if chunk_num == 1:
@@ -986,6 +1152,9 @@ def _start_resumable(
             print('Upload id: {0}'.format(upload_id))
             bar = _init_progress_bar(chunk_num, chunksize, filename)
         bar.next()
+        offset += len(chunk)
+        if on_chunk:
+            on_chunk(upload_id, offset)
         if stop_at:
             if chunk_num == stop_at:
                 print('stopping at chunk {0}'.format(chunk_num))
@@ -1002,13 +1171,9 @@ def _start_resumable(
         bar,
         session=session,
         mtime=str(current_mtime),
-        api_key=api_key,
-        refresh_token=refresh_token,
-        refresh_target=refresh_target,
+        token_manager=manager,
     )
-    if not tokens:
-        tokens = resp.get('tokens')
-    return {'response': resp.get('response'), 'tokens': tokens, 'session': session}
+    return {'response': resp.get('response'), 'tokens': manager.as_dict(), 'session': session}
 
 
 @handle_request_errors
@@ -1023,13 +1188,15 @@ def _continue_resumable(
     dev_url: Optional[str] = None,
     backend: str = 'files',
     is_dir: bool = False,
-    session: Any = requests,
+    session: Any = http,
     set_mtime: bool = False,
     public_key: Optional["libnacl.public.PublicKey"] = None,
     api_key: Optional[str] = None,
     refresh_token: Optional[str] = None,
     refresh_target: Optional[int] = None,
+    token_manager: Optional[TokenManager] = None,
     remote_path: Optional[str] = None,
+    on_chunk: Optional[Callable[[str, int], None]] = None,
 ) -> dict:
     """
     Continue a resumable upload, reding a file, from the
@@ -1038,9 +1205,11 @@ def _continue_resumable(
     before resume.
 
     """
-    tokens = {}
+    manager = token_manager or TokenManager(
+        env, pnum, token, refresh_token, api_key=api_key, refresh_target=refresh_target,
+    )
     url = _resumable_url(env, pnum, filename, dev_url, backend, is_dir, group=group, remote_path=remote_path)
-    headers = {'Authorization': f'Bearer {token}'}
+    headers = {}
     current_mtime = os.stat(filename).st_mtime if set_mtime else None
     if set_mtime:
         headers['Modified-Time'] = str(current_mtime)
@@ -1056,12 +1225,7 @@ def _continue_resumable(
     for chunk, enc_nonce, enc_key, ch_size in lazy_reader(
         filename, chunksize, previous_offset, next_offset, verify, server_chunk_md5, public_key=public_key,
     ):
-        tokens = maybe_refresh(env, pnum, api_key, token, refresh_token, refresh_target)
-        if tokens:
-            token = tokens.get("access_token")
-            refresh_token = tokens.get("refresh_token")
-            refresh_target = get_claims(token).get('exp')
-            headers['Authorization'] = f'Bearer {token}'
+        headers['Authorization'] = f'Bearer {manager.current()}'
         if public_key:
             headers['Content-Type'] = 'application/octet-stream+nacl'
             headers['Nacl-Nonce'] = nacl_encode_header(enc_nonce)
@@ -1069,15 +1233,17 @@ def _continue_resumable(
             headers['Nacl-Chunksize'] = str(ch_size)
         parmaterised_url = '{0}?chunk={1}&id={2}'.format(url, str(chunk_num), upload_id)
         debug_step(f'sending chunk {chunk_num}, using {parmaterised_url}')
-        with Retry(session.patch, parmaterised_url, headers, chunk) as retriable:
-            if retriable.get("new_session"):
-                session = retriable.get("new_session")
+        with Retry(session.patch, parmaterised_url, headers, chunk, retry=True) as retriable:
             resp = retriable.get("resp")
+            _check_encrypted_response(env, pnum, resp, public_key)
             resp.raise_for_status()
             data = json.loads(resp.text)
         bar.next()
         upload_id = data['id']
         chunk_num = data.get("max_chunk") + 1
+        next_offset += len(chunk)
+        if on_chunk:
+            on_chunk(upload_id, next_offset)
     if not group:
         group = '{0}-member-group'.format(pnum)
     parmaterised_url = '{0}?chunk={1}&id={2}&group={3}'.format(url, 'end', upload_id, group)
@@ -1089,13 +1255,9 @@ def _continue_resumable(
         bar,
         session=session,
         mtime=str(current_mtime),
-        api_key=api_key,
-        refresh_token=refresh_token,
-        refresh_target=refresh_target,
+        token_manager=manager,
     )
-    if not tokens:
-        tokens = resp.get('tokens')
-    return {'response': resp.get('response'), 'tokens': tokens, 'session': session}
+    return {'response': resp.get('response'), 'tokens': manager.as_dict(), 'session': session}
 
 
 @handle_request_errors
@@ -1107,7 +1269,7 @@ def delete_resumable(
     upload_id: str,
     dev_url: Optional[str] = None,
     backend: str = 'files',
-    session: Any = requests,
+    session: Any = http,
 ) -> dict:
     """
     Delete a specific incomplete resumable.
@@ -1147,10 +1309,11 @@ def delete_all_resumables(
     token: str,
     dev_url: Optional[str] = None,
     backend: str = 'files',
-    session: Any = requests,
+    session: Any = http,
+    workers: int = DELETE_WORKERS,
 ):
     """
-    Delete all incomplete resumables.
+    Delete all incomplete resumables, concurrently.
 
     Parameters
     ----------
@@ -1160,6 +1323,7 @@ def delete_all_resumables(
     dev_url: pass a complete url (useful for development)
     backend: API backend
     session:  requests.session, optional
+    workers: number of concurrent deletes
 
     Returns
     -------
@@ -1169,9 +1333,14 @@ def delete_all_resumables(
     overview = get_resumable(
         env, pnum, token, dev_url=dev_url, backend=backend, session=session
     ).get('overview')
-    all_resumables = overview['resumables']
-    for r in all_resumables:
-        delete_resumable(
-            env, pnum, token, r['filename'], r['id'],
-            dev_url=dev_url, backend=backend, session=session
-        )
+    filenames = {r['id']: r['filename'] for r in overview['resumables']}
+    try:
+        BulkDeleter(
+            lambda upload_id: delete_resumable.__wrapped__(
+                env, pnum, token, filenames[upload_id], upload_id,
+                dev_url=dev_url, backend=backend, session=session
+            ),
+            workers=workers,
+        ).run(filenames)
+    except DeletionError as e:
+        sys.exit(str(e))
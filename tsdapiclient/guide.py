@@ -1,4 +1,4 @@
-from tsdapiclient.tools import HELP_URL
+from tsdapiclient.client_config import HELP_URL
 
 topics = """
 config
@@ -53,6 +53,15 @@ To control which folders and files are included:
 
     tacl p11 --upload mydirectory --ignore-prefixes .git,build,dist --ignore-suffixes .pyc,.db
 
+gitignore-style patterns are also supported, including negation:
+
+    tacl p11 --upload mydirectory --ignore-patterns '*.tmp,build/,!build/keep.txt'
+    tacl p11 --upload mydirectory --ignore-file .gitignore
+
+As with git, the last matching pattern decides, and files inside an
+ignored directory cannot be re-included - such directories are skipped
+entirely. The same rules apply to downloads and sync.
+
 To disable the resume functionality for a directory:
 
     tacl p11 --upload mydirectory --cache-disable
@@ -97,6 +106,10 @@ To delete a downloadable resource:
 
     tacl p11 --download-delete myfile
 
+Several resources can be deleted at once, concurrently:
+
+    tacl p11 --download-delete myfile --download-delete mydir
+
 To view and manage the directory download cache:
 
     tacl p11 --download-cache-show
@@ -149,6 +162,59 @@ and invoke tacl as such:
     tacl p11 --api-key @path-to-file --upload myfile
 
 Invoking tacl like this will over-ride any other local config.
+
+When running many short, automated transfers, a local token broker
+avoids authenticating for each of them:
+
+    tacl --broker
+
+While it runs, tacl processes using --basic or --api-key get their
+access tokens from the broker, which authenticates once, per project,
+token type and API key, and refreshes tokens in the background. The
+broker listens on $XDG_CONFIG_HOME/tacl/broker.sock (or the path in
+$TACL_BROKER_SOCKET), only accessible to your user. Without a running
+broker, tacl authenticates as usual.
+
+Many transfers can be run by one tacl process, authenticating once,
+listing them in a YAML manifest:
+
+    concurrency: 4
+    defaults:
+      encrypt: true
+    jobs:
+      - upload: results.csv
+      - upload_sync: instrument-data
+        keep_missing: true
+        group: p11-special-group
+      - download: report.pdf
+        remote_path: /reports
+      - download_sync: exports
+
+    tacl p11 --basic --batch manifest.yaml
+
+Jobs accept the options group, remote_path, ignore_prefixes,
+ignore_suffixes, ignore_patterns, ignore_file, transfer_order,
+cache, keep_missing, keep_updated, encrypt, chunk_size, and
+resumable_threshold. Jobs on different local paths run concurrently,
+and jobs on the same, or nested paths, run in order. All jobs share
+the same tokens, which are refreshed in the background. Jobs with
+a higher priority (default 0) are started first.
+
+Machines which transfer data repeatedly, such as instrument PCs,
+can instead run a transfer agent, which keeps running, with its
+connections and tokens, and runs jobs as they arrive:
+
+    tacl p11 --basic --agent --spool-dir /data/tacl-spool
+
+Jobs are submitted as manifests, like the one above, written to
+the spool directory (under a name starting with a dot, renamed
+to end in .yaml when complete). They are moved to accepted/ or
+rejected/ once read. Python programs can submit jobs over the
+agent's socket, with tsdapiclient.agent.agent_submit. Paths are
+relative to the working directory of the agent, which runs up to
+--agent-concurrency jobs at a time (default 2). Jobs are kept in
+a queue, so jobs which are interrupted, e.g. by a reboot, run
+again when the agent is restarted.
 """
 
 links = f"""
@@ -222,6 +288,65 @@ Using on-the-fly encryption, with automatic server-side decryption:
 
     tacl p11 --upload-sync mydir --encrypt
 
+Before transferring, tacl prints a plan: the number of files, the
+total size, and an estimated duration, based on the throughput of
+the previous directory transfer. The order of transfers can be
+chosen, e.g. to complete as many files as possible within the time
+limit of a batch job:
+
+    tacl p11 --upload-sync mydir --transfer-order small-first
+
+Other orders are largest-first, newest-first, and mixed, which
+interleaves files larger than --resumable-threshold with smaller
+ones, so that both make progress. The same option applies to
+directory uploads, and downloads.
+
+On Linux, uploads can be kept in sync continuously - after an
+initial sync, tacl keeps running, and uploads files as they
+change, deleting remote files that are removed locally
+(unless --keep-missing is set):
+
+    tacl p11 --upload-sync mydir --watch
+
+A file is only uploaded once it has not been written to for
+--watch-settle seconds (default 5), so files which are still
+being written are not sent partially. A full sync is also run
+every --reconcile-interval seconds (default 3600), and whenever
+changes might have been missed.
+
+Downloads can be kept in sync continuously by polling:
+
+    tacl p11 --download-sync mydir --follow
+
+New and changed remote files are downloaded without re-scanning
+the local directory. Polls start every --poll-interval seconds
+(default 30), and back off to every 10 minutes while nothing
+changes. Files modified in place remotely are picked up by the
+full sync, run every --reconcile-interval seconds.
+
+Several tacl processes, e.g. on different hosts, can share a large
+directory transfer, using a queue in a directory which they can
+all access, such as a shared filesystem:
+
+    tacl p11 --upload mydir --queue-dir /shared/tacl-queue
+
+Run the same command, from the same working directory, on each
+host. One process plans the transfer, and all of them transfer
+files from the queue. The same option applies to directory
+downloads, and sync. Claimed files are renewed every few minutes,
+so if a process stops, its files are picked up by the others.
+Hosts' clocks should be synchronised.
+
+Alternatively, without any shared state, a directory transfer can
+be split into N disjoint parts, e.g. over the tasks of a job array,
+each task handling part K, from 1 to N:
+
+    tacl p11 --upload-sync mydir --shard $K/8
+
+Files are assigned to parts by a hash of their path, so every
+task agrees on the split, and each part has its own cache. The
+same option applies to directory uploads and downloads.
+
 """
 
 encryption = f"""
@@ -265,5 +390,13 @@ Encrypted download:
       <---------------------- encrypt(data, nonce, key)
     write data
 
+The public key is cached for a day, per project, in
+$XDG_DATA_HOME/tacl (~/.local/share/tacl by default), and
+fetched again if the server rejects data encrypted with it.
+
+To measure encryption throughput on a machine, e.g. when choosing
+a --chunk-size for encrypted transfers, run, offline:
+
+    python -m tsdapiclient.benchmark --output results.json
 
 """
@@ -0,0 +1,177 @@
+"""Compiled ignore rules for directory transfers."""
+
+import re
+
+from typing import Iterable, Optional
+
+from tsdapiclient.tools import debug_step
+
+
+def _glob_to_regex(pattern: str) -> str:
+    """
+    Translate a single gitignore-style glob into a regular expression
+    fragment, matched against a relative path.
+
+    Supported syntax: *, ?, [...], ** (any number of directories).
+
+    """
+    i, n = 0, len(pattern)
+    out = []
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern[i:i+3] == '**/':
+                out.append('(?:.*/)?')
+                i += 3
+                continue
+            elif pattern[i:i+2] == '**':
+                out.append('.*')
+                i += 2
+                continue
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = pattern.find(']', i + 2 if pattern[i+1:i+2] in ('!', ']') else i + 1)
+            if j == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i+1:j].replace('\\', '\\\\')
+                if body.startswith('!'):
+                    body = f'^{body[1:]}'
+                out.append(f'[{body}]')
+                i = j
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+def _pattern_to_regex(pattern: str) -> str:
+    """
+    Translate a gitignore pattern (without leading !) into a regex.
+
+    Paths are tested relative to the transfer root, and directories
+    are tested with a trailing slash, so that patterns ending in /
+    only match directories.
+
+    """
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    body = _glob_to_regex(pattern)
+    start = '^' if anchored else '(?:^|/)'
+    # the lookbehind stops a trailing * from matching an empty name
+    end = '(?<!/)/$' if dir_only else '(?<!/)/?$'
+    return f'{start}{body}{end}'
+
+
+class IgnoreRules(object):
+
+    """
+    A compiled set of ignore rules, shared by local and remote scans.
+
+    Three kinds of rules are supported, and evaluated in this order:
+
+    - prefixes: directories, relative to the transfer root, which start
+      with the given string (e.g. .git,build,dist)
+    - suffixes: files ending with the given string (e.g. .pyc,.db)
+    - patterns: gitignore-style globs, including negation with !
+
+    As with gitignore, the last matching rule decides, and files inside
+    an ignored directory cannot be re-included, which means that ignored
+    directories can be pruned from a scan altogether.
+
+    Consecutive rules of the same kind (ignore or re-include) are
+    combined into a single regular expression, so the common case
+    of no negation needs one regex search per path.
+
+    """
+
+    def __init__(
+        self,
+        prefixes: Optional[Iterable[str]] = None,
+        suffixes: Optional[Iterable[str]] = None,
+        patterns: Optional[Iterable[str]] = None,
+    ) -> None:
+        rules = []
+        for prefix in prefixes or []:
+            if prefix:
+                rules.append((f'^{re.escape(prefix.strip("/"))}.*/$', False))
+        for suffix in suffixes or []:
+            if suffix:
+                rules.append((f'{re.escape(suffix)}$', False))
+        for pattern in patterns or []:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            negate = pattern.startswith('!')
+            if negate:
+                pattern = pattern[1:]
+            elif pattern.startswith('\\'):
+                pattern = pattern[1:]
+            rules.append((_pattern_to_regex(pattern), negate))
+        self.groups = []
+        for regex, negate in rules:
+            if self.groups and self.groups[-1][1] == negate:
+                self.groups[-1][0].append(regex)
+            else:
+                self.groups.append(([regex], negate))
+        self.groups = [
+            (re.compile('|'.join(f'(?:{r})' for r in regexes)).search, negate)
+            for regexes, negate in self.groups
+        ]
+        # evaluated last to first, since the last matching rule wins
+        self.groups.reverse()
+
+    @classmethod
+    def from_options(
+        cls,
+        prefixes: Optional[str] = None,
+        suffixes: Optional[str] = None,
+        patterns: Optional[str] = None,
+        ignore_file: Optional[str] = None,
+    ) -> "IgnoreRules":
+        """
+        Create rules from comma separated command-line values,
+        and optionally a gitignore-style file.
+
+        """
+        def split(data: Optional[str]) -> list:
+            if not data:
+                return []
+            debug_step(f'ignoring patterns: {data}')
+            return data.replace(' ', '').split(',')
+        all_patterns = split(patterns)
+        if ignore_file:
+            debug_step(f'reading ignore patterns from {ignore_file}')
+            with open(ignore_file, 'r') as f:
+                all_patterns.extend(line.rstrip('\n') for line in f)
+        return cls(split(prefixes), split(suffixes), all_patterns)
+
+    def __bool__(self) -> bool:
+        return bool(self.groups)
+
+    def ignores(self, path: str, is_dir: bool = False) -> bool:
+        """
+        Decide whether a path, relative to the transfer root,
+        should be ignored.
+
+        """
+        if not path:
+            return False # never ignore the root itself
+        if is_dir:
+            path = f'{path}/'
+        for search, negate in self.groups:
+            if search(path):
+                return not negate
+        return False
+
+    def can_prune(self, directory: str) -> bool:
+        """
+        Decide whether a directory, and everything below it,
+        can be skipped during a scan.
+
+        """
+        return self.ignores(directory, is_dir=True)
@@ -0,0 +1,360 @@
+"""Sorted, out-of-core resource inventories, and diffing for sync."""
+
+import hashlib
+import heapq
+import marshal
+import tempfile
+
+from array import array
+from operator import itemgetter
+from typing import Iterable, Iterator, Optional, Union
+
+try:
+    import numpy
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from tsdapiclient.tools import debug_step
+
+MEMORY_BUDGET = 2*1000*1000 # entries held in memory before spilling to disk
+SPILL_BLOCK_SIZE = 10000
+MTIME_TOLERANCE = 0.001 # seconds
+
+
+def as_number(reference: Union[str, float, int, None]) -> Optional[float]:
+    """
+    Interpret an integrity reference as a number, if possible.
+
+    References arrive either as numbers, or as strings, which
+    may be 'None' when the API did not provide a value.
+
+    """
+    if reference is None or isinstance(reference, (int, float)):
+        return reference
+    try:
+        return float(reference)
+    except ValueError:
+        return None
+
+
+class CompactInventory(object):
+
+    """
+    An array-backed inventory of (path, mtime, size) entries.
+
+    Instead of one tuple of full path strings per entry, which costs
+    around 200 bytes, directory prefixes are interned, file names are
+    packed into a single UTF-8 buffer, and numeric data is stored in
+    typed arrays - roughly 60 bytes per entry. The position of an
+    entry is its path ID.
+
+    Each path also gets a 128 bit key (blake2b), so that two
+    inventories can be compared without building path strings,
+    vectorised with NumPy if it is installed.
+
+    Missing mtimes are stored as NaN, missing sizes as -1, and
+    references which are not numbers (e.g. etags) are kept aside,
+    in a dict keyed by path ID.
+
+    """
+
+    def __init__(self) -> None:
+        self.directories = []
+        self.directory_ids = {}
+        self.path_directories = array('I')
+        self.names = bytearray()
+        self.name_offsets = array('Q', [0])
+        self.mtimes = array('d')
+        self.sizes = array('q')
+        self.keys = array('Q')
+        self.references = {}
+
+    def __len__(self) -> int:
+        return len(self.mtimes)
+
+    def add(
+        self,
+        path: str,
+        reference: Union[str, float, int, None] = None,
+        size: Optional[int] = None,
+    ) -> int:
+        directory, _, name = path.rpartition('/')
+        prefix = f'{directory}/' if directory else ''
+        directory_id = self.directory_ids.get(prefix)
+        if directory_id is None:
+            directory_id = len(self.directories)
+            self.directory_ids[prefix] = directory_id
+            self.directories.append(prefix)
+        path_id = len(self.mtimes)
+        self.path_directories.append(directory_id)
+        self.names += name.encode('utf-8', 'surrogateescape')
+        self.name_offsets.append(len(self.names))
+        mtime = as_number(reference)
+        if mtime is None and reference is not None and str(reference) != 'None':
+            self.references[path_id] = reference
+        self.mtimes.append(float('nan') if mtime is None else mtime)
+        self.sizes.append(-1 if size is None else int(size))
+        self.keys.frombytes(hashlib.blake2b(path.encode('utf-8', 'surrogateescape'), digest_size=16).digest())
+        return path_id
+
+    def extend(self, entries: Iterable[tuple]) -> "CompactInventory":
+        for entry in entries:
+            self.add(*entry)
+        return self
+
+    def path(self, path_id: int) -> str:
+        start, end = self.name_offsets[path_id], self.name_offsets[path_id + 1]
+        name = self.names[start:end].decode('utf-8', 'surrogateescape')
+        return f'{self.directories[self.path_directories[path_id]]}{name}'
+
+    def entry(self, path_id: int) -> tuple:
+        mtime = self.mtimes[path_id]
+        size = self.sizes[path_id]
+        return (
+            self.path(path_id),
+            self.references.get(path_id, None if mtime != mtime else mtime),
+            None if size < 0 else size,
+        )
+
+    def __iter__(self) -> Iterator[tuple]:
+        for path_id in range(len(self)):
+            yield self.entry(path_id)
+
+    def sorted(self) -> list:
+        return sorted(self, key=itemgetter(0))
+
+    def diff(
+        self,
+        target: "CompactInventory",
+        keep_missing: bool = False,
+        keep_updated: bool = False,
+        tolerance: float = MTIME_TOLERANCE,
+        entries: bool = False,
+    ) -> tuple:
+        """
+        Compare this (source) inventory to a target inventory,
+        returning lists of paths to transfer, and to delete,
+        with the same semantics as diff_sorted. With entries,
+        lists of (path, reference, size) entries are returned.
+
+        """
+        if not NUMPY_AVAILABLE:
+            transfers, deletes = [], []
+            for action, entry in diff_sorted(
+                self.sorted(),
+                target.sorted(),
+                keep_missing=keep_missing,
+                keep_updated=keep_updated,
+                tolerance=tolerance,
+                entries=entries,
+            ):
+                (deletes if action == 'delete' else transfers).append(entry)
+            return transfers, deletes
+        ns, nt = len(self), len(target)
+        source_keys = numpy.frombuffer(self.keys, dtype=numpy.uint64).reshape(-1, 2)
+        target_keys = numpy.frombuffer(target.keys, dtype=numpy.uint64).reshape(-1, 2)
+        # sort both sides together, so equal keys become neighbours,
+        # with the source entry first
+        hi = numpy.concatenate((source_keys[:, 0], target_keys[:, 0]))
+        lo = numpy.concatenate((source_keys[:, 1], target_keys[:, 1]))
+        side = numpy.concatenate((numpy.zeros(ns, numpy.int8), numpy.ones(nt, numpy.int8)))
+        order = numpy.lexsort((side, lo, hi))
+        hi, lo, side = hi[order], lo[order], side[order]
+        pairs = numpy.nonzero(
+            (hi[1:] == hi[:-1]) & (lo[1:] == lo[:-1]) & (side[:-1] == 0) & (side[1:] == 1)
+        )[0]
+        matched_source = order[pairs]
+        matched_target = order[pairs + 1] - ns
+        source_only = numpy.ones(ns, dtype=bool)
+        source_only[matched_source] = False
+        # compare modified times and sizes of the resources on both sides
+        source_mtimes = numpy.frombuffer(self.mtimes, dtype=numpy.float64)[matched_source]
+        target_mtimes = numpy.frombuffer(target.mtimes, dtype=numpy.float64)[matched_target]
+        source_sizes = numpy.frombuffer(self.sizes, dtype=numpy.int64)[matched_source]
+        target_sizes = numpy.frombuffer(target.sizes, dtype=numpy.int64)[matched_target]
+        delta = source_mtimes - target_mtimes
+        sizes_differ = (source_sizes >= 0) & (target_sizes >= 0) & (source_sizes != target_sizes)
+        source_nan, target_nan = numpy.isnan(source_mtimes), numpy.isnan(target_mtimes)
+        within = numpy.abs(delta) <= tolerance
+        newer = delta > tolerance if keep_updated else ~within
+        changed = numpy.where(
+            ~source_nan & ~target_nan,
+            numpy.where(within, sizes_differ, newer),
+            sizes_differ | (source_nan != target_nan),
+        )
+        transfer_ids = numpy.concatenate(
+            (numpy.nonzero(source_only)[0], matched_source[changed])
+        ).tolist()
+        if self.references or target.references:
+            # non-numeric references need a string comparison
+            transfer_ids = set(transfer_ids)
+            for s, t in zip(matched_source.tolist(), matched_target.tolist()):
+                if s in self.references or t in target.references:
+                    if needs_transfer(self.entry(s), target.entry(t), keep_updated, tolerance):
+                        transfer_ids.add(s)
+                    else:
+                        transfer_ids.discard(s)
+            transfer_ids = sorted(transfer_ids)
+        transfers = [self.entry(i) if entries else self.path(i) for i in transfer_ids]
+        deletes = []
+        if not keep_missing:
+            target_only = numpy.ones(nt, dtype=bool)
+            target_only[matched_target] = False
+            deletes = [
+                target.entry(i) if entries else target.path(i)
+                for i in numpy.nonzero(target_only)[0].tolist()
+            ]
+        return transfers, deletes
+
+
+class ExternalSorter(object):
+
+    """
+    Sort an arbitrarily large stream of (path, reference, size) entries.
+
+    Entries are collected in a CompactInventory until the memory budget
+    is reached, at which point they are sorted by path, and spilled to a
+    temporary file as a sorted run. Iterating over the sorter merges all
+    runs, so memory use is bounded by the budget, and one block per run.
+    If nothing was spilled, the in-memory inventory is available as
+    the inventory attribute, for vectorised comparisons.
+
+    Use as a context manager, so spilled runs are always removed.
+
+    """
+
+    def __init__(
+        self,
+        memory_budget: int = MEMORY_BUDGET,
+        spill_dir: Optional[str] = None,
+    ) -> None:
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.buffer = CompactInventory()
+        self.runs = []
+        self.count = 0
+
+    def __enter__(self) -> "ExternalSorter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def inventory(self) -> Optional[CompactInventory]:
+        return self.buffer if not self.runs else None
+
+    def add(self, entry: tuple) -> None:
+        self.buffer.add(*entry)
+        self.count += 1
+        if len(self.buffer) >= self.memory_budget:
+            self._spill()
+
+    def extend(self, entries: Iterable[tuple]) -> "ExternalSorter":
+        for entry in entries:
+            self.add(entry)
+        return self
+
+    def _spill(self) -> None:
+        entries = self.buffer.sorted()
+        run = tempfile.TemporaryFile(dir=self.spill_dir)
+        for i in range(0, len(entries), SPILL_BLOCK_SIZE):
+            marshal.dump(entries[i:i+SPILL_BLOCK_SIZE], run)
+        debug_step(f'spilled {len(entries)} inventory entries to disk')
+        self.runs.append(run)
+        self.buffer = CompactInventory()
+
+    @staticmethod
+    def _read_run(run: "tempfile.TemporaryFile") -> Iterator[tuple]:
+        run.seek(0)
+        while True:
+            try:
+                block = marshal.load(run)
+            except EOFError:
+                break
+            yield from block
+
+    def __iter__(self) -> Iterator[tuple]:
+        entries = self.buffer.sorted()
+        if not self.runs:
+            return iter(entries)
+        streams = [self._read_run(run) for run in self.runs]
+        streams.append(iter(entries))
+        return heapq.merge(*streams, key=itemgetter(0))
+
+    def close(self) -> None:
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self.buffer = CompactInventory()
+
+
+def needs_transfer(
+    source: tuple,
+    target: tuple,
+    keep_updated: bool = False,
+    tolerance: float = MTIME_TOLERANCE,
+) -> bool:
+    """
+    Decide whether a resource present on both sides must be transferred.
+
+    Numeric references (mtimes) are compared as numbers, within a
+    tolerance, so formatting differences between local and remote
+    values do not cause re-transfers. Sizes are compared when both
+    sides provide them. Non-numeric references (e.g. etags) are
+    compared for equality.
+
+    """
+    source_size = source[2] if len(source) > 2 else None
+    target_size = target[2] if len(target) > 2 else None
+    sizes_differ = (
+        source_size is not None
+        and target_size is not None
+        and int(source_size) != int(target_size)
+    )
+    source_mtime, target_mtime = as_number(source[1]), as_number(target[1])
+    if source_mtime is None or target_mtime is None:
+        return sizes_differ or str(source[1]) != str(target[1])
+    delta = source_mtime - target_mtime
+    if abs(delta) <= tolerance:
+        return sizes_differ
+    if keep_updated:
+        return delta > 0
+    return True
+
+
+def diff_sorted(
+    source: Iterable[tuple],
+    target: Iterable[tuple],
+    keep_missing: bool = False,
+    keep_updated: bool = False,
+    tolerance: float = MTIME_TOLERANCE,
+    entries: bool = False,
+) -> Iterator[tuple]:
+    """
+    Merge two inventories, sorted by path, yielding
+    ('transfer', path) and ('delete', path) actions,
+    or with entries, the full entry instead of the path.
+
+    Only one entry from each side is held at a time,
+    so inventories can be streamed from disk.
+
+    """
+    source, target = iter(source), iter(target)
+    s, t = next(source, None), next(target, None)
+    while s is not None or t is not None:
+        if t is None or (s is not None and s[0] < t[0]):
+            yield 'transfer', s if entries else s[0]
+            s = next(source, None)
+        elif s is None or t[0] < s[0]:
+            if not keep_missing:
+                yield 'delete', t if entries else t[0]
+            t = next(target, None)
+        else:
+            if needs_transfer(s, t, keep_updated=keep_updated, tolerance=tolerance):
+                yield 'transfer', s if entries else s[0]
+            s, t = next(source, None), next(target, None)
@@ -0,0 +1,259 @@
+"""Retries of HTTP requests, with backoff, and a budget shared by all of them."""
+
+import email.utils
+import random
+import threading
+import time
+
+from datetime import timezone
+from typing import Any, Callable, Optional
+
+import requests
+
+from requests.exceptions import (ConnectionError, ConnectTimeout, ReadTimeout,
+                                 RequestException)
+
+RETRY_ATTEMPTS = 5 # attempts per request, including the first
+RETRY_BACKOFF = 0.5 # seconds, doubled per attempt, before jitter
+RETRY_MAX_BACKOFF = 30 # seconds, at most, between attempts
+RETRY_MAX_RETRY_AFTER = 300 # seconds, longer Retry-After responses are not waited for
+RETRY_BUDGET = 20 # retries available at once, across all requests
+RETRY_BUDGET_RATIO = 0.1 # retries earned per request
+
+# not PATCH, since the first chunk of a resumable upload starts a new
+# one - later chunks, which carry its id, and which the API accepts
+# again, are sent with retry=True
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+# status: methods for which it is retried, None for all, since the
+# request was declined, rather than processed - a DELETE retried after
+# the first attempt succeeded gets a 404, which BulkDeleter counts as
+# deleted
+RETRY_STATUSES = {
+    429: None,
+    500: IDEMPOTENT_METHODS,
+    502: IDEMPOTENT_METHODS,
+    503: None,
+    504: IDEMPOTENT_METHODS,
+}
+
+# (exception, methods), the first matching exception applies
+RETRY_EXCEPTIONS = [
+    (ConnectTimeout, None),
+    (ConnectionError, IDEMPOTENT_METHODS),
+    (ReadTimeout, IDEMPOTENT_METHODS),
+]
+
+
+class RetryBudget(object):
+
+    """
+    Retries available to all requests, so that when the API is down,
+    or overloaded, clients soon stop adding retries to its load.
+
+    Each retry uses one, of at most capacity, and each request earns
+    ratio of one back, so that, over time, at most ratio of requests
+    are retries.
+
+    """
+
+    def __init__(self, capacity: float = RETRY_BUDGET, ratio: float = RETRY_BUDGET_RATIO) -> None:
+        self.capacity = capacity
+        self.ratio = ratio
+        self.available = capacity
+        self.lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self.lock:
+            self.available = min(self.capacity, self.available + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            if self.available < 1:
+                return False
+            self.available -= 1
+            return True
+
+
+class RetryPolicy(object):
+
+    """
+    When, and how long after, to send a request again.
+
+    Parameters
+    ----------
+    attempts: number of attempts per request, including the first
+    backoff: seconds before the first retry, doubled for each one after it,
+             and jittered, by waiting a random time up to that
+    max_backoff: seconds, at most, between attempts
+    max_retry_after: seconds, at most, to wait for a Retry-After header,
+                     responses asking for longer are returned
+    statuses: status codes to retry, with the methods they apply to,
+              or None for all, see RETRY_STATUSES
+    exceptions: list of (exception, methods) to retry, see RETRY_EXCEPTIONS
+    budget: RetryBudget, shared by all requests using the policy
+
+    """
+
+    def __init__(
+        self,
+        attempts: int = RETRY_ATTEMPTS,
+        backoff: float = RETRY_BACKOFF,
+        max_backoff: float = RETRY_MAX_BACKOFF,
+        max_retry_after: float = RETRY_MAX_RETRY_AFTER,
+        statuses: Optional[dict] = None,
+        exceptions: Optional[list] = None,
+        budget: Optional[RetryBudget] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.statuses = RETRY_STATUSES if statuses is None else statuses
+        self.exceptions = RETRY_EXCEPTIONS if exceptions is None else exceptions
+        self.budget = budget or RetryBudget()
+        self.sleep = sleep
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait after a failed attempt, with full jitter."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    def retry_after(self, response: requests.Response) -> Optional[float]:
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        return max(0.0, when.timestamp() - time.time())
+
+    def retries_status(self, method: str, status: int, idempotent: bool = False) -> bool:
+        if status not in self.statuses:
+            return False
+        methods = self.statuses[status]
+        return methods is None or idempotent or method in methods
+
+    def retries_exception(self, method: str, error: Exception, idempotent: bool = False) -> bool:
+        for exception, methods in self.exceptions:
+            if isinstance(error, exception):
+                return methods is None or idempotent or method in methods
+        return False
+
+    def call(
+        self,
+        method: str,
+        send: Callable[[], requests.Response],
+        url: str = '',
+        attempts: Optional[int] = None,
+        rewind: Optional[Callable[[], None]] = None,
+        idempotent: bool = False,
+    ) -> requests.Response:
+        """
+        Call send, which sends a request, until it succeeds, or may
+        not be retried, returning the last response, or raising the
+        last exception. send must be able to send the same request
+        again, after calling rewind, if given, see replayable.
+        Idempotent requests are retried as such, whatever their method.
+
+        """
+        from tsdapiclient.tools import debug_step
+        method = method.upper()
+        attempts = attempts or self.attempts
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            attempt += 1
+            response, error = None, None
+            try:
+                response = send()
+            except RequestException as e:
+                if attempt >= attempts or not self.retries_exception(method, e, idempotent):
+                    raise
+                error = e
+                reason = e.__class__.__name__
+                delay = self.delay(attempt)
+            else:
+                if attempt >= attempts or not self.retries_status(method, response.status_code, idempotent):
+                    return response
+                reason = str(response.status_code)
+                delay = self.retry_after(response)
+                if delay is None:
+                    delay = self.delay(attempt)
+                elif delay > self.max_retry_after:
+                    debug_step(f'{method} {url}: {reason}, not waiting {delay:.0f}s to retry')
+                    return response
+            if not self.budget.withdraw():
+                debug_step(f'{method} {url}: {reason}, retry budget exhausted')
+                if error:
+                    raise error
+                return response
+            if response is not None:
+                _release(response)
+            debug_step(f'{method} {url}: {reason}, attempt {attempt + 1}/{attempts} in {delay:.1f}s')
+            self.sleep(delay)
+            if rewind:
+                rewind()
+
+
+def _release(response: requests.Response) -> None:
+    """Read, and close, a response, so its connection returns to the pool."""
+    try:
+        response.content
+    except RequestException:
+        pass
+    response.close()
+
+
+def replayable(data: Any = None, files: Any = None) -> bool:
+    """
+    Whether a request body can be sent again, unlike e.g. a generator.
+    Bodies which are read as they are sent, such as fileapi.FileBody,
+    are replayable if they have a rewind method, which restarts them.
+
+    """
+    if files:
+        return False
+    return hasattr(data, 'rewind') or isinstance(
+        data, (type(None), bytes, bytearray, memoryview, str, dict, list, tuple)
+    )
+
+
+class RetryingSession(requests.Session):
+
+    """
+    A session which retries requests according to retry_policy,
+    on the same connection pool, unless called with retry=False,
+    or with a body which cannot be sent again. Requests called with
+    retry=True are retried as idempotent ones, whatever their method.
+
+    """
+
+    def __init__(self, retry_policy: RetryPolicy) -> None:
+        super().__init__()
+        self.retry_policy = retry_policy
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        *args: Any,
+        retry: Optional[bool] = None,
+        **kwargs: Any,
+    ) -> requests.Response:
+        def send() -> requests.Response:
+            return super(RetryingSession, self).request(method, url, *args, **kwargs)
+        data = args[1] if len(args) > 1 else kwargs.get('data')
+        files = args[4] if len(args) > 4 else kwargs.get('files')
+        if retry is False or not replayable(data, files):
+            return send()
+        return self.retry_policy.call(
+            method, send, url, rewind=getattr(data, 'rewind', None), idempotent=bool(retry),
+        )
@@ -0,0 +1,195 @@
+"""Ordering of directory transfers, and pre-transfer plans."""
+
+import json
+import os
+
+from typing import Callable, Optional
+
+import humanfriendly
+
+from tsdapiclient.client_config import SCHEDULING_POLICIES
+from tsdapiclient.tools import debug_step, get_data_path
+
+LARGE_FILE_THRESHOLD = 1000*1000*1000 # bytes, the large lane of the mixed policy
+LARGE_FILE_SHARE = 0.5 # fraction of bytes given to the large lane
+MIN_THROUGHPUT_SAMPLE = 1000*1000*10 # bytes, before a throughput is recorded
+
+
+class TransferScheduler(object):
+
+    """
+    Decide the order in which the resources of a directory are transferred.
+
+    Policies:
+    - scan: the order in which resources were found
+    - small-first: maximise the number of files completed early
+    - largest-first: start the longest transfers as early as possible
+    - newest-first: most recently modified files first
+    - mixed: two lanes, files smaller and larger than large_threshold,
+      each ordered small-first, interleaved so that the large lane gets
+      large_share of the bytes, and small files keep flowing while
+      large files are transferred
+
+    Sizes and modified times are provided by a describe callable,
+    which maps a resource to a (size, mtime) tuple, either of which
+    can be None, if unknown - such resources are ordered last.
+
+    """
+
+    def __init__(
+        self,
+        policy: str = 'scan',
+        large_threshold: int = LARGE_FILE_THRESHOLD,
+        large_share: float = LARGE_FILE_SHARE,
+    ) -> None:
+        if policy not in SCHEDULING_POLICIES:
+            raise ValueError(f'unknown transfer order: {policy}')
+        self.policy = policy
+        self.large_threshold = large_threshold
+        self.large_share = large_share
+
+    def order(self, resources: list, describe: Callable[[str], tuple]) -> list:
+        """
+        Order a list of (resource, integrity_reference) tuples.
+
+        """
+        if self.policy == 'scan' or len(resources) < 2:
+            return resources
+        described = [(item, describe(item[0])) for item in resources]
+        if self.policy == 'small-first':
+            described.sort(key=_size_key)
+        elif self.policy == 'largest-first':
+            described.sort(key=_size_key)
+            known = [d for d in described if d[1][0] is not None]
+            described = known[::-1] + described[len(known):]
+        elif self.policy == 'newest-first':
+            described.sort(key=lambda d: -d[1][1] if d[1][1] is not None else float('inf'))
+        elif self.policy == 'mixed':
+            described = self._interleave(described)
+        debug_step(f'ordered {len(resources)} resources: {self.policy}')
+        return [item for item, _ in described]
+
+    def _interleave(self, described: list) -> list:
+        small, large = [], []
+        for entry in sorted(described, key=_size_key):
+            size = entry[1][0]
+            (large if size is not None and size >= self.large_threshold else small).append(entry)
+        ordered = []
+        small_bytes, large_bytes = 0, 0
+        i, j = 0, 0
+        while i < len(small) or j < len(large):
+            large_due = (
+                large_bytes * (1 - self.large_share) <= small_bytes * self.large_share
+            )
+            if j < len(large) and (large_due or i >= len(small)):
+                ordered.append(large[j])
+                large_bytes += large[j][1][0]
+                j += 1
+            else:
+                ordered.append(small[i])
+                small_bytes += small[i][1][0] or 0
+                i += 1
+        return ordered
+
+    def plan(
+        self,
+        resources: list,
+        describe: Callable[[str], tuple],
+        deletes: int = 0,
+        throughput: Optional[float] = None,
+    ) -> str:
+        """
+        Summarise a transfer: number of files, bytes, and
+        an estimated duration, given a throughput in bytes/second.
+
+        """
+        total, unknown = plan_bytes(resources, describe)
+        lines = [
+            f'transfer plan ({self.policy}): {len(resources)} files, '
+            f'{humanfriendly.format_size(total)}'
+            + (f' ({unknown} files of unknown size)' if unknown else '')
+        ]
+        if self.policy == 'mixed':
+            large = [r for r in resources if (describe(r[0])[0] or 0) >= self.large_threshold]
+            large_total, _ = plan_bytes(large, describe)
+            lines.append(
+                f'large lane: {len(large)} files, {humanfriendly.format_size(large_total)}, '
+                f'small lane: {len(resources) - len(large)} files, '
+                f'{humanfriendly.format_size(total - large_total)}'
+            )
+        if deletes:
+            lines.append(f'{deletes} resources to delete')
+        if throughput:
+            lines.append(
+                f'estimated time: {humanfriendly.format_timespan(total / throughput)}, '
+                f'at {humanfriendly.format_size(throughput)}/s (previous transfer)'
+            )
+        elif total:
+            lines.append('estimated time: unknown, no previous transfers to estimate from')
+        return '\n'.join(lines)
+
+
+def _size_key(described: tuple) -> tuple:
+    size = described[1][0]
+    return (size is None, size or 0)
+
+
+def plan_bytes(resources: list, describe: Callable[[str], tuple]) -> tuple:
+    """
+    Sum the sizes of resources, returning (bytes, number of resources of unknown size).
+
+    """
+    total, unknown = 0, 0
+    for resource, _ in resources:
+        size = describe(resource)[0]
+        if size is None:
+            unknown += 1
+        else:
+            total += size
+    return total, unknown
+
+
+def _throughput_file(env: str, pnum: str) -> str:
+    return f'{get_data_path(env, pnum)}/throughput.json'
+
+
+def read_throughput(env: str, pnum: str, direction: str) -> Optional[float]:
+    """
+    Get the throughput (bytes/second) of the last directory transfer
+    in the given direction ('upload' or 'download'), if known.
+
+    """
+    try:
+        with open(_throughput_file(env, pnum)) as f:
+            return json.load(f).get(direction)
+    except (OSError, ValueError):
+        return None
+
+
+def record_throughput(
+    env: str,
+    pnum: str,
+    direction: str,
+    transferred: int,
+    seconds: float,
+) -> None:
+    """
+    Remember the throughput of a directory transfer, for later
+    estimates, if enough data was transferred to be representative.
+
+    """
+    if transferred < MIN_THROUGHPUT_SAMPLE or seconds <= 0:
+        return
+    path = _throughput_file(env, pnum)
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {}
+    data[direction] = transferred / seconds
+    try:
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(f'{path}.tmp', path)
+    except OSError as e:
+        debug_step(f'could not record throughput: {e}')
@@ -5,20 +5,34 @@ import time
 from datetime import datetime, timedelta
 from typing import Optional
 
-from rich.console import Console
-from rich.table import Table
-from rich.text import Text
-import yaml
-
+from tsdapiclient.store import store_for
 from tsdapiclient.tools import (check_if_exp_is_within_range,
                                 check_if_key_has_expired, debug_step,
                                 get_config_path, get_claims,
                                 check_if_key_has_expired,)
 
-SESSION_STORE = get_config_path() + '/session'
+
+def session_file() -> str:
+    return get_config_path() + '/session'
+
+def __getattr__(name: str) -> str:
+    # the path is resolved on first use, not on import
+    if name == 'SESSION_STORE':
+        return session_file()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def session_default() -> dict:
+    return {
+        'prod': {},
+        'alt': {},
+        'test': {},
+        'ec-prod': {},
+        'ec-test': {},
+        'dev': {},
+    }
 
 def session_file_exists() -> bool:
-    return False if not os.path.lexists(SESSION_STORE) else True
+    return False if not os.path.lexists(session_file()) else True
 
 def session_is_expired(env: str, pnum: str, token_type: str) -> bool:
     if not session_file_exists():
@@ -50,10 +64,8 @@ def session_expires_soon(env: str, pnum: str, token_type: str, minutes: int = 10
         debug_step('session will not expire soon')
         return False
 
-def session_read(session_store: str = SESSION_STORE) -> dict:
-    with open(session_store, 'r') as f:
-        data = yaml.load(f, Loader=yaml.Loader)
-    return data
+def session_read(session_store: Optional[str] = None) -> dict:
+    return store_for(session_store or session_file()).read()
 
 def session_update(
     env: str,
@@ -62,56 +74,39 @@ def session_update(
     token: str,
     refresh_token: Optional[str] = None,
 ) -> None:
-    default = {
-        'prod': {},
-        'alt': {},
-        'test': {},
-        'ec-prod': {},
-        'ec-test': {},
-        'dev': {},
-    }
-    if not session_file_exists():
-        debug_step('creating new tacl session store')
-        data = default
-    try:
-        data = session_read()
-    except FileNotFoundError:
-        data = default
-    target = data.get(env, {}).get(pnum, {})
-    target[token_type] = token
-    target[f'{token_type}_refresh'] = refresh_token
-    if not data.get(env):
-        data[env] = {}
-    data[env][pnum] = target
+    def update(data: Optional[dict]) -> dict:
+        if not data:
+            debug_step('creating new tacl session store')
+            data = session_default()
+        target = data.get(env, {}).get(pnum, {})
+        target[token_type] = token
+        target[f'{token_type}_refresh'] = refresh_token
+        if not data.get(env):
+            data[env] = {}
+        data[env][pnum] = target
+        return data
     debug_step('updating session')
-    with open(SESSION_STORE, 'w') as f:
-        f.write(yaml.dump(data, Dumper=yaml.Dumper))
+    store_for(session_file()).update(update)
 
 def session_token(env: str, pnum: str, token_type: str) -> str:
-    data = session_read()
+    data = session_read() or {}
     return data.get(env, {}).get(pnum, {}).get(token_type)
 
 def session_refresh_token(env: str, pnum: str, token_type: str) -> str:
-    data = session_read()
+    data = session_read() or {}
     return data.get(env, {}).get(pnum, {}).get(f'{token_type}_refresh')
 
 
 def session_clear() -> None:
-    data = {
-        'prod': {},
-        'alt': {},
-        'test': {},
-        'ec-prod': {},
-        'ec-test': {},
-        'dev': {},
-    }
-    with open(SESSION_STORE, 'w') as f:
-        f.write(yaml.dump(data, Dumper=yaml.Dumper))
+    store_for(session_file()).write(session_default())
 
-def session_print(session_file: str = SESSION_STORE) -> None:
+def session_print(session_file: Optional[str] = None) -> None:
+    from rich.console import Console
+    from rich.table import Table
+    from rich.text import Text
     console = Console()
     try:
-        data = session_read()
+        data = session_read(session_file)
     except FileNotFoundError:
         print("No session file found")
         exit(1)
@@ -0,0 +1,129 @@
+"""Cached, locked, and atomic YAML files, for the session and config."""
+
+import copy
+import os
+import tempfile
+import threading
+
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+import yaml
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+try:
+    from yaml import CSafeLoader as Loader, CSafeDumper as Dumper
+except ImportError:
+    from yaml import SafeLoader as Loader, SafeDumper as Dumper
+
+from tsdapiclient.tools import debug_step
+
+
+class YamlStore(object):
+
+    """
+    A YAML file, holding a dict, shared by concurrent tacl processes.
+
+    The file is parsed once per process, and again only if it has
+    changed on disk. Updates are made under an exclusive advisory
+    lock (on a separate lock file, where supported), re-reading the
+    file first, so that concurrent updates are not lost, and written
+    to a temporary file which is renamed into place, so that readers
+    never see a partially written file.
+
+    Use store_for to get the store of a given path.
+
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.data = None
+        self.signature = None
+        self.thread_lock = threading.RLock()
+
+    def _signature(self) -> tuple:
+        st = os.stat(self.path)
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def read(self) -> Optional[dict]:
+        """
+        Get a copy of the contents, raising FileNotFoundError
+        if the file does not exist.
+
+        """
+        with self.thread_lock:
+            signature = self._signature()
+            if signature != self.signature:
+                debug_step(f'reading {self.path}')
+                with open(self.path, 'r') as f:
+                    self.data = yaml.load(f, Loader=Loader)
+                self.signature = signature
+            return copy.deepcopy(self.data)
+
+    def write(self, data: dict) -> None:
+        with self.locked():
+            self._write(data)
+
+    def update(self, func: Callable[[Optional[dict]], dict]) -> dict:
+        """
+        Replace the contents with func(contents), atomically,
+        where contents is None if the file does not exist.
+
+        """
+        with self.locked():
+            try:
+                data = self.read()
+            except FileNotFoundError:
+                data = None
+            data = func(data)
+            self._write(data)
+            return data
+
+    def _write(self, data: dict) -> None:
+        directory = os.path.dirname(self.path) or '.'
+        try:
+            mode = os.stat(self.path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o600
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(self.path)}.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(yaml.dump(data, Dumper=Dumper))
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp, mode)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.data = copy.deepcopy(data)
+        self.signature = self._signature()
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        with self.thread_lock:
+            if not FCNTL_AVAILABLE:
+                yield
+                return
+            with open(f'{self.path}.lock', 'a') as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def store_for(path: str) -> YamlStore:
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = YamlStore(path)
+        return _stores[path]
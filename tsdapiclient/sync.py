@@ -1,13 +1,18 @@
 import os
 import time
 import shutil
+import socket
 import sqlite3
 import sys
+import threading
+import zlib
 
+from collections import Counter
 from contextlib import contextmanager
-from typing import ContextManager, Iterable, Optional
+from typing import Callable, ContextManager, Iterable, Iterator, Optional
 
 import click
+import humanfriendly
 import humanfriendly.tables
 import requests
 
@@ -17,10 +22,23 @@ try:
 except OSError:
     LIBSODIUM_AVAILABLE = False
 
+from tsdapiclient.authapi import TokenManager
+from tsdapiclient.deletion import (BulkDeleter, DeletionError, ancestors,
+                                   collapse, DELETE_WORKERS)
 from tsdapiclient.fileapi import (streamfile, initiate_resumable, import_list,
                                   export_list, export_get,
                                   import_delete, export_delete, survey_list)
-from tsdapiclient.tools import debug_step, get_data_path, get_claims
+from tsdapiclient.ignore import IgnoreRules
+from tsdapiclient.inventory import (ExternalSorter, as_number, diff_sorted,
+                                    MEMORY_BUDGET, MTIME_TOLERANCE)
+from tsdapiclient.scheduler import (TransferScheduler, plan_bytes,
+                                    read_throughput, record_throughput,
+                                    LARGE_FILE_THRESHOLD)
+from tsdapiclient.tools import debug_step, get_data_path
+from tsdapiclient.transport import shared_session
+
+QUEUE_LEASE = 300 # seconds, before claims of an unresponsive worker are recovered
+QUEUE_POLL = 10 # seconds, between checks while waiting for other workers
 
 
 @contextmanager
@@ -68,32 +86,116 @@ class CacheError(Exception):
     pass
 
 
+def worker_id() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def shard_of(path: str, count: int) -> int:
+    """
+    Assign a path to one of count shards, numbered from 1, using a hash
+    which is stable across processes, hosts, and Python versions.
+
+    """
+    return zlib.crc32(path.encode('utf-8', 'surrogateescape')) % count + 1
+
+
 class GenericRequestCache(object):
 
-    """sqlite-backed request cache."""
+    """
+    sqlite-backed request cache.
+
+    The cache acts as a journal of outstanding work, with one row per
+    resource, recording its status (pending, in-flight, done, failed),
+    the number of attempts, and for resumable uploads, the upload id
+    and the number of bytes committed by the API. Items are claimed
+    atomically, so several workers can share a journal.
+
+    The journal runs in WAL mode, and status updates are group-committed:
+    every commit_every items, or commit_interval seconds, whichever comes
+    first. After a crash, at most the uncommitted items are transferred,
+    or deleted, again, which is safe, since transfers are idempotent,
+    and deletes of resources which are already gone count as done.
+
+    Given a shared directory, e.g. on a network filesystem, the journal
+    is kept there instead, as a work queue for processes on several
+    hosts. WAL requires shared memory, which network filesystems do
+    not provide, so a shared journal uses a rollback journal, and
+    commits every update. Claims then carry a lease, which their
+    worker renews, and items whose lease has expired are returned
+    to the queue, so the work of crashed workers is not lost.
 
-    dbname = 'generic-request-cache.db'
+    """
 
-    def __init__(self, env: str, pnum: str) -> None:
-        self.path = f'{get_data_path(env, pnum)}/{self.dbname}'
+    dbname = 'generic-request-cache.db'
+    commit_every = 1000
+    commit_interval = 5 # seconds
+    journal_columns = [
+        ('status', "text not null default 'pending'"),
+        ('attempts', 'integer not null default 0'),
+        ('upload_id', 'text'),
+        ('committed_offset', 'integer not null default 0'),
+        ('claimed_by', 'text'),
+        ('updated_at', 'timestamp'),
+        ('lease_expires', 'real'),
+    ]
+    plan_table = 'tacl_plans'
+
+    def __init__(self, env: str, pnum: str, directory: Optional[str] = None) -> None:
+        self.shared = directory is not None
+        self.path = f'{directory if self.shared else get_data_path(env, pnum)}/{self.dbname}'
         try:
-            self.engine = sqlite3.connect(self.path)
+            if self.shared:
+                self.engine = sqlite3.connect(self.path, timeout=120)
+                self.engine.execute('pragma journal_mode=delete')
+                self.engine.execute('pragma synchronous=full')
+                self.commit_every = 1
+            else:
+                self.engine = sqlite3.connect(self.path, timeout=30)
+                self.engine.execute('pragma journal_mode=wal')
+                self.engine.execute('pragma synchronous=normal')
         except sqlite3.OperationalError as e:
             msg = f'cannot access request cache: {e}'
             raise CacheConnectionError(msg) from e
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    @staticmethod
+    def _table(key: str) -> str:
+        name = os.path.basename(key).replace('"', '""')
+        return f'"{name}"'
 
     def create(self, *, key: str) -> None:
+        columns = ''.join(
+            f',\n                {name} {definition}' for name, definition in self.journal_columns
+        )
         request_table_definition = f"""
-        \"{os.path.basename(key)}\"(
+        {self._table(key)}(
                 resource_path text not null unique,
                 created_at timestamp default current_timestamp,
-                integrity_reference text
+                integrity_reference text{columns}
             )"""
         try:
             with sqlite_session(self.engine) as session:
                 session.execute(
                     f'create table if not exists {request_table_definition}'
                 )
+                # caches created by earlier versions lack the journal columns
+                existing = [
+                    row[1] for row in session.execute(f'pragma table_info({self._table(key)})')
+                ]
+                for name, definition in self.journal_columns:
+                    if name not in existing:
+                        session.execute(
+                            f'alter table {self._table(key)} add column {name} {definition}'
+                        )
+                if self.shared:
+                    session.execute(
+                        f'create table if not exists {self.plan_table}( \
+                            key text primary key, \
+                            state text not null, \
+                            planner text, \
+                            lease_expires real)'
+                    )
         except Exception as e:
             msg = f'could not create request cache for {key}: {e}'
             raise CacheCreationError(msg) from e
@@ -104,8 +206,9 @@ class GenericRequestCache(object):
         try:
             with sqlite_session(self.engine) as session:
                 session.execute(
-                    f"insert into \"{os.path.basename(key)}\"(resource_path, integrity_reference) \
-                      values ('{item}', '{integrity_reference}')"
+                    f'insert into {self._table(key)}(resource_path, integrity_reference) \
+                      values (?, ?)',
+                    (item, integrity_reference),
                 )
         except sqlite3.IntegrityError as e:
             msg = f'{item} already cached for {key}'
@@ -116,7 +219,7 @@ class GenericRequestCache(object):
         return (item, integrity_reference)
 
     def add_many(self, *, key: str, items: list) -> bool:
-        stmt = f'insert into "{os.path.basename(key)}"(resource_path, integrity_reference) \
+        stmt = f'insert into {self._table(key)}(resource_path, integrity_reference) \
                  values (?, ?)'
         try:
             with sqlite_session(self.engine) as session:
@@ -132,17 +235,276 @@ class GenericRequestCache(object):
         return True
 
     def remove(self, *, key: str, item: str) -> str:
-        with sqlite_session(self.engine) as session:
-            session.execute(
-                f"delete from \"{os.path.basename(key)}\" where resource_path = '{item}'"
+        """
+        Remove an item, committing in groups.
+
+        """
+        self._write(f'delete from {self._table(key)} where resource_path = ?', (item,))
+        return item
+
+    def _write(self, stmt: str, params: tuple) -> None:
+        self.engine.execute(stmt, params)
+        self.uncommitted += 1
+        if (
+            self.uncommitted >= self.commit_every
+            or time.monotonic() - self.last_commit >= self.commit_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Commit pending updates.
+
+        """
+        self.engine.commit()
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    def claim(
+        self,
+        *,
+        key: str,
+        limit: int = 1,
+        worker: Optional[str] = None,
+        lease: Optional[float] = None,
+    ) -> list:
+        """
+        Atomically claim up to limit pending items, marking them as
+        in-flight, and incrementing their attempt count.
+
+        With a lease (seconds), in-flight items whose lease has
+        expired are first returned to the queue, and the claimed
+        items expire after the lease, unless renewed.
+
+        Returns a list of tuples:
+        (resource_path, integrity_reference, upload_id, committed_offset)
+
+        """
+        worker = worker if worker else worker_id()
+        now = time.time()
+        self.flush()
+        try:
+            # take the write lock before reading, so no
+            # other worker can claim the same items
+            self.engine.execute('begin immediate')
+            if lease:
+                self.engine.execute(self._recover_statement(key), (now,))
+            rows = self.engine.execute(
+                f"select resource_path, integrity_reference, upload_id, committed_offset \
+                  from {self._table(key)} where status = 'pending' order by rowid limit ?",
+                (limit,),
+            ).fetchall()
+            self.engine.executemany(
+                f"update {self._table(key)} set status = 'in-flight', attempts = attempts + 1, \
+                  claimed_by = ?, lease_expires = ?, updated_at = current_timestamp \
+                  where resource_path = ?",
+                [(worker, now + lease if lease else None, row[0]) for row in rows],
             )
+            self.engine.commit()
+        except sqlite3.OperationalError as e:
+            self.engine.rollback()
+            msg = f"{e}, call: create(key='{key}')"
+            raise CacheExistenceError(msg) from e
+        return rows
+
+    def _recover_statement(self, key: str) -> str:
+        return f"update {self._table(key)} set status = 'pending', claimed_by = null, \
+                 lease_expires = null where status = 'in-flight' and lease_expires < ?"
+
+    def recover(self, *, key: str) -> int:
+        """
+        Return in-flight items whose lease has expired to the queue.
+
+        """
+        try:
+            with sqlite_session(self.engine) as session:
+                count = session.execute(self._recover_statement(key), (time.time(),)).rowcount
+        except sqlite3.OperationalError as e:
+            msg = f"{e}, call: create(key='{key}')"
+            raise CacheExistenceError(msg) from e
+        if count:
+            debug_step(f'recovered {count} items with expired leases')
+        return count
+
+    def renew(self, *, key: str, worker: str, lease: float) -> int:
+        """
+        Extend the leases of all items claimed by worker, and of
+        its plan, if it is planning. Returns the number of items.
+
+        """
+        expires = time.time() + lease
+        try:
+            with sqlite_session(self.engine) as session:
+                count = session.execute(
+                    f"update {self._table(key)} set lease_expires = ? \
+                      where status = 'in-flight' and claimed_by = ?",
+                    (expires, worker),
+                ).rowcount
+                if self.shared:
+                    session.execute(
+                        f"update {self.plan_table} set lease_expires = ? \
+                          where key = ? and planner = ? and state = 'planning'",
+                        (expires, os.path.basename(key), worker),
+                    )
+        except sqlite3.OperationalError as e:
+            msg = f"{e}, call: create(key='{key}')"
+            raise CacheExistenceError(msg) from e
+        return count
+
+    def begin_plan(self, *, key: str, worker: str, lease: float) -> str:
+        """
+        Elect the worker which plans a shared transfer, i.e. which
+        finds the resources, and fills the queue.
+
+        Returns
+        -------
+        str, 'plan' if the calling worker should plan, 'wait' if
+        another worker is planning, and 'ready' once the queue is
+        filled. A planner which does not renew its lease is replaced.
+
+        """
+        name = os.path.basename(key)
+        now = time.time()
+        self.flush()
+        try:
+            self.engine.execute('begin immediate')
+            row = self.engine.execute(
+                f'select state, planner, lease_expires from {self.plan_table} where key = ?',
+                (name,),
+            ).fetchone()
+            if row and row[0] == 'ready':
+                state = 'ready'
+            elif row and row[1] != worker and (row[2] or 0) >= now:
+                state = 'wait'
+            else:
+                self.engine.execute(
+                    f"insert or replace into {self.plan_table}(key, state, planner, lease_expires) \
+                      values (?, 'planning', ?, ?)",
+                    (name, worker, now + lease),
+                )
+                state = 'plan'
+            self.engine.commit()
+        except sqlite3.OperationalError as e:
+            self.engine.rollback()
+            raise CacheError(f'could not plan shared transfer for {key}: {e}') from e
+        return state
+
+    def finish_plan(self, *, key: str, worker: str) -> None:
+        """
+        Mark the queue as filled, and ready to be worked on.
+
+        """
+        with sqlite_session(self.engine) as session:
+            count = session.execute(
+                f"update {self.plan_table} set state = 'ready', lease_expires = null \
+                  where key = ? and planner = ?",
+                (os.path.basename(key), worker),
+            ).rowcount
+        if not count:
+            raise CacheError(f'lost the plan for {key} to another worker')
+
+    def finish(self, *, key: str) -> bool:
+        """
+        Remove a queue, and its plan, once all items are done.
+        Returns False if items remain, True once removed, also
+        if another worker removed it first.
+
+        """
+        self.flush()
+        try:
+            self.engine.execute('begin immediate')
+            remaining = self.engine.execute(
+                f"select count(*) from {self._table(key)} where status != 'done'"
+            ).fetchone()[0]
+            if not remaining:
+                self.engine.execute(f'drop table {self._table(key)}')
+                if self.shared:
+                    self.engine.execute(
+                        f'delete from {self.plan_table} where key = ?',
+                        (os.path.basename(key),),
+                    )
+            self.engine.commit()
+        except sqlite3.OperationalError as e:
+            self.engine.rollback()
+            if 'no such table' in str(e):
+                return True
+            raise CacheDestroyError(f'could not finish queue for {key}: {e}') from e
+        return not remaining
+
+    def progress(self, *, key: str, item: str, upload_id: str, offset: int) -> None:
+        """
+        Record the upload id, and number of bytes committed, for an item.
+
+        """
+        self._write(
+            f'update {self._table(key)} set upload_id = ?, committed_offset = ?, \
+              updated_at = current_timestamp where resource_path = ?',
+            (upload_id, offset, item),
+        )
+
+    def complete(self, *, key: str, item: str) -> str:
+        self._write(
+            f"update {self._table(key)} set status = 'done', \
+              updated_at = current_timestamp where resource_path = ?",
+            (item,),
+        )
         return item
 
+    def fail(self, *, key: str, item: str) -> str:
+        self._write(
+            f"update {self._table(key)} set status = 'failed', \
+              updated_at = current_timestamp where resource_path = ?",
+            (item,),
+        )
+        self.flush()
+        return item
+
+    def requeue(self, *, key: str, statuses: tuple = ('in-flight', 'failed')) -> int:
+        """
+        Return items with the given statuses to the pending state,
+        e.g. those left in-flight by an interrupted run.
+
+        """
+        marks = ', '.join('?' for _ in statuses)
+        try:
+            with sqlite_session(self.engine) as session:
+                count = session.execute(
+                    f"update {self._table(key)} set status = 'pending', claimed_by = null \
+                      where status in ({marks})",
+                    statuses,
+                ).rowcount
+        except sqlite3.OperationalError as e:
+            msg = f"{e}, call: create(key='{key}')"
+            raise CacheExistenceError(msg) from e
+        return count
+
+    def summary(self, *, key: str) -> dict:
+        """
+        Count items per status, and sum the bytes committed
+        for unfinished items.
+
+        """
+        summary = {'pending': 0, 'in-flight': 0, 'done': 0, 'failed': 0, 'committed': 0}
+        try:
+            with sqlite_session(self.engine) as session:
+                for status, count, committed in session.execute(
+                    f'select status, count(*), sum(committed_offset) \
+                      from {self._table(key)} group by status'
+                ).fetchall():
+                    summary[status] = count
+                    if status != 'done':
+                        summary['committed'] += committed or 0
+        except sqlite3.OperationalError as e:
+            msg = f"{e}, call: create(key='{key}')"
+            raise CacheExistenceError(msg) from e
+        return summary
+
     def read(self, *, key: str) -> list:
         try:
             with sqlite_session(self.engine) as session:
                 res = session.execute(
-                    f"select resource_path, integrity_reference from \"{os.path.basename(key)}\""
+                    f"select resource_path, integrity_reference from {self._table(key)} \
+                      where status != 'done'"
                 ).fetchall()
         except sqlite3.OperationalError as e:
             msg = f"{e}, call: create(key='{key}')"
@@ -153,7 +515,7 @@ class GenericRequestCache(object):
         try:
             with sqlite_session(self.engine) as session:
                 session.execute(
-                    f"drop table if exists \"{os.path.basename(key)}\""
+                    f'drop table if exists {self._table(key)}'
                 )
         except sqlite3.OperationalError as e:
             msg = f'could not destroy cache for {key}: {e}'
@@ -167,23 +529,34 @@ class GenericRequestCache(object):
             all_tables = session.execute(all_tables_query).fetchall()
         if not all_tables:
             return []
-        for table in all_tables[0]:
-            summary_query = f"select min(created_at), max(created_at) from \"{table}\""
+        for (table,) in all_tables:
+            if table == self.plan_table:
+                continue
+            self.create(key=table) # migrate caches from earlier versions
+            summary_query = f"select min(created_at), max(coalesce(updated_at, created_at)) \
+                              from {self._table(table)}"
             with sqlite_session(self.engine) as session:
                 summary = session.execute(summary_query).fetchall()[0]
-                data.append((table, summary[0], summary[1]))
+            data.append((table, summary[0], summary[1], self.summary(key=table)))
         return data
 
     def print(self) -> None:
         data = self.overview()
-        colnames = ['Cache key', 'Created at', 'Updated at']
+        colnames = [
+            'Cache key', 'Created at', 'Updated at',
+            'Pending', 'In flight', 'Done', 'Failed', 'Committed',
+        ]
         values = []
         for entry in data:
-            row = [entry[0], entry[1], entry[2]]
+            progress = entry[3]
+            row = [
+                entry[0], entry[1], entry[2],
+                progress['pending'], progress['in-flight'], progress['done'], progress['failed'],
+                humanfriendly.format_size(progress['committed']),
+            ]
             values.append(row)
         print(humanfriendly.tables.format_pretty_table(sorted(values), colnames))
 
-
     def destroy_all(self) -> None:
         data = self.overview()
         for entry in data:
@@ -216,6 +589,8 @@ class GenericDirectoryTransporter(object):
 
     transfer_cache_class =  GenericRequestCache
     delete_cache_class = GenericDeleteCache
+    claim_size = 100
+    local_source = False # whether resources are transferred from local disk
 
     def __init__(
         self,
@@ -227,6 +602,8 @@ class GenericDirectoryTransporter(object):
         use_cache: bool = True,
         prefixes: Optional[str] = None,
         suffixes: Optional[str] = None,
+        patterns: Optional[str] = None,
+        ignore_file: Optional[str] = None,
         sync_mtime: bool = False,
         keep_missing: bool = False,
         keep_updated: bool = False,
@@ -239,20 +616,43 @@ class GenericDirectoryTransporter(object):
         refresh_token: Optional[str] = None,
         refresh_target: Optional[int] = None,
         remote_path: Optional[str] = None,
+        mtime_tolerance: float = MTIME_TOLERANCE,
+        memory_budget: int = MEMORY_BUDGET,
+        transfer_order: str = 'scan',
+        delete_workers: int = DELETE_WORKERS,
+        session: Optional[requests.Session] = None,
+        token_manager: Optional[TokenManager] = None,
+        queue_dir: Optional[str] = None,
+        lease: float = QUEUE_LEASE,
+        shard: Optional[tuple] = None,
     ) -> None:
         self.env = env
         self.pnum = pnum
         self.directory = directory
-        self.token = token
+        # shared by all requests, and threads, which refresh tokens
+        self.token_manager = token_manager or TokenManager(
+            env, pnum, token, refresh_token, api_key=api_key, refresh_target=refresh_target,
+        )
         self.group = group
-        self.session = requests.session()
-        self.use_cache = use_cache
-        self.transfer_cache = self.transfer_cache_class(env, pnum)
-        self.transfer_cache.create(key=directory)
-        self.delete_cache = self.delete_cache_class(env, pnum)
-        self.delete_cache.create(key=directory)
-        self.ignore_prefixes = self._parse_ignore_data(prefixes)
-        self.ignore_suffixes = self._parse_ignore_data(suffixes)
+        self.session = session if session is not None else shared_session()
+        # a shared queue is a cache, shared with other workers
+        self.queue_dir = queue_dir
+        self.use_cache = use_cache or queue_dir is not None
+        self.lease = lease
+        self.worker = worker_id()
+        # (K, N): handle only the K-th of N disjoint parts of the directory
+        self.shard = shard
+        self.cache_key = directory if not shard else f'{directory}.shard-{shard[0]}-of-{shard[1]}'
+        self.transfer_cache = self.transfer_cache_class(env, pnum, directory=queue_dir)
+        self.transfer_cache.create(key=self.cache_key)
+        self.delete_cache = self.delete_cache_class(env, pnum, directory=queue_dir)
+        self.delete_cache.create(key=self.cache_key)
+        self.ignore_rules = IgnoreRules.from_options(
+            prefixes=prefixes,
+            suffixes=suffixes,
+            patterns=patterns,
+            ignore_file=ignore_file,
+        )
         self.sync_mtime = sync_mtime
         self.integrity_reference_key = 'etag' if not sync_mtime else 'mtime'
         self.keep_missing = keep_missing
@@ -263,17 +663,24 @@ class GenericDirectoryTransporter(object):
         self.chunk_size = chunk_size
         self.chunk_threshold = chunk_threshold
         self.api_key = api_key
-        self.refresh_token = refresh_token
-        self.refresh_target = refresh_target
         self.remote_path = remote_path
+        self.mtime_tolerance = mtime_tolerance
+        self.memory_budget = memory_budget
+        self.scheduler = TransferScheduler(
+            transfer_order, large_threshold=chunk_threshold or LARGE_FILE_THRESHOLD,
+        )
+        # (size, mtime) of resources to transfer, for scheduling
+        self.transfer_info = {}
+        self.delete_workers = delete_workers
 
-    def _parse_ignore_data(self, patterns: str) -> list:
-        # e.g. .git,build,dist
-        if not patterns:
-            return []
-        else:
-            debug_step(f'ignoring patterns: {patterns}')
-            return patterns.replace(' ', '').split(',')
+    @property
+    def token(self) -> Optional[str]:
+        """The current access token, refreshed if due."""
+        return self.token_manager.current()
+
+    @property
+    def refresh_token(self) -> Optional[str]:
+        return self.token_manager.refresh_token
 
     def sync(self) -> bool:
         """
@@ -283,46 +690,329 @@ class GenericDirectoryTransporter(object):
         as transfers complete.
 
         """
+        if self.queue_dir:
+            return self._sync_shared()
         resources = []
         deletes = []
         # 1. check caches
         if self.use_cache:
             debug_step('reading from cache')
-            left_overs = self.transfer_cache.read(key=self.directory)
+            # retry items left in-flight, or failed, by an earlier run
+            self.transfer_cache.requeue(key=self.cache_key)
+            left_overs = self.transfer_cache.read(key=self.cache_key)
             if left_overs:
                 click.echo('resuming directory transfer from cache')
                 resources = left_overs
-            left_over_deletes = self.delete_cache.read(key=self.directory)
+            left_over_deletes = self.delete_cache.read(key=self.cache_key)
             if left_over_deletes:
                 click.echo('resuming deletion from cache')
                 deletes = left_over_deletes
         # 2. maybe find resources, maybe fill caches
         if not resources or not self.use_cache:
             resources, deletes = self._find_resources_to_handle(self.directory)
+            # the cache is claimed in insertion order
+            resources = self.scheduler.order(resources, self._describe)
             if self.use_cache:
-                self.transfer_cache.add_many(key=self.directory, items=resources)
-                self.delete_cache.add_many(key=self.directory, items=deletes)
+                self.transfer_cache.add_many(key=self.cache_key, items=resources)
+                self.delete_cache.add_many(key=self.cache_key, items=deletes)
+        direction = 'upload' if self.local_source else 'download'
+        if resources:
+            click.echo(
+                self.scheduler.plan(
+                    resources,
+                    self._describe,
+                    deletes=len(deletes),
+                    throughput=read_throughput(self.env, self.pnum, direction),
+                )
+            )
         # 3. transfer resources
-        for resource, integrity_reference in resources:
-            print(f'transferring: {resource}')
-            self._transfer(resource, integrity_reference=integrity_reference)
+        started = time.monotonic()
+        try:
             if self.use_cache:
-                self.transfer_cache.remove(key=self.directory, item=resource)
+                self._transfer_from_cache()
+            else:
+                for resource, integrity_reference in resources:
+                    print(f'transferring: {resource}')
+                    self._transfer(resource, integrity_reference=integrity_reference)
+        finally:
+            # record progress, also when interrupted
+            self.transfer_cache.flush()
+        if resources:
+            record_throughput(
+                self.env,
+                self.pnum,
+                direction,
+                plan_bytes(resources, self._describe)[0],
+                time.monotonic() - started,
+            )
+        self.transfer_info = {}
         debug_step('destroying transfer cache')
-        self.transfer_cache.destroy(key=self.directory)
+        self.transfer_cache.destroy(key=self.cache_key)
         # 4. maybe delete resources
-        for resource, _ in deletes:
-            self._delete(resource)
-            if self.use_cache:
-                self.delete_cache.remove(key=self.directory, item=resource)
+        try:
+            self._delete_many(
+                (resource for resource, _ in deletes),
+                on_done=self._record_deletion if self.use_cache else None,
+            )
+        finally:
+            self.delete_cache.flush()
         debug_step('destroying delete cache')
-        self.delete_cache.destroy(key=self.directory)
+        self.delete_cache.destroy(key=self.cache_key)
         return True
 
+    def _sync_shared(self) -> bool:
+        """
+        Work on a directory together with other workers, possibly
+        on other hosts, through a queue in a shared directory.
+
+        One worker plans: it finds the resources to handle, and fills
+        the queue, while the others wait. All workers then claim
+        transfers, and later deletes, in batches, until the queue
+        is empty, and no other worker has claims left, since their
+        claims are recovered if they stop renewing them. The last
+        worker to finish removes the queue.
+
+        """
+        with self._renewing_leases():
+            self._join_plan()
+            try:
+                while True:
+                    self._transfer_from_cache()
+                    summary = self._wait_for_workers(self.transfer_cache)
+                    if not summary['pending']:
+                        break
+                if summary['failed']:
+                    sys.exit(f'{summary["failed"]} transfers failed, run again to retry them')
+                while True:
+                    claimed = self.delete_cache.claim(
+                        key=self.cache_key,
+                        limit=self.claim_size,
+                        worker=self.worker,
+                        lease=self.lease,
+                    )
+                    if claimed:
+                        self._delete_many(
+                            (resource for resource, *_ in claimed),
+                            on_done=self._record_deletion,
+                        )
+                    elif not self._wait_for_workers(self.delete_cache)['pending']:
+                        break
+            except CacheExistenceError:
+                debug_step('queue removed by another worker')
+                return True
+            finally:
+                self.transfer_cache.flush()
+                self.delete_cache.flush()
+        if not self.delete_cache.finish(key=self.cache_key):
+            sys.exit('some deletes failed, run again to retry them')
+        self.transfer_cache.finish(key=self.cache_key)
+        return True
+
+    def _join_plan(self) -> None:
+        """
+        Plan the shared transfer, or wait for another worker to do so.
+
+        """
+        while True:
+            state = self.transfer_cache.begin_plan(
+                key=self.cache_key, worker=self.worker, lease=self.lease,
+            )
+            if state == 'ready':
+                # retry items which failed, e.g. on workers which have exited
+                self.transfer_cache.requeue(key=self.cache_key, statuses=('failed',))
+                self.delete_cache.requeue(key=self.cache_key, statuses=('failed',))
+                summary = self.transfer_cache.summary(key=self.cache_key)
+                click.echo(
+                    f'joining shared transfer: {summary["pending"]} pending, '
+                    f'{summary["in-flight"]} in flight, {summary["done"]} done'
+                )
+                return
+            if state == 'plan':
+                break
+            click.echo('waiting for another worker to plan the transfer')
+            time.sleep(QUEUE_POLL)
+        # replace anything left by a planner which stopped
+        for cache in (self.transfer_cache, self.delete_cache):
+            cache.destroy(key=self.cache_key)
+            cache.create(key=self.cache_key)
+        resources, deletes = self._find_resources_to_handle(self.directory)
+        resources = self.scheduler.order(resources, self._describe)
+        self.transfer_cache.add_many(key=self.cache_key, items=resources)
+        self.delete_cache.add_many(key=self.cache_key, items=deletes)
+        click.echo(self.scheduler.plan(resources, self._describe, deletes=len(deletes)))
+        self.transfer_info = {}
+        self.transfer_cache.finish_plan(key=self.cache_key, worker=self.worker)
+
+    def _wait_for_workers(self, cache: GenericRequestCache) -> dict:
+        """
+        Wait until no other worker has items in flight, or until new
+        pending items appear, e.g. recovered from a stopped worker.
+
+        """
+        while True:
+            cache.recover(key=self.cache_key)
+            summary = cache.summary(key=self.cache_key)
+            if summary['pending'] or not summary['in-flight']:
+                return summary
+            debug_step(f'waiting for {summary["in-flight"]} items in flight on other workers')
+            time.sleep(min(QUEUE_POLL, self.lease / 10))
+
+    @contextmanager
+    def _renewing_leases(self) -> Iterator[None]:
+        """
+        Renew the leases of this worker's claims, in the background.
+
+        """
+        stop = threading.Event()
+        def renew() -> None:
+            # sqlite connections cannot be shared between threads
+            caches = [
+                cache_class(self.env, self.pnum, directory=self.queue_dir)
+                for cache_class in (self.transfer_cache_class, self.delete_cache_class)
+            ]
+            while not stop.wait(self.lease / 3):
+                for cache in caches:
+                    try:
+                        cache.renew(key=self.cache_key, worker=self.worker, lease=self.lease)
+                    except (CacheExistenceError, sqlite3.Error) as e:
+                        debug_step(f'could not renew leases: {e}')
+        thread = threading.Thread(target=renew, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def _transfer_from_cache(self) -> None:
+        """
+        Claim resources from the transfer cache in batches,
+        and record the outcome of each transfer.
+
+        """
+        while True:
+            if self.queue_dir:
+                claimed = self.transfer_cache.claim(
+                    key=self.cache_key,
+                    limit=self.claim_size,
+                    worker=self.worker,
+                    lease=self.lease,
+                )
+            else:
+                claimed = self.transfer_cache.claim(key=self.cache_key, limit=self.claim_size)
+            if not claimed:
+                break
+            for resource, integrity_reference, upload_id, _ in claimed:
+                print(f'transferring: {resource}')
+                try:
+                    self._transfer(
+                        resource,
+                        integrity_reference=integrity_reference,
+                        upload_id=upload_id,
+                    )
+                except Exception:
+                    self.transfer_cache.fail(key=self.cache_key, item=resource)
+                    raise
+                self.transfer_cache.complete(key=self.cache_key, item=resource)
+
+    def _delete_many(
+        self,
+        resources: Iterable[str],
+        on_done: Optional[Callable[[str], None]] = None,
+    ) -> list:
+        """
+        Delete resources concurrently, with retries,
+        exiting if any of them could not be deleted.
+
+        """
+        try:
+            return BulkDeleter(
+                lambda resource: self._delete(resource, raise_errors=True),
+                workers=self.delete_workers,
+                on_done=on_done,
+            ).run(resources)
+        except DeletionError as e:
+            sys.exit(str(e))
+
+    def _record_deletion(self, resource: str) -> None:
+        self.delete_cache.complete(key=self.cache_key, item=resource)
+
+    def _record_progress(self, resource: str) -> Optional[Callable]:
+        """
+        Create a callback which records the progress of
+        a resumable upload in the transfer cache.
+
+        """
+        if not self.use_cache:
+            return None
+        def on_chunk(upload_id: str, offset: int) -> None:
+            self.transfer_cache.progress(
+                key=self.cache_key, item=resource, upload_id=upload_id, offset=offset,
+            )
+        return on_chunk
+
+    def _in_shard(self, entries: Iterable[tuple]) -> Iterator[tuple]:
+        """
+        Keep the (resource, ...) entries which belong to this
+        transporter's shard, if any, hashing paths relative to
+        the directory, so that both sides of a sync agree.
+
+        """
+        if not self.shard:
+            yield from entries
+            return
+        index, count = self.shard
+        root = f'{self.directory}/'
+        for entry in entries:
+            resource = entry[0]
+            relative = resource[len(root):] if resource.startswith(root) else resource
+            if shard_of(relative, count) == index:
+                yield entry
+
+    def _describe(self, resource: str) -> tuple:
+        """
+        Get the (size, mtime) of a resource to transfer,
+        from the listing, or for local resources, from disk.
+
+        """
+        info = self.transfer_info.get(resource)
+        if info and info[0] is not None:
+            return info
+        if self.local_source:
+            path = resource if not self.target_dir else os.path.normpath(f'{self.target_dir}/{resource}')
+            try:
+                st = os.stat(path)
+                return st.st_size, st.st_mtime
+            except OSError:
+                pass
+        return info or (None, None)
+
+    def _remember(self, resource: str, reference: Optional[str], size: Optional[int]) -> None:
+        self.transfer_info[resource] = (
+            None if size is None else int(size), as_number(reference),
+        )
+
     def _find_local_resources(self, path: str) -> list:
         """
-        Recursively list the given path.
-        Ignore prefixes and suffixes if they exist.
+        Recursively list the given path, returning a list of
+        (resource, integrity_reference) tuples.
+        With sharding, only resources in this shard are included.
+
+        """
+        resources = []
+        for resource, mtime, size in self._in_shard(self._iter_local_resources(path)):
+            if size is not None:
+                self._remember(resource, mtime, size)
+            resources.append((resource, str(mtime) if mtime is not None else None))
+        return resources
+
+    def _iter_local_resources(self, path: str) -> Iterator[tuple]:
+        """
+        Recursively list the given path, yielding
+        (resource, mtime, size) tuples.
+
+        Skip resources matched by the ignore rules, pruning
+        ignored directories from the walk altogether.
         If self.target_dir is specified, then it is
         prepended to the path before the recursive listing
         and removed again before compiling the list.
@@ -330,45 +1020,56 @@ class GenericDirectoryTransporter(object):
         exist remotely.
 
         """
-        path = path if not self.target_dir else os.path.normpath(f'{self.target_dir}/{path}')
-        resources = []
-        integrity_reference = None
+        # normalised, e.g. without a trailing slash, so that paths
+        # relative to it, matched by the ignore rules, are correct
+        path = os.path.normpath(path if not self.target_dir else f'{self.target_dir}/{path}')
+        mtime, size = None, None
+        ignores = self.ignore_rules.ignores if self.ignore_rules else None
+        can_prune = self.ignore_rules.can_prune
+        root_length = len(path) + 1
         debug_step('finding local resources to transfer')
-        for directory, subdirectory, files in os.walk(path):
+        for directory, subdirectories, files in os.walk(path):
             if sys.platform == 'win32':
                 directory = directory.replace("\\", "/")
-            folder = directory.replace(f'{path}/', '')
-            ignore_prefix = False
-            for prefix in self.ignore_prefixes:
-                if folder.startswith(prefix):
-                    ignore_prefix = True
-                    break
-            if ignore_prefix:
-                continue
+            folder = directory[root_length:]
+            if ignores:
+                subdirectories[:] = [
+                    d for d in subdirectories
+                    if not can_prune(f'{folder}/{d}' if folder else d)
+                ]
             for file in files:
-                ignore_suffix = False
-                for suffix in self.ignore_suffixes:
-                    if file.endswith(suffix):
-                        ignore_suffix = True
-                        break
-                if ignore_suffix:
+                if ignores and ignores(f'{folder}/{file}' if folder else file):
                     continue
                 target = f'{directory}/{file}'
                 if self.sync_mtime:
-                    integrity_reference = str(os.stat(target).st_mtime)
+                    st = os.stat(target)
+                    mtime, size = st.st_mtime, st.st_size
                 if self.target_dir:
                     target = os.path.normpath(target.replace(f'{self.target_dir}/', ''))
-                resources.append((target, integrity_reference))
-        return resources
+                yield target, mtime, size
 
     def _find_remote_resources(self, path: str) -> list:
         """
-        Recursively list a remote path.
-        Ignore prefixes and suffixes if they exist.
-        Collect integrity references for all resources.
+        Recursively list a remote path, returning a list of
+        (resource, integrity_reference) tuples.
+        With sharding, only resources in this shard are included.
+
         """
+        resources = []
+        for resource, reference, size in self._in_shard(self._iter_remote_resources(path)):
+            self._remember(resource, reference, size)
+            resources.append((resource, str(reference)))
+        return resources
 
-        print(f'finding remote resources for {path}')
+    def _list_remote_directory(self, path: str) -> Iterator[tuple]:
+        """
+        List a single remote directory, following all pages,
+        yielding (resource, is_dir, entry) tuples, where entry
+        is the information returned by the API.
+
+        Skip resources matched by the ignore rules.
+
+        """
         list_funcs = {
             'export': {
                 'func': export_list,
@@ -383,9 +1084,9 @@ class GenericDirectoryTransporter(object):
                 'backend': 'survey',
             }
         }
-        resources = []
-        subdirs = []
         next_page = None
+        ignores = self.ignore_rules.ignores if self.ignore_rules else None
+        root = f'{self.directory}/'
         while True:
             click.echo(f'fetching information about directory: {path}')
             out = list_funcs[self.remote_key]['func'](
@@ -404,55 +1105,56 @@ class GenericDirectoryTransporter(object):
             next_page = out.get('page')
             if found:
                 for entry in found:
-                    import os
                     subdir_and_resource = os.path.basename(entry.get("href"))
                     ref = f'{path}/{subdir_and_resource}'
-                    ignore_prefix = False
-                    # check if we should ignore it
-                    for prefix in self.ignore_prefixes:
-                        # because we ignore _sub_ directories
-                        target = ref.replace(f'{self.directory}/', '')
-                        if target.startswith(prefix):
-                            ignore_prefix = True
-                            break
-                    if ignore_prefix:
+                    is_dir = entry.get('mime-type') == 'directory'
+                    # because we ignore _sub_ directories
+                    if ignores and ignores(
+                        ref[len(root):] if ref.startswith(root) else ref, is_dir=is_dir
+                    ):
                         debug_step(f'ignoring {ref}')
                         continue
-                    ignore_suffix = False
-                    for suffix in self.ignore_suffixes:
-                        if subdir_and_resource.endswith(suffix):
-                            ignore_suffix = True
-                            break
-                    if ignore_suffix:
-                        debug_step(f'ignoring {ref}')
-                        continue
-                    # track resource
-                    if entry.get('mime-type') == 'directory':
-                        subdirs.append(ref)
-                    else:
-                        resources.append(
-                            (ref, str(entry.get(self.integrity_reference_key)))
-                        )
+                    yield ref, is_dir, entry
             # follow next_page(s) for a given path, until exhaustively listed
-            # break if no other subdirs were found
-            if not next_page and not subdirs:
-                debug_step(f'found all files for {path}')
+            if not next_page:
                 break
-            if not next_page and subdirs:
-                path = subdirs.pop(0)
-                debug_step(f'finding files for sub-directory {path}')
-        return resources
+
+    def _iter_remote_resources(self, path: str) -> Iterator[tuple]:
+        """
+        Recursively list a remote path, yielding
+        (resource, integrity_reference, size) tuples.
+
+        Do not descend into ignored sub-directories.
+        Collect integrity references for all resources.
+        """
+
+        print(f'finding remote resources for {path}')
+        subdirs = [path]
+        while subdirs:
+            path = subdirs.pop(0)
+            debug_step(f'finding files for directory {path}')
+            for ref, is_dir, entry in self._list_remote_directory(path):
+                # track resource
+                if is_dir:
+                    subdirs.append(ref)
+                else:
+                    yield ref, entry.get(self.integrity_reference_key), entry.get('size')
+        debug_step('found all remote files')
 
     def _transfer_local_to_remote(
         self,
         resource: str,
         integrity_reference: Optional[str] = None,
+        upload_id: Optional[str] = None,
     ) -> str:
         """
         Upload a resource to the remote destination, either
         as a basic stream, or a resumable - depending on the
         size of the $CHUNK_THRESHOLD.
 
+        Resumable uploads continue from the upload_id recorded
+        in the transfer cache, if any, and record their progress.
+
         """
         if not os.path.lexists(resource):
             print(f'WARNING: could not find {resource} on local disk')
@@ -471,10 +1173,10 @@ class GenericDirectoryTransporter(object):
                 session=self.session,
                 set_mtime=self.sync_mtime,
                 public_key=self.public_key,
-                api_key=self.api_key,
-                refresh_token=self.refresh_token,
-                refresh_target=self.refresh_target,
+                token_manager=self.token_manager,
                 remote_path=self.remote_path,
+                upload_id=upload_id,
+                on_chunk=self._record_progress(resource),
             )
         else:
             resp = streamfile(
@@ -487,18 +1189,12 @@ class GenericDirectoryTransporter(object):
                 session=self.session,
                 set_mtime=self.sync_mtime,
                 public_key=self.public_key,
-                api_key=self.api_key,
-                refresh_token=self.refresh_token,
-                refresh_target=self.refresh_target,
+                token_manager=self.token_manager,
                 remote_path=self.remote_path,
             )
         if resp.get("session"):
             debug_step("renewing session")
             self.session = resp.get("session")
-        if resp.get('tokens'):
-            self.token = resp.get('tokens').get('access_token')
-            self.refresh_token = resp.get('tokens').get('refresh_token')
-            self.refresh_target = get_claims(self.token).get('exp')
         return resource
 
     def _transfer_remote_to_local(
@@ -530,51 +1226,45 @@ class GenericDirectoryTransporter(object):
             set_mtime=self.sync_mtime,
             backend=self.remote_key,
             target_dir=self.target_dir,
-            api_key=self.api_key,
-            refresh_token=self.refresh_token,
-            refresh_target=self.refresh_target,
+            token_manager=self.token_manager,
             public_key=self.public_key,
             remote_path=self.remote_path,   
         )
-        if resp.get('tokens'):
-            self.token = resp.get('tokens').get('access_token')
-            self.refresh_token = resp.get('tokens').get('refresh_token')
-            self.refresh_target = get_claims(self.token).get('exp')
         return resource
 
-    def _delete_remote_resource(self, resource: str) -> str:
+    def _delete_remote_resource(self, resource: str, raise_errors: bool = False) -> str:
         """
         Choose a function, invoke it to delete a remote resource.
 
+        With raise_errors, failed requests raise exceptions,
+        instead of exiting, so they can be retried. It is safe
+        to call this from several threads.
+
         """
         delete_funcs = {
             'export': export_delete,
             'import': import_delete,
         }
         debug_step(f'deleting: {resource}')
-        resp = delete_funcs[self.remote_key](
+        delete_func = delete_funcs[self.remote_key]
+        delete_func = delete_func.__wrapped__ if raise_errors else delete_func
+        delete_func(
             self.env,
             self.pnum,
             self.token,
             resource,
             session=self.session,
             group=self.group,
-            api_key=self.api_key,
-            refresh_token=self.refresh_token,
-            refresh_target=self.refresh_target,
+            token_manager=self.token_manager,
             remote_path=self.remote_path,
         )
-        if resp.get('tokens'):
-            self.token = resp.get('tokens').get('access_token')
-            self.refresh_token = resp.get('tokens').get('refresh_token')
-            self.refresh_target = get_claims(self.token).get('exp')
         return resource
 
     def _find_sync_lists(
         self,
         *,
-        source: list,
-        target: list,
+        source: Iterable[tuple],
+        target: Iterable[tuple],
         keep_updated: bool = False,
         keep_missing: bool = False,
     ) -> tuple:
@@ -585,10 +1275,18 @@ class GenericDirectoryTransporter(object):
         conditional on the keep_updated and keep_missing
         parameters.
 
+        Source and target are iterables of (resource, mtime)
+        or (resource, mtime, size) tuples, in any order. They are
+        collected into compact inventories, and compared in memory
+        (vectorised, with NumPy) if they fit within the memory budget,
+        otherwise sorted out-of-core, and merged. Modified times are
+        compared as numbers, within self.mtime_tolerance, and differing
+        sizes imply a change.
+
         For example, given two sets of filenames, and modified times (higher == more recent):
 
         source = {               ('file1', 10), ('file2', 20), ('file3', 15), ('file4', 89)}
-        target = {('file0', 32), ('file1', 10), ('file2', 10), ('file3', 13)               }
+        target = {('file0', 32), ('file1', 10), ('file2', 10), ('file3', 18)               }
 
         The default return values will be:
 
@@ -603,28 +1301,59 @@ class GenericDirectoryTransporter(object):
         """
         # the integrity reference is not relevant
         # so None is passed as the second tuple value
-        if not keep_missing:
-            target_names = set([ r for r, i in target ])
-            source_names = set([ r for r, i in source ])
-            deletes = [ (r, None) for r in target_names.difference(source_names) ]
-        else:
-            deletes = []
-        if not keep_updated:
-            source_names_mtimes = set([ (r, i) for r, i in source ])
-            target_names_mtimes = set([ (r, i) for r, i in target ])
-            transfers = [ (r, None) for r, i in source_names_mtimes.difference(target_names_mtimes) ]
-        else:
-            sources = { r: i for r, i in source }
-            remotes = { r: i for r, i in target }
-            transfers = []
-            for k, v in sources.items():
-                if not remotes.get(k):
-                    transfers.append((k, None))
-                else:
-                    if sources[k] > remotes[k]:
-                        transfers.append((k, None))
-                    else:
-                        continue
+        transfers, deletes = [], []
+        # the number of target resources in each directory, so that
+        # deletes of whole directories can be collapsed
+        totals = Counter()
+        def counting(entries: Iterable[tuple]) -> Iterator[tuple]:
+            for entry in entries:
+                totals.update(ancestors(entry[0]))
+                yield entry
+        # directories with source resources, which must not be deleted,
+        # even when all of their target resources are
+        kept = set()
+        def keeping(entries: Iterable[tuple]) -> Iterator[tuple]:
+            for entry in entries:
+                kept.update(ancestors(entry[0]))
+                yield entry
+        with ExternalSorter(self.memory_budget) as sorted_source, \
+                ExternalSorter(self.memory_budget) as sorted_target:
+            # with sharding, only directories without resources in
+            # other shards can be collapsed, so count all of them
+            sorted_source.extend(self._in_shard(keeping(source)))
+            sorted_target.extend(self._in_shard(counting(target)))
+            debug_step(
+                f'comparing {len(sorted_source)} source and {len(sorted_target)} target resources'
+            )
+            if sorted_source.inventory is not None and sorted_target.inventory is not None:
+                # both fit within the memory budget
+                changes, missing = sorted_source.inventory.diff(
+                    sorted_target.inventory,
+                    keep_missing=keep_missing,
+                    keep_updated=keep_updated,
+                    tolerance=self.mtime_tolerance,
+                    entries=True,
+                )
+            else:
+                changes, missing = [], []
+                for action, entry in diff_sorted(
+                    sorted_source,
+                    sorted_target,
+                    keep_missing=keep_missing,
+                    keep_updated=keep_updated,
+                    tolerance=self.mtime_tolerance,
+                    entries=True,
+                ):
+                    (missing if action == 'delete' else changes).append(entry)
+        for resource, reference, size in changes:
+            self._remember(resource, reference, size)
+            transfers.append((resource, None))
+        deleted = [resource for resource, _, _ in missing]
+        if not self.ignore_rules:
+            # with ignore rules, the totals do not count ignored resources,
+            # so directories which still hold them would seem fully deleted
+            deleted = collapse(deleted, totals, root=self.directory, keep=kept)
+        deletes = [(resource, None) for resource in deleted]
         return transfers, deletes
 
     # Implement the following methods for specific Transport classes
@@ -639,7 +1368,12 @@ class GenericDirectoryTransporter(object):
         """
         raise NotImplementedError
 
-    def _transfer(self, resource: str, integrity_reference: Optional[str] = None) -> str:
+    def _transfer(
+        self,
+        resource: str,
+        integrity_reference: Optional[str] = None,
+        upload_id: Optional[str] = None,
+    ) -> str:
         """
         Transfer a given resource over the network.
 
@@ -648,11 +1382,12 @@ class GenericDirectoryTransporter(object):
         """
         raise NotImplementedError
 
-    def _delete(self, resource: str) -> str:
+    def _delete(self, resource: str, raise_errors: bool = False) -> str:
         """
         Delete a given resource.
 
-        Invoked by the sync method.
+        Invoked by the sync method, from several threads,
+        with raise_errors, so that failures can be retried.
 
         """
         raise NotImplementedError
@@ -664,6 +1399,7 @@ class SerialDirectoryUploader(GenericDirectoryTransporter):
 
     """Simple idempotent resumable directory upload."""
 
+    local_source = True
     transfer_cache_class = UploadCache
 
     def _find_resources_to_handle(self, path: str) -> tuple:
@@ -672,9 +1408,14 @@ class SerialDirectoryUploader(GenericDirectoryTransporter):
         return resources, deletes
 
 
-    def _transfer(self, resource: str, integrity_reference: Optional[str] = None) -> str:
+    def _transfer(
+        self,
+        resource: str,
+        integrity_reference: Optional[str] = None,
+        upload_id: Optional[str] = None,
+    ) -> str:
         resource = self._transfer_local_to_remote(
-            resource, integrity_reference=integrity_reference
+            resource, integrity_reference=integrity_reference, upload_id=upload_id,
         )
         return resource
 
@@ -690,7 +1431,12 @@ class SerialDirectoryDownloader(GenericDirectoryTransporter):
         resources = self._find_remote_resources(path)
         return resources, deletes
 
-    def _transfer(self, resource: str, integrity_reference: Optional[str] = None) -> str:
+    def _transfer(
+        self,
+        resource: str,
+        integrity_reference: Optional[str] = None,
+        upload_id: Optional[str] = None,
+    ) -> str:
         resource = self._transfer_remote_to_local(
             resource, integrity_reference=integrity_reference
         )
@@ -709,12 +1455,13 @@ class SerialDirectoryUploadSynchroniser(GenericDirectoryTransporter):
 
     """
 
+    local_source = True
     transfer_cache_class = UploadCache
     delete_cache_class = UploadDeleteCache
 
     def _find_resources_to_handle(self, path: str) -> tuple:
-        source = self._find_local_resources(path)
-        target = self._find_remote_resources(path)
+        source = self._iter_local_resources(path)
+        target = self._iter_remote_resources(path)
         resources, deletes = self._find_sync_lists(
             source=source, target=target,
             keep_missing=self.keep_missing,
@@ -722,14 +1469,19 @@ class SerialDirectoryUploadSynchroniser(GenericDirectoryTransporter):
         )
         return resources, deletes
 
-    def _transfer(self, resource: str, integrity_reference: Optional[str] = None) -> str:
+    def _transfer(
+        self,
+        resource: str,
+        integrity_reference: Optional[str] = None,
+        upload_id: Optional[str] = None,
+    ) -> str:
         resource = self._transfer_local_to_remote(
-            resource, integrity_reference=integrity_reference
+            resource, integrity_reference=integrity_reference, upload_id=upload_id,
         )
         return resource
 
-    def _delete(self, resource) -> str:
-        resource = self._delete_remote_resource(resource)
+    def _delete(self, resource: str, raise_errors: bool = False) -> str:
+        resource = self._delete_remote_resource(resource, raise_errors=raise_errors)
         return resource
 
 
@@ -749,8 +1501,8 @@ class SerialDirectoryDownloadSynchroniser(GenericDirectoryTransporter):
     delete_cache_class = DownloadDeleteCache
 
     def _find_resources_to_handle(self, path: str) -> tuple:
-        target = self._find_local_resources(path)
-        source = self._find_remote_resources(path)
+        target = self._iter_local_resources(path)
+        source = self._iter_remote_resources(path)
         resources, deletes = self._find_sync_lists(
             source=source, target=target,
             keep_missing=self.keep_missing,
@@ -758,16 +1510,24 @@ class SerialDirectoryDownloadSynchroniser(GenericDirectoryTransporter):
         )
         return resources, deletes
 
-    def _transfer(self, resource: str, integrity_reference: Optional[str] = None) -> str:
+    def _transfer(
+        self,
+        resource: str,
+        integrity_reference: Optional[str] = None,
+        upload_id: Optional[str] = None,
+    ) -> str:
         resource = self._transfer_remote_to_local(
             resource, integrity_reference=integrity_reference
         )
         return resource
 
-    def _delete(self, resource: str) -> str:
+    def _delete(self, resource: str, raise_errors: bool = False) -> str:
         print(f'deleting: {resource}')
-        if os.path.isdir(resource):
-            shutil.rmtree(resource)
-        else:
-            os.remove(resource)
+        try:
+            if os.path.isdir(resource):
+                shutil.rmtree(resource)
+            else:
+                os.remove(resource)
+        except FileNotFoundError:
+            debug_step(f'already deleted: {resource}')
         return resource
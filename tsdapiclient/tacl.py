@@ -11,70 +11,27 @@ from typing import Optional
 import uuid
 
 import click
-import requests
 
+# Only light modules are imported here, so that e.g. --version, --guide,
+# and shell completion start quickly. Authentication, transfers, and
+# their dependencies (requests, rich, numpy, libnacl) are imported
+# where they are used, once an action needs them.
 from tsdapiclient import __version__
-from tsdapiclient.administrator import get_tsd_api_key
-from tsdapiclient.authapi import get_jwt_two_factor_auth, get_jwt_basic_auth, get_jwt_instance_auth
-from tsdapiclient.client_config import ENV, CHUNK_THRESHOLD, CHUNK_SIZE
-from tsdapiclient.configurer import (
-    read_config, update_config, print_config, delete_config,
-)
-try:
-    from tsdapiclient.crypto import nacl_get_server_public_key
-    LIBSODIUM_AVAILABLE = True
-except OSError:
-    LIBSODIUM_AVAILABLE = False
-from tsdapiclient.fileapi import (
-    streamfile,
-    initiate_resumable,
-    get_resumable,
-    delete_resumable,
-    delete_all_resumables,
-    export_get,
-    export_list,
-    print_export_list,
-    print_resumables_list,
-    export_head,
-    export_delete,
+from tsdapiclient.client_config import (
+    AGENT_CONCURRENCY,
+    ENV,
+    CHUNK_THRESHOLD,
+    CHUNK_SIZE,
+    EDUCLOUD_CONTACT_URL,
+    HELP_URL,
+    POLL_INTERVAL,
+    RECONCILE_INTERVAL,
+    SCHEDULING_POLICIES,
+    WATCH_SETTLE,
 )
 from tsdapiclient.guide import (
     topics, config, uploads, downloads, debugging, automation, sync, encryption, links
 )
-from tsdapiclient.session import (
-    session_is_expired,
-    session_expires_soon,
-    session_update,
-    session_clear,
-    session_token,
-    session_refresh_token,
-    session_print,
-)
-from tsdapiclient.sync import (
-    SerialDirectoryUploader,
-    SerialDirectoryDownloader,
-    SerialDirectoryUploadSynchroniser,
-    SerialDirectoryDownloadSynchroniser,
-    UploadCache,
-    DownloadCache,
-    UploadDeleteCache,
-    DownloadDeleteCache,
-)
-from tsdapiclient.tools import (
-    EDUCLOUD_CONTACT_URL,
-    HELP_URL,
-    check_if_key_has_expired,
-    get_external_ip_address,
-    has_api_connectivity,
-    user_agent,
-    debug_step,
-    as_bytes,
-    get_claims,
-    renew_api_key,
-    display_instance_info,
-)
-
-requests.utils.default_user_agent = user_agent
 
 API_ENVS = {
     'prod': 'api.tsd.usit.no',
@@ -143,6 +100,23 @@ def print_version_info() -> None:
     """))
 
 
+def set_user_agent() -> None:
+    import requests
+    from tsdapiclient.tools import user_agent
+    requests.utils.default_user_agent = user_agent
+
+
+def get_server_public_key(env: str, pnum: str, token: str) -> Optional["libnacl.public.PublicKey"]:
+    try:
+        from tsdapiclient.crypto import nacl_get_server_public_key
+    except OSError:
+        click.echo("libsodium system dependency missing - end-to-end encryption not available")
+        return None
+    from tsdapiclient.tools import debug_step
+    debug_step('Using end-to-end encryption')
+    return nacl_get_server_public_key(env, pnum, token)
+
+
 def get_api_envs(ctx: str, args: list, incomplete: str) -> list:
     return [k for k, v in API_ENVS.items() if incomplete in k]
 
@@ -194,6 +168,8 @@ def get_user_credentials(env: Optional[str] = None) -> tuple:
 
 
 def get_api_key(env: str, pnum: str) -> str:
+    from tsdapiclient.configurer import read_config
+    from tsdapiclient.tools import check_if_key_has_expired
     if env == "dev":
         return "would-have-been-a-jwt"
     config = read_config()
@@ -216,6 +192,8 @@ def get_api_key(env: str, pnum: str) -> str:
 
 
 def check_api_connection(env: str) -> None:
+    from tsdapiclient.tools import debug_step, get_external_ip_address, has_api_connectivity
+    set_user_agent()
     if os.getenv("TACL_DISABLE_API_CONNECTION_CHECK"):
         return
     if env == "dev":
@@ -242,13 +220,215 @@ def check_api_connection(env: str) -> None:
         )
 
 
-def construct_correct_remote_path(path: str) -> str:
-    if path.startswith('../'):
-        return os.path.abspath(path)
-    elif path.startswith('~/'):
-        return os.path.expanduser(path)
+def auth_requirements(
+    env: str,
+    direction: str,
+    basic: bool,
+    api_key: Optional[str],
+    link_id: Optional[str] = None,
+) -> tuple:
+    """
+    Determine whether user credentials are required, and
+    which token type to request, for uploads or downloads.
+
+    """
+    if direction == 'upload':
+        if basic or api_key:
+            return False, TOKENS[env]['upload']
+        return False if link_id else True, TOKENS[env]['upload']
+    if env == 'alt' and basic:
+        return False, TOKENS[env]['download']
+    elif env != 'alt' and basic and not api_key:
+        click.echo('download not authorized with basic auth')
+        sys.exit(1)
+    elif link_id:
+        return False, TOKENS[env]['download']
+    elif env != 'alt' and api_key:
+        return False, 'export_auto'
+    return True, TOKENS[env]['download']
+
+
+def session_login(
+    env: str,
+    pnum: str,
+    token_type: str,
+    api_key: Optional[str],
+    auth_method: str,
+) -> tuple:
+    """
+    Get tokens from the login session, authenticating if
+    it has expired, returning (token, refresh_token, api_key).
+
+    """
+    from tsdapiclient.authapi import get_jwt_two_factor_auth
+    from tsdapiclient.session import (
+        session_is_expired,
+        session_expires_soon,
+        session_update,
+        session_token,
+        session_refresh_token,
+    )
+    from tsdapiclient.tools import debug_step, get_claims
+    auth_required = False
+    debug_step(f'using login session with {env}:{pnum}:{token_type}')
+    debug_step('checking if login session has expired')
+    expired = session_is_expired(env, pnum, token_type)
+    if expired:
+        click.echo('your session has expired, please authenticate')
+        auth_required = True
+    debug_step('checking if login session will expire soon')
+    expires_soon = session_expires_soon(env, pnum, token_type)
+    if expires_soon:
+        click.echo('your session expires soon')
+        if click.confirm('Do you want to refresh your login session?'):
+            auth_required = True
+        else:
+            auth_required = False
+    if not expires_soon and expired:
+        auth_required = True
+    if not api_key:
+        api_key = get_api_key(env, pnum)
+    if auth_required:
+        username, password, otp = get_user_credentials(env)
+        token, refresh_token = get_jwt_two_factor_auth(
+            env, pnum, api_key, username, password, otp, token_type, auth_method=auth_method,
+        )
+        if token:
+            debug_step('updating login session')
+            session_update(env, pnum, token_type, token, refresh_token)
+    else:
+        token = session_token(env, pnum, token_type)
+        debug_step(f'using token from existing login session')
+        refresh_token = session_refresh_token(env, pnum, token_type)
+        if refresh_token:
+            debug_step(f'using refresh token from existing login session')
+            debug_step(f'refreshes remaining: {get_claims(refresh_token).get("counter")}')
+            debug_step(refresh_token)
+    return token, refresh_token, api_key
+
+
+def load_api_key(env: str, pnum: str, api_key: Optional[str]) -> str:
+    """
+    Get the API key from config, or from a file (@path-to-file),
+    renewing it if it has expired.
+
+    """
+    from tsdapiclient.tools import check_if_key_has_expired, debug_step, renew_api_key
+    key_file = None
+    if not api_key:
+        api_key = get_api_key(env, pnum)
+    if api_key.startswith("@"):
+        key_file = api_key[1:]
+        if not os.path.lexists(key_file):
+            sys.exit(f"key file not found: {key_file}")
+        debug_step(f'reading API key from {key_file}')
+        with open(key_file, "r") as f:
+            api_key = f.read().strip()
+    if check_if_key_has_expired(api_key):
+        debug_step("API key has expired")
+        api_key = renew_api_key(env, pnum, api_key, key_file)
+    return api_key
+
+
+def direction_tokens(
+    env: str,
+    pnum: str,
+    direction: str,
+    basic: bool,
+    api_key: Optional[str],
+) -> tuple:
+    """
+    Authenticate for uploads or downloads, returning
+    (TokenManager, api_key), with the API key as loaded.
+
+    """
+    from tsdapiclient.authapi import get_jwt_basic_auth, TokenManager
+    from tsdapiclient.broker import broker_token_manager
+    auth_method = "iam" if env.startswith("ec-") or pnum.startswith("ec") else "tsd"
+    requires_user_credentials, token_type = auth_requirements(env, direction, basic, api_key)
+    if requires_user_credentials:
+        token, refresh_token, api_key = session_login(
+            env, pnum, token_type, api_key, auth_method,
+        )
     else:
-        return path
+        api_key = load_api_key(env, pnum, api_key)
+        manager = broker_token_manager(env, pnum, token_type, api_key)
+        if manager:
+            return manager, api_key
+        token, refresh_token = get_jwt_basic_auth(env, pnum, api_key, token_type)
+    if not token:
+        click.echo('authentication failed')
+        sys.exit(1)
+    return TokenManager(env, pnum, token, refresh_token, api_key=api_key), api_key
+
+
+def run_batch(
+    env: str,
+    pnum: str,
+    manifest: str,
+    basic: bool,
+    api_key: Optional[str],
+) -> None:
+    """
+    Authenticate once for each direction needed by the
+    jobs in a manifest, and run them all.
+
+    """
+    from tsdapiclient.batch import BatchRunner, ManifestError, load_manifest
+    from tsdapiclient.transport import configure, POOL_MAXSIZE
+    try:
+        jobs, concurrency = load_manifest(manifest)
+    except ManifestError as e:
+        sys.exit(str(e))
+    configure(pool_maxsize=max(POOL_MAXSIZE, concurrency * 2))
+    if not pnum:
+        click.echo('missing pnum argument')
+        sys.exit(1)
+    check_api_connection(env)
+    tokens = {}
+    for direction in sorted({job.direction for job in jobs}):
+        tokens[direction], api_key = direction_tokens(env, pnum, direction, basic, api_key)
+    public_key = None
+    if any(job.options['encrypt'] for job in jobs):
+        public_key = get_server_public_key(env, pnum, next(iter(tokens.values())).current())
+    if not BatchRunner(env, pnum, jobs, tokens, public_key, concurrency).run():
+        sys.exit(1)
+
+
+def run_agent(
+    env: str,
+    pnum: str,
+    basic: bool,
+    api_key: Optional[str],
+    spool_dir: Optional[str],
+    concurrency: int,
+) -> None:
+    """
+    Run a transfer agent, authenticating for each
+    direction when the first job needs it.
+
+    """
+    from tsdapiclient.agent import AgentTokens, JobQueue, TransferAgent, agent_queue_path
+    from tsdapiclient.broker import BrokerError
+    from tsdapiclient.transport import configure, POOL_MAXSIZE
+    if not pnum:
+        click.echo('missing pnum argument')
+        sys.exit(1)
+    configure(pool_maxsize=max(POOL_MAXSIZE, concurrency * 2))
+    check_api_connection(env)
+    tokens = AgentTokens(
+        lambda direction: direction_tokens(env, pnum, direction, basic, api_key)[0]
+    )
+    agent = TransferAgent(
+        env, pnum, tokens, JobQueue(agent_queue_path(env, pnum)),
+        concurrency=concurrency, spool_dir=spool_dir,
+    )
+    try:
+        agent.run()
+    except BrokerError as e:
+        sys.exit(str(e))
+    except KeyboardInterrupt:
+        click.echo('stopped agent')
 
 
 @click.command()
@@ -387,6 +567,19 @@ def construct_correct_remote_path(path: str) -> str:
     required=False,
     help='Comma separated list of files (based on suffix match)'
 )
+@click.option(
+    '--ignore-patterns',
+    default=None,
+    required=False,
+    help='Comma separated list of gitignore-style patterns, e.g.: *.tmp,build/,!build/keep.txt'
+)
+@click.option(
+    '--ignore-file',
+    default=None,
+    required=False,
+    type=click.Path(exists=True),
+    help='Path to a file with gitignore-style patterns, one per line'
+)
 @click.option(
     '--upload-cache-show',
     is_flag=True,
@@ -460,10 +653,63 @@ def construct_correct_remote_path(path: str) -> str:
     help='Do not over-write updated files in the target directory while syncing'
 )
 @click.option(
-    '--download-delete',
+    '--transfer-order',
+    required=False,
+    default='scan',
+    type=click.Choice(SCHEDULING_POLICIES),
+    help='Order of directory transfers: as found, small or large files first, newest first, or mixed'
+)
+@click.option(
+    '--queue-dir',
+    required=False,
+    default=None,
+    type=click.Path(exists=True, file_okay=False),
+    help='Share a directory transfer with other tacl processes, via a queue in this (shared) directory'
+)
+@click.option(
+    '--shard',
+    required=False,
     default=None,
+    help='Handle only part K of N of a directory transfer, e.g. 2/8, for job arrays'
+)
+@click.option(
+    '--watch',
+    is_flag=True,
+    required=False,
+    help='Keep running after --upload-sync, uploading changes as they happen (Linux only)'
+)
+@click.option(
+    '--watch-settle',
+    required=False,
+    default=WATCH_SETTLE,
+    type=float,
+    help='Seconds a file must be unchanged before it is uploaded, with --watch'
+)
+@click.option(
+    '--follow',
+    is_flag=True,
+    required=False,
+    help='Keep running after --download-sync, polling for remote changes'
+)
+@click.option(
+    '--poll-interval',
+    required=False,
+    default=POLL_INTERVAL,
+    type=float,
+    help='Seconds between remote polls with --follow, increased while nothing changes'
+)
+@click.option(
+    '--reconcile-interval',
+    required=False,
+    default=RECONCILE_INTERVAL,
+    type=float,
+    help='Seconds between full syncs, when continuously syncing'
+)
+@click.option(
+    '--download-delete',
+    multiple=True,
     required=False,
-    help='Delete a file/folder which is available for download'
+    help='Delete a file/folder which is available for download, can be repeated'
 )
 @click.option(
     '--api-key',
@@ -502,6 +748,39 @@ def construct_correct_remote_path(path: str) -> str:
     default=CHUNK_THRESHOLD,
     help='E.g.: 1gb, files larger than this size will be sent as resumable uploads'
 )
+@click.option(
+    '--batch',
+    required=False,
+    default=None,
+    type=click.Path(exists=True),
+    help='Run the uploads, downloads and syncs listed in a YAML manifest, in one process'
+)
+@click.option(
+    '--agent',
+    is_flag=True,
+    required=False,
+    help='Keep running, transferring jobs submitted over a local socket, or to --spool-dir'
+)
+@click.option(
+    '--spool-dir',
+    required=False,
+    default=None,
+    type=click.Path(exists=True, file_okay=False),
+    help='Directory from which the agent takes job manifests (YAML, as with --batch)'
+)
+@click.option(
+    '--agent-concurrency',
+    required=False,
+    default=AGENT_CONCURRENCY,
+    type=int,
+    help='Number of jobs the agent runs at the same time'
+)
+@click.option(
+    '--broker',
+    is_flag=True,
+    required=False,
+    help='Run a local token broker, serving tokens to tacl processes using --basic or --api-key'
+)
 @click.option(
     '--remote-path',
     required=False,
@@ -530,6 +809,8 @@ def cli(
     register: bool,
     ignore_prefixes: str,
     ignore_suffixes: str,
+    ignore_patterns: str,
+    ignore_file: str,
     upload_cache_show: bool,
     upload_cache_delete: str,
     upload_cache_delete_all: bool,
@@ -542,13 +823,26 @@ def cli(
     cache_sync: bool,
     keep_missing: bool,
     keep_updated: bool,
-    download_delete: str,
+    transfer_order: str,
+    queue_dir: str,
+    shard: str,
+    watch: bool,
+    watch_settle: float,
+    follow: bool,
+    poll_interval: float,
+    reconcile_interval: float,
+    download_delete: tuple,
     api_key: str,
     link_id: str,
     secret_challenge_file: str,
     encrypt: bool,
     chunk_size: int,
     resumable_threshold: int,
+    batch: str,
+    agent: bool,
+    spool_dir: str,
+    agent_concurrency: int,
+    broker: bool,
     remote_path: str,
 ) -> None:
     """tacl - TSD API client."""
@@ -557,9 +851,47 @@ def cli(
         env = "ec-prod" if pnum and pnum.startswith("ec") else "prod"
 
     token = None
+    token_manager = None
     if verbose:
         os.environ['DEBUG'] = '1'
 
+    if watch and not upload_sync:
+        sys.exit('--watch can only be used with --upload-sync')
+    if follow and not download_sync:
+        sys.exit('--follow can only be used with --download-sync')
+    if spool_dir and not agent:
+        sys.exit('--spool-dir can only be used with --agent')
+    if queue_dir and (watch or follow):
+        sys.exit('--queue-dir cannot be used with --watch or --follow')
+    if shard:
+        from tsdapiclient.tools import as_shard
+        if queue_dir or watch or follow:
+            sys.exit('--shard cannot be used with --queue-dir, --watch, or --follow')
+        try:
+            shard = as_shard(shard)
+        except ValueError as e:
+            sys.exit(str(e))
+
+    if batch:
+        run_batch(env, pnum, batch, basic, api_key)
+        return
+
+    if agent:
+        run_agent(env, pnum, basic, api_key, spool_dir, max(1, agent_concurrency))
+        return
+
+    if broker:
+        from tsdapiclient.broker import TokenBroker, BrokerError, broker_socket_path
+        set_user_agent()
+        click.echo(f'starting token broker: {broker_socket_path()}')
+        try:
+            TokenBroker().serve()
+        except BrokerError as e:
+            sys.exit(str(e))
+        except KeyboardInterrupt:
+            click.echo('stopped token broker')
+        return
+
     # 1. Determine necessary authentication options
     if (upload or
         resume_list or
@@ -567,10 +899,9 @@ def cli(
         resume_delete_all or
         upload_sync
     ):
-        if basic or api_key:
-            requires_user_credentials, token_type = False, TOKENS[env]['upload']
-        else:
-            requires_user_credentials, token_type = False if link_id else True, TOKENS[env]['upload']
+        requires_user_credentials, token_type = auth_requirements(
+            env, 'upload', basic, api_key, link_id,
+        )
     elif (
         download or
         download_list or
@@ -578,62 +909,26 @@ def cli(
         download_delete or
         (link_id and not upload)
     ):
-        if env == 'alt' and basic:
-            requires_user_credentials, token_type = False, TOKENS[env]['download']
-        elif env != 'alt' and basic and not api_key:
-            click.echo('download not authorized with basic auth')
-            sys.exit(1)
-        elif link_id:
-            requires_user_credentials, token_type = False, TOKENS[env]['download']
-        elif env != 'alt' and api_key:
-            requires_user_credentials, token_type = False, 'export_auto'
-        else:
-            requires_user_credentials, token_type = True, TOKENS[env]['download']
+        requires_user_credentials, token_type = auth_requirements(
+            env, 'download', basic, api_key, link_id,
+        )
     else:
         requires_user_credentials = False
 
     auth_method = "iam" if env.startswith("ec-") or (pnum and pnum.startswith("ec")) else "tsd"
     # 2. Try to get a valid access token
+    if requires_user_credentials or basic or api_key:
+        from tsdapiclient.authapi import get_jwt_basic_auth, get_jwt_instance_auth
+        from tsdapiclient.broker import broker_token_manager
+        from tsdapiclient.tools import debug_step, display_instance_info, get_claims
     if requires_user_credentials:
         check_api_connection(env)
         if not pnum:
             click.echo('missing pnum argument')
             sys.exit(1)
-        auth_required = False
-        debug_step(f'using login session with {env}:{pnum}:{token_type}')
-        debug_step('checking if login session has expired')
-        expired = session_is_expired(env, pnum, token_type)
-        if expired:
-            click.echo('your session has expired, please authenticate')
-            auth_required = True
-        debug_step('checking if login session will expire soon')
-        expires_soon = session_expires_soon(env, pnum, token_type)
-        if expires_soon:
-            click.echo('your session expires soon')
-            if click.confirm('Do you want to refresh your login session?'):
-                auth_required = True
-            else:
-                auth_required = False
-        if not expires_soon and expired:
-            auth_required = True
-        if not api_key:
-            api_key = get_api_key(env, pnum)
-        if auth_required:
-            username, password, otp = get_user_credentials(env)
-            token, refresh_token = get_jwt_two_factor_auth(
-                env, pnum, api_key, username, password, otp, token_type, auth_method=auth_method,
-            )
-            if token:
-                debug_step('updating login session')
-                session_update(env, pnum, token_type, token, refresh_token)
-        else:
-            token = session_token(env, pnum, token_type)
-            debug_step(f'using token from existing login session')
-            refresh_token = session_refresh_token(env, pnum, token_type)
-            if refresh_token:
-                debug_step(f'using refresh token from existing login session')
-                debug_step(f'refreshes remaining: {get_claims(refresh_token).get("counter")}')
-                debug_step(refresh_token)
+        token, refresh_token, api_key = session_login(
+            env, pnum, token_type, api_key, auth_method,
+        )
     elif not requires_user_credentials and (basic or api_key):
         if not pnum:
             if api_key and link_id:
@@ -642,18 +937,7 @@ def cli(
                 click.echo('missing pnum argument')
                 sys.exit(1)
         check_api_connection(env)
-        if not api_key:
-            api_key = get_api_key(env, pnum)
-        if api_key.startswith("@"):
-            key_file = api_key[1:]
-            if not os.path.lexists(key_file):
-                sys.exit(f"key file not found: {key_file}")
-            debug_step(f'reading API key from {key_file}')
-            with open(key_file, "r") as f:
-                api_key = f.read().strip()
-        if check_if_key_has_expired(api_key):
-            debug_step("API key has expired")
-            api_key = renew_api_key(env, pnum, api_key, key_file)
+        api_key = load_api_key(env, pnum, api_key)
         if link_id:
             if link_id.startswith("@"):
                 link_id_file = link_id[1:]
@@ -690,49 +974,51 @@ def cli(
             token, refresh_token = get_jwt_instance_auth(env, pnum, api_key, link_id, secret_challenge, token_type)
             pnum = get_claims(token).get("proj")
         else:
-            debug_step('using basic authentication')
-            token, refresh_token = get_jwt_basic_auth(env, pnum, api_key, token_type)
+            token_manager = broker_token_manager(env, pnum, token_type, api_key)
+            if token_manager:
+                token, refresh_token = token_manager.current(), None
+            else:
+                debug_step('using basic authentication')
+                token, refresh_token = get_jwt_basic_auth(env, pnum, api_key, token_type)
     if (requires_user_credentials or basic) and not token:
         click.echo('authentication failed')
         sys.exit(1)
 
     # 3. Given a valid access token, perform a given action
     if token:
+        from tsdapiclient.deletion import BulkDeleter, DeletionError
+        from tsdapiclient.fileapi import (
+            streamfile,
+            initiate_resumable,
+            get_resumable,
+            delete_resumable,
+            delete_all_resumables,
+            export_get,
+            export_list,
+            print_export_list,
+            print_resumables_list,
+            export_head,
+            export_delete,
+        )
+        from tsdapiclient.sync import (
+            SerialDirectoryUploader,
+            SerialDirectoryDownloader,
+            SerialDirectoryUploadSynchroniser,
+            SerialDirectoryDownloadSynchroniser,
+        )
+        from tsdapiclient.tools import (
+            as_bytes,
+            construct_correct_remote_path,
+            resolve_remote_path,
+            select_group,
+        )
+        from tsdapiclient.watch import DirectoryWatcher, RemotePoller, WatchError
         refresh_target = get_claims(token).get('exp')
-        if encrypt:
-            if not LIBSODIUM_AVAILABLE:
-                click.echo("libsodium system dependency missing - end-to-end encryption not available")
-                public_key = None
-            else:
-                debug_step('Using end-to-end encryption')
-                public_key = nacl_get_server_public_key(env, pnum, token)
-        else:
-            public_key = None
-
-        available_groups = get_claims(token).get('groups')
-        if group:
-            if group not in available_groups:
-                sys.exit(f'group {group} not available with this authentication')
-        else:
-            member_group  = f'{pnum}-member-group'
-            if member_group not in available_groups:
-                if len(available_groups) == 1:
-                    group = available_groups[0]
-                else:
-                    sys.exit(f'select a group from on of the following: {available_groups}')
-            else:
-                group = member_group
+        public_key = get_server_public_key(env, pnum, token) if encrypt else None
 
+        group = select_group(pnum, token, group)
         token_path = get_claims(token).get('path', None)
-
-        if remote_path:
-            if not remote_path.endswith('/'):
-                remote_path = f'{remote_path}/'
-            if token_path and not remote_path.startswith(token_path):
-                sys.exit(f'upload path mismatch: {remote_path} != {token_path}')
-        else:
-            if token_path:
-                remote_path = f"{token_path}/"
+        remote_path = resolve_remote_path(token, remote_path)
         if upload:
             if os.path.isfile(upload):
                 if upload_id or os.stat(upload).st_size > as_bytes(resumable_threshold):
@@ -750,12 +1036,14 @@ def cli(
                         api_key=api_key,
                         refresh_token=refresh_token,
                         refresh_target=refresh_target,
+                        token_manager=token_manager,
                         remote_path=remote_path,
                     )
                 else:
                     debug_step('starting upload')
                     resp = streamfile(
-                        env, pnum, upload, token, group=group, public_key=public_key, remote_path=remote_path
+                        env, pnum, upload, token, group=group, public_key=public_key, remote_path=remote_path,
+                        token_manager=token_manager,
                     )
             else:
                 click.echo(f'uploading directory {upload}')
@@ -768,6 +1056,11 @@ def cli(
                     group,
                     prefixes=ignore_prefixes,
                     suffixes=ignore_suffixes,
+                    patterns=ignore_patterns,
+                    ignore_file=ignore_file,
+                    transfer_order=transfer_order,
+                    queue_dir=queue_dir,
+                    shard=shard,
                     use_cache=True if not cache_disable else False,
                     public_key=public_key,
                     chunk_size=as_bytes(chunk_size),
@@ -775,6 +1068,7 @@ def cli(
                     api_key=api_key,
                     refresh_token=refresh_token,
                     refresh_target=refresh_target,
+                    token_manager=token_manager,
                     remote_path=remote_path,
                 )
                 uploader.sync()
@@ -791,6 +1085,11 @@ def cli(
                 group,
                 prefixes=ignore_prefixes,
                 suffixes=ignore_suffixes,
+                patterns=ignore_patterns,
+                ignore_file=ignore_file,
+                transfer_order=transfer_order,
+                queue_dir=queue_dir,
+                shard=shard,
                 use_cache=False if not cache_sync else True,
                 sync_mtime=True,
                 keep_missing=keep_missing,
@@ -802,9 +1101,20 @@ def cli(
                 api_key=api_key,
                 refresh_token=refresh_token,
                 refresh_target=refresh_target,
+                token_manager=token_manager,
                 remote_path=remote_path,
             )
-            syncer.sync()
+            if watch:
+                try:
+                    DirectoryWatcher(
+                        syncer, settle=watch_settle, reconcile_interval=reconcile_interval,
+                    ).run()
+                except WatchError as e:
+                    sys.exit(str(e))
+                except KeyboardInterrupt:
+                    click.echo('stopped watching')
+            else:
+                syncer.sync()
         elif resume_list:
             debug_step('listing resumables')
             overview = get_resumable(env, pnum, token)
@@ -833,11 +1143,17 @@ def cli(
                     token,
                     prefixes=ignore_prefixes,
                     suffixes=ignore_suffixes,
+                    patterns=ignore_patterns,
+                    ignore_file=ignore_file,
+                    transfer_order=transfer_order,
+                    queue_dir=queue_dir,
+                    shard=shard,
                     use_cache=True if not cache_disable else False,
                     remote_key='export',
                     api_key=api_key,
                     refresh_token=refresh_token,
                     refresh_target=refresh_target,
+                    token_manager=token_manager,
                     public_key=public_key,
                     remote_path=remote_path,
                 )
@@ -851,14 +1167,22 @@ def cli(
                     etag=download_id,
                     public_key=public_key,
                     remote_path=remote_path,
+                    token_manager=token_manager,
                 )
         elif download_list:
             debug_step('listing export directory')
             data = export_list(env, pnum, token, remote_path=remote_path)
             print_export_list(data)
         elif download_delete:
-            debug_step(f'deleting {download_delete}')
-            export_delete(env, pnum, token, download_delete, remote_path=remote_path)
+            debug_step(f'deleting {", ".join(download_delete)}')
+            try:
+                BulkDeleter(
+                    lambda filename: export_delete.__wrapped__(
+                        env, pnum, token, filename, remote_path=remote_path
+                    ),
+                ).run(dict.fromkeys(download_delete))
+            except DeletionError as e:
+                sys.exit(str(e))
         elif download_sync:
             filename = download_sync
             debug_step('starting directory sync')
@@ -872,6 +1196,11 @@ def cli(
                 token,
                 prefixes=ignore_prefixes,
                 suffixes=ignore_suffixes,
+                patterns=ignore_patterns,
+                ignore_file=ignore_file,
+                transfer_order=transfer_order,
+                queue_dir=queue_dir,
+                shard=shard,
                 use_cache=False if not cache_sync else True,
                 sync_mtime=True,
                 keep_missing=keep_missing,
@@ -880,59 +1209,79 @@ def cli(
                 api_key=api_key,
                 refresh_token=refresh_token,
                 refresh_target=refresh_target,
+                token_manager=token_manager,
                 public_key=public_key,
                 remote_path=remote_path
             )
-            syncer.sync()
+            if follow:
+                try:
+                    RemotePoller(
+                        syncer, interval=poll_interval, reconcile_interval=reconcile_interval,
+                    ).run()
+                except KeyboardInterrupt:
+                    click.echo('stopped following')
+            else:
+                syncer.sync()
         return
 
     # 4. Optionally perform actions which do no require authentication
     else:
-        if (upload_cache_show or
+        cache_action = (upload_cache_show or
             upload_cache_delete or
             upload_cache_delete_all or
             download_cache_show or
             download_cache_delete or
             download_cache_delete_all
-        ) and not pnum:
+        )
+        if cache_action and not pnum:
             sys.exit('cache operations are project specific - missing pnum argument')
         # 4.1 Interact with config, sessions, and caches
         if config_show:
+            from tsdapiclient.configurer import print_config
             print_config()
         elif config_delete:
+            from tsdapiclient.configurer import delete_config
             delete_config()
         elif session_show:
+            from tsdapiclient.session import session_print
             session_print()
         elif session_delete:
+            from tsdapiclient.session import session_clear
             session_clear()
-        elif upload_cache_show:
-            cache = UploadCache(env, pnum)
-            cache.print()
-        elif upload_cache_delete:
-            cache = UploadCache(env, pnum)
-            cache.destroy(key=upload_cache_delete)
-            delete_cache = UploadDeleteCache(env, pnum)
-            delete_cache.destroy(key=upload_cache_delete)
-        elif upload_cache_delete_all:
-            cache = UploadCache(env, pnum)
-            cache.destroy_all()
-            delete_cache = UploadDeleteCache(env, pnum)
-            delete_cache.destroy_all()
-        elif download_cache_show:
-            cache = DownloadCache(env, pnum)
-            cache.print()
-        elif download_cache_delete:
-            cache = DownloadCache(env, pnum)
-            cache.destroy(key=download_cache_delete)
-            delete_cache = DownloadDeleteCache(env, pnum)
-            delete_cache.destroy(key=download_cache_delete)
-        elif download_cache_delete_all:
-            cache = DownloadCache(env, pnum)
-            cache.destroy_all()
-            delete_cache = DownloadDeleteCache(env, pnum)
-            delete_cache.destroy_all()
+        elif cache_action:
+            from tsdapiclient.sync import (
+                UploadCache, DownloadCache, UploadDeleteCache, DownloadDeleteCache,
+            )
+            if upload_cache_show:
+                cache = UploadCache(env, pnum)
+                cache.print()
+            elif upload_cache_delete:
+                cache = UploadCache(env, pnum)
+                cache.destroy(key=upload_cache_delete)
+                delete_cache = UploadDeleteCache(env, pnum)
+                delete_cache.destroy(key=upload_cache_delete)
+            elif upload_cache_delete_all:
+                cache = UploadCache(env, pnum)
+                cache.destroy_all()
+                delete_cache = UploadDeleteCache(env, pnum)
+                delete_cache.destroy_all()
+            elif download_cache_show:
+                cache = DownloadCache(env, pnum)
+                cache.print()
+            elif download_cache_delete:
+                cache = DownloadCache(env, pnum)
+                cache.destroy(key=download_cache_delete)
+                delete_cache = DownloadDeleteCache(env, pnum)
+                delete_cache.destroy(key=download_cache_delete)
+            elif download_cache_delete_all:
+                cache = DownloadCache(env, pnum)
+                cache.destroy_all()
+                delete_cache = DownloadDeleteCache(env, pnum)
+                delete_cache.destroy_all()
         # 4.2 Register a client
         elif register:
+            from tsdapiclient.administrator import get_tsd_api_key
+            from tsdapiclient.configurer import update_config
             prod = "1 - TSD production usage"
             fx = "2 - TSD fiber network for hospitals (fx03)"
             test = "3 - TSD testing"
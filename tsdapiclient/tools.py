@@ -15,8 +15,6 @@ from typing import Optional, Callable, Any, Union
 from urllib.parse import urlencode
 
 import click
-import humanfriendly.tables
-import requests
 
 from . import __version__
 from requests.exceptions import (
@@ -25,11 +23,10 @@ from requests.exceptions import (
     RequestException,
     Timeout,
 )
-from tsdapiclient.client_config import API_VERSION
+from tsdapiclient.client_config import API_VERSION, EDUCLOUD_CONTACT_URL, HELP_URL
 from tsdapiclient.exc import AuthzError, AuthnError
-
-HELP_URL = 'https://www.uio.no/english/services/it/research/sensitive-data/contact/index.html'
-EDUCLOUD_CONTACT_URL = "https://www.uio.no/english/services/it/research/platforms/edu-research/help/contact-us.html"
+from tsdapiclient.retry import RETRY_ATTEMPTS, RetryingSession, replayable
+from tsdapiclient.transport import get_transport, http
 
 HOSTS = {
     'test': 'test.api.tsd.usit.no',
@@ -163,7 +160,7 @@ def renew_api_key(env: str, pnum: str, key: str, save_to: str) -> str:
         }
         url = auth_api_url(env, pnum, 'renew')
         debug_step(f"renewing API key at: {url}")
-        resp = requests.post(
+        resp = http.post(
             url, data=json.dumps(payload),
         )
         new_key = json.loads(resp.text).get("new_client_secret")
@@ -178,6 +175,50 @@ def renew_api_key(env: str, pnum: str, key: str, save_to: str) -> str:
     except Exception as e:
         raise e
 
+def construct_correct_remote_path(path: str) -> str:
+    if path.startswith('../'):
+        return os.path.abspath(path)
+    elif path.startswith('~/'):
+        return os.path.expanduser(path)
+    else:
+        return path
+
+
+def select_group(pnum: str, token: str, group: Optional[str] = None) -> str:
+    """
+    Check that the requested group is available with the token,
+    or choose a default: the member group, or the only group.
+
+    """
+    available_groups = get_claims(token).get('groups')
+    if group:
+        if group not in available_groups:
+            sys.exit(f'group {group} not available with this authentication')
+        return group
+    member_group  = f'{pnum}-member-group'
+    if member_group in available_groups:
+        return member_group
+    if len(available_groups) == 1:
+        return available_groups[0]
+    sys.exit(f'select a group from on of the following: {available_groups}')
+
+
+def resolve_remote_path(token: str, remote_path: Optional[str] = None) -> Optional[str]:
+    """
+    Normalise a remote path, checking it against the path claim
+    of the token, if any, which is the default.
+
+    """
+    token_path = get_claims(token).get('path', None)
+    if remote_path:
+        if not remote_path.endswith('/'):
+            remote_path = f'{remote_path}/'
+        if token_path and not remote_path.startswith(token_path):
+            sys.exit(f'upload path mismatch: {remote_path} != {token_path}')
+    elif token_path:
+        remote_path = f"{token_path}/"
+    return remote_path
+
 def check_if_exp_is_within_range(key: str, lower: int, upper: int) -> bool:
     try:
         enc_claim_text = key.split('.')[1]
@@ -266,6 +307,10 @@ def has_api_connectivity(
 ) -> bool:
     """Verify that a connection can be made to the API.
 
+    The connection is made with the shared session, so it is
+    reused by the requests which follow, without retries, so that
+    a missing connection is reported quickly.
+
     Args:
         hostname (str): domain where the API is hosted
         port (int, optional): TCP port the API is listening on. Defaults to 443.
@@ -277,7 +322,7 @@ def has_api_connectivity(
     """
     connectivity = False
     try:
-        r = requests.get(f"{schema}://{hostname}:{port}", timeout=timeout)
+        r = http.get(f"{schema}://{hostname}:{port}", timeout=timeout, retry=False)
         if r.status_code != 403:
             connectivity = True
     except:
@@ -287,7 +332,7 @@ def has_api_connectivity(
 
 def get_external_ip_address(timeout: float = 5) -> str:
     try:
-        ip_address_request = requests.get(IP_LOOKUP_API_URL, timeout=timeout)
+        ip_address_request = http.get(IP_LOOKUP_API_URL, timeout=timeout)
     except:
         return "UNKNOWN"
     return ip_address_request.text
@@ -309,11 +354,25 @@ def as_bytes(amount: str) -> int:
     return num_bytes
 
 
+def as_shard(spec: str) -> tuple:
+    """
+    Change a string like '2/8' to (2, 8): the second of eight shards.
+
+    """
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f'unsupported shard: {spec}, expected K/N, e.g. 1/4')
+    if not 1 <= index <= count:
+        raise ValueError(f'unsupported shard: {spec}, K must be between 1 and N')
+    return index, count
+
+
 def instance_info(env: str, instance_id: str) -> dict:
     try:
         url = f"https://{HOSTS.get(env)}/v1/public/iam/capabilities/instances/{instance_id}"
         debug_step(f"Fetching info from: {url}")
-        resp = requests.get(url)
+        resp = http.get(url)
         return json.loads(resp.text)
     except Exception as e:
         debug_step("problem fetching instance information")
@@ -324,7 +383,7 @@ def project_info(env: str, pnum: str) -> dict:
     try:
         url = f"https://{HOSTS.get(env)}/v1/public/iam/projects/{pnum}"
         debug_step(f"Fetching info from: {url}")
-        resp = requests.get(url)
+        resp = http.get(url)
         return json.loads(resp.text)
     except Exception as e:
         debug_step("problem fetching project information")
@@ -346,15 +405,23 @@ def display_instance_info(env: str, instance_id: str) -> None:
     project = project_info(env, pnum)
     values.append(["Project name", project.get("project_name")])
     values.append(["Project number", pnum])
+    import humanfriendly.tables
     print(humanfriendly.tables.format_pretty_table(values, colnames))
 
 
 class Retry(object):
 
     """
-    When nginx returns a 504 due to an upstream timeout,
-    it does not try to find a new upstream, so we can
-    retry it.
+    Send a request, retrying it according to the RetryPolicy of the
+    shared transport, e.g. when nginx returns a 504 due to an upstream
+    timeout, since it does not try to find a new upstream, or when
+    the connection is lost, on the same connection pool.
+
+    The result has the response, as resp, and new_session, which is
+    always None, since sessions are kept across retries. Bodies which
+    cannot be sent again, see retry.replayable, are sent once, as are
+    requests with retry=False, while those with retry=True are retried
+    as idempotent ones, whatever their method.
 
     """
 
@@ -364,59 +431,39 @@ class Retry(object):
         url: str,
         headers: dict,
         data: Union[bytes, Callable],
-        counter: int = 5,
+        counter: int = RETRY_ATTEMPTS,
+        retry: Optional[bool] = None,
     ) -> None:
         self.func = func
         self.url = url
         self.headers = headers
         self.data = data
         self.counter = counter
-        self.func_str = str(func)
-
-    def _new_func(self) -> tuple:
-        session = requests.session()
-        if "patch" in self.func_str:
-            func = session.patch
-        elif "put" in self.func_str:
-            func = session.put
-        elif "get" in self.func_str:
-            func = session.get
-        elif "delete" in self.func_str:
-            func = session.delete
-        return func, session
+        self.retry = retry
+        self.session = getattr(func, '__self__', None)
+
+    def _send(self) -> Any:
+        if isinstance(self.session, RetryingSession):
+            # retried here, with counter attempts, rather than by the session
+            return self.session.request(
+                self.func.__name__, self.url, headers=self.headers, data=self.data, retry=False,
+            )
+        return self.func(self.url, headers=self.headers, data=self.data)
 
     def __enter__(self) -> dict:
-        new_session = None
-        total = self.counter
-        retry_attempt_no = 0
-        rc = 0
-        while self.counter > 0:
-            try:
-                self.resp = self.func(self.url, headers=self.headers, data=self.data)
-                rc = self.resp.status_code
-                reconnect = False
-            except KeyboardInterrupt:
-                sys.exit()
-            except ConnectionError:
-                debug_step("trying to re-establish connectivity")
-                time.sleep(5)
-                self.func, new_session = self._new_func()
-                debug_step("retrying request with new connection")
-                reconnect = True
-            if rc >= 200 and rc <= 299:
-                return {"resp": self.resp, "new_session": new_session}
-            elif rc >= 400 and rc <= 499:
-                return {"resp": self.resp, "new_session": new_session}
-            elif rc in [500, 504] or reconnect:
-                self.counter -= 1
-                retry_attempt_no += 1
-                debug_step(
-                    f"timeout: retrying request attempt {retry_attempt_no}/{total}"
-                )
-                if self.counter == 0:  # this was the last attempt
-                    self.resp.raise_for_status()
+        policy = getattr(self.session, 'retry_policy', None) or get_transport().retry_policy
+        try:
+            if self.retry is False or not replayable(self.data):
+                self.resp = self._send()
             else:
-                return {"resp": self.resp, "new_session": new_session}
+                self.resp = policy.call(
+                    self.func.__name__, self._send, self.url,
+                    attempts=self.counter, rewind=getattr(self.data, 'rewind', None),
+                    idempotent=bool(self.retry),
+                )
+        except KeyboardInterrupt:
+            sys.exit()
+        return {"resp": self.resp, "new_session": None}
 
     def __exit__(self, exc_type, exc_value, exc_traceback) -> dict:
         if exc_type:
@@ -0,0 +1,163 @@
+"""HTTP connection pools, shared by all requests made by tacl."""
+
+import socket
+import threading
+
+from typing import Any, Optional
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+from tsdapiclient.retry import RetryingSession, RetryPolicy
+
+POOL_CONNECTIONS = 4 # hosts, with a connection pool each
+POOL_MAXSIZE = 10 # connections kept open, per host
+KEEPALIVE_IDLE = 60 # seconds before an idle connection is probed
+KEEPALIVE_INTERVAL = 10 # seconds between probes
+KEEPALIVE_COUNT = 6 # unanswered probes before a connection is dropped
+
+
+class _SocketOptionsAdapter(HTTPAdapter):
+
+    """An HTTPAdapter which sets socket options on new connections."""
+
+    def __init__(self, socket_options: list, **kwargs: Any) -> None:
+        self.socket_options = socket_options
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        kwargs['socket_options'] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, proxy: str, **kwargs: Any) -> Any:
+        kwargs['socket_options'] = self.socket_options
+        return super().proxy_manager_for(proxy, **kwargs)
+
+
+class Transport(object):
+
+    """
+    Configuration of HTTP connections, and the session which
+    shares them, so that e.g. the connectivity check, authentication,
+    and the transfers which follow, all use the same TLS connections.
+
+    Parameters
+    ----------
+    pool_connections: number of hosts to keep connection pools for
+    pool_maxsize: number of connections to keep open, per host
+    keepalive: whether to probe idle connections, so that they are
+               neither dropped by firewalls, nor kept when dead
+    nodelay: whether to disable Nagle's algorithm (TCP_NODELAY)
+    socket_buffer_size: bytes, for send and receive buffers,
+                        the default, None, leaves them to the kernel
+    retry_policy: RetryPolicy, for all requests of its sessions,
+                  with a retry budget shared by them
+
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = POOL_CONNECTIONS,
+        pool_maxsize: int = POOL_MAXSIZE,
+        keepalive: bool = True,
+        nodelay: bool = True,
+        socket_buffer_size: Optional[int] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+    ) -> None:
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keepalive = keepalive
+        self.nodelay = nodelay
+        self.socket_buffer_size = socket_buffer_size
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.shared = None
+        self.lock = threading.Lock()
+
+    def socket_options(self) -> list:
+        options = [
+            option for option in HTTPConnection.default_socket_options
+            if option[:2] != (socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        ]
+        if self.nodelay:
+            options.append((socket.IPPROTO_TCP, socket.TCP_NODELAY, 1))
+        if self.keepalive:
+            options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+            for name, value in (
+                ('TCP_KEEPIDLE', KEEPALIVE_IDLE),
+                ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                ('TCP_KEEPCNT', KEEPALIVE_COUNT),
+            ):
+                if hasattr(socket, name):
+                    options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+        if self.socket_buffer_size:
+            options.append((socket.SOL_SOCKET, socket.SO_SNDBUF, self.socket_buffer_size))
+            options.append((socket.SOL_SOCKET, socket.SO_RCVBUF, self.socket_buffer_size))
+        return options
+
+    def new_session(self) -> requests.Session:
+        """A session with its own connections, configured by this transport."""
+        session = RetryingSession(self.retry_policy)
+        adapter = _SocketOptionsAdapter(
+            self.socket_options(),
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def session(self) -> requests.Session:
+        """The session shared by all users of this transport."""
+        with self.lock:
+            if self.shared is None:
+                self.shared = self.new_session()
+            return self.shared
+
+    def close(self) -> None:
+        with self.lock:
+            if self.shared is not None:
+                self.shared.close()
+                self.shared = None
+
+
+_transport = Transport()
+_transport_lock = threading.Lock()
+
+
+def configure(**options: Any) -> Transport:
+    """
+    Replace the shared transport with one configured by options,
+    see Transport, closing the connections of the previous one.
+
+    """
+    global _transport
+    with _transport_lock:
+        _transport.close()
+        _transport = Transport(**options)
+        return _transport
+
+
+def get_transport() -> Transport:
+    with _transport_lock:
+        return _transport
+
+
+def shared_session() -> requests.Session:
+    return get_transport().session()
+
+
+class _SharedSession(object):
+
+    """
+    Stands in for the shared session, e.g. as a default argument,
+    so that it is only created, when a request is made.
+
+    """
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(shared_session(), name)
+
+
+http = _SharedSession()
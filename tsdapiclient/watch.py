@@ -0,0 +1,387 @@
+"""Continuous directory synchronisation: inotify for uploads, polling for downloads."""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from typing import Optional
+
+import click
+
+from tsdapiclient.client_config import POLL_INTERVAL, RECONCILE_INTERVAL, WATCH_SETTLE
+from tsdapiclient.inventory import needs_transfer
+from tsdapiclient.tools import debug_step
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+EVENT_HEADER = struct.Struct('iIII')
+
+POLL_MAX_INTERVAL = 600 # seconds between remote polls, when idle
+
+
+class WatchError(Exception):
+    pass
+
+
+class Inotify(object):
+
+    """Minimal ctypes binding to the Linux inotify API."""
+
+    def __init__(self) -> None:
+        if not sys.platform.startswith('linux'):
+            raise WatchError('watching directories is only supported on Linux')
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise WatchError(f'inotify_init1 failed: {os.strerror(ctypes.get_errno())}')
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise WatchError(
+                    'inotify watch limit reached - increase fs.inotify.max_user_watches'
+                )
+            raise WatchError(f'cannot watch {path}: {os.strerror(err)}')
+        return wd
+
+    def read(self, timeout: Optional[float] = None) -> list:
+        """
+        Wait for events, returning a list of (wd, mask, cookie, name) tuples.
+
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            buf = os.read(self.fd, 1024*64)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(buf):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buf[offset:offset+length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class DirectoryWatcher(object):
+
+    """
+    Continuously synchronise a local directory, using inotify.
+
+    An initial full sync is performed, after which changed files
+    are collected from inotify events, and handed to the transporter's
+    _transfer and _delete methods. A file is only transferred once
+    it has not changed for settle seconds, so partially written files
+    are not sent. Periodically, and whenever events may have been lost,
+    a full sync reconciles the local and remote directories.
+
+    Only files known to exist remotely, since they were present at
+    the last full sync, or transferred since, are deleted remotely,
+    so that e.g. temporary files, removed before they settled, are not.
+
+    """
+
+    def __init__(
+        self,
+        transporter: "GenericDirectoryTransporter",
+        settle: float = WATCH_SETTLE,
+        reconcile_interval: float = RECONCILE_INTERVAL,
+    ) -> None:
+        self.transporter = transporter
+        self.root = os.path.normpath(transporter.directory)
+        self.ignore_rules = transporter.ignore_rules
+        self.settle = settle
+        self.reconcile_interval = reconcile_interval
+        self.inotify = Inotify()
+        self.watches = {}
+        self.changed = {}
+        self.deleted = set()
+        self.remote = set()
+        self.reconcile_due = True
+
+    def _relative(self, path: str) -> str:
+        return path[len(self.root) + 1:]
+
+    def _watch_tree(self, directory: str, queue_files: bool = False) -> None:
+        """
+        Watch a directory, and all its (non-ignored) sub-directories,
+        optionally queueing existing files, e.g. for directories
+        created, or moved into the tree, after the watch started.
+
+        """
+        for current, subdirectories, files in os.walk(directory):
+            if self.ignore_rules:
+                subdirectories[:] = [
+                    d for d in subdirectories
+                    if not self.ignore_rules.can_prune(self._relative(f'{current}/{d}'))
+                ]
+            self.watches[self.inotify.add_watch(current)] = current
+            if queue_files:
+                now = time.monotonic()
+                for file in files:
+                    self._changed(f'{current}/{file}', now)
+
+    def _changed(self, path: str, when: float) -> None:
+        if self.ignore_rules and self.ignore_rules.ignores(self._relative(path)):
+            return
+        self.deleted.discard(path)
+        self.changed[path] = when
+
+    def _handle(self, wd: int, mask: int, name: str) -> None:
+        if mask & IN_Q_OVERFLOW:
+            debug_step('inotify queue overflow, scheduling full sync')
+            self.reconcile_due = True
+            return
+        directory = self.watches.get(wd)
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        if directory is None:
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            if directory == self.root:
+                raise WatchError(f'{self.root} was removed, or moved')
+            return
+        path = f'{directory}/{name}'
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                if not (self.ignore_rules and self.ignore_rules.can_prune(self._relative(path))):
+                    self._watch_tree(path, queue_files=True)
+            elif mask & IN_MOVED_FROM:
+                # the files it contained are no longer known individually
+                self.reconcile_due = True
+            return
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self.changed.pop(path, None)
+            if (
+                not self.transporter.keep_missing
+                and path in self.remote
+                and not (self.ignore_rules and self.ignore_rules.ignores(self._relative(path)))
+            ):
+                self.deleted.add(path)
+        elif mask & (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE):
+            self._changed(path, time.monotonic())
+
+    def _ready(self, now: float) -> list:
+        ready = [path for path, when in self.changed.items() if now - when >= self.settle]
+        for path in ready:
+            del self.changed[path]
+        return sorted(ready)
+
+    def _reconcile(self) -> None:
+        click.echo(f'reconciling {self.root}')
+        self.transporter.sync()
+        # after a full sync, every file which is not ignored exists remotely
+        self.remote = {
+            path for path, _, _ in self.transporter._iter_local_resources(self.root)
+        }
+        self.reconcile_due = False
+        self.last_reconcile = time.monotonic()
+
+    def run(self, forever: bool = True) -> None:
+        click.echo(f'watching {self.root} for changes')
+        self._watch_tree(self.root)
+        self._reconcile()
+        try:
+            while True:
+                now = time.monotonic()
+                if self.reconcile_due or now - self.last_reconcile >= self.reconcile_interval:
+                    self.changed.clear()
+                    self.deleted.clear()
+                    self._reconcile()
+                    continue
+                for path in self._ready(now):
+                    if os.path.isfile(path):
+                        print(f'transferring: {path}')
+                        self.transporter._transfer(path)
+                        self.remote.add(path)
+                self.transporter._delete_many(
+                    path for path in sorted(self.deleted) if not os.path.lexists(path)
+                )
+                self.remote -= self.deleted
+                self.deleted.clear()
+                if not forever and not self.changed:
+                    break
+                if self.changed:
+                    timeout = max(0.1, self.settle - (now - min(self.changed.values())))
+                else:
+                    timeout = self.reconcile_interval - (now - self.last_reconcile)
+                for wd, mask, _, name in self.inotify.read(timeout=max(0.1, timeout)):
+                    self._handle(wd, mask, name)
+        finally:
+            self.inotify.close()
+
+
+class RemoteDirectory(object):
+
+    """Snapshot of a single remote directory listing."""
+
+    __slots__ = ('mtime', 'files', 'subdirectories')
+
+    def __init__(self, mtime: Optional[str], files: dict, subdirectories: dict) -> None:
+        self.mtime = mtime
+        self.files = files
+        self.subdirectories = subdirectories
+
+
+class RemotePoller(object):
+
+    """
+    Continuously synchronise a remote directory, by polling.
+
+    Each poll lists the remote tree, comparing every directory to
+    the snapshot taken by the previous poll, and only new or changed
+    files are downloaded - the local directory is not re-scanned.
+
+    Directories without sub-directories, whose mtime (as reported
+    in the listing of their parent) did not change, are not listed
+    at all, since no files were added to, or removed from them.
+    Files modified in place do not change the mtime of their
+    directory, so a full sync reconciles the local and remote
+    directories every reconcile_interval seconds.
+
+    The poll interval doubles after each poll that found no
+    changes, up to max_interval, and is reset when changes appear.
+
+    """
+
+    def __init__(
+        self,
+        transporter: "GenericDirectoryTransporter",
+        interval: float = POLL_INTERVAL,
+        max_interval: float = POLL_MAX_INTERVAL,
+        reconcile_interval: float = RECONCILE_INTERVAL,
+    ) -> None:
+        self.transporter = transporter
+        self.root = os.path.normpath(transporter.directory)
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.reconcile_interval = reconcile_interval
+        self.snapshot = {}
+
+    def poll(self) -> tuple:
+        """
+        List the remote directory, update the snapshot, and return
+        lists of resources that changed, and that were removed,
+        since the previous poll.
+
+        """
+        reference_key = self.transporter.integrity_reference_key
+        snapshot = {}
+        changed, removed = [], []
+        directories = [(self.root, None)]
+        while directories:
+            directory, mtime = directories.pop(0)
+            previous = self.snapshot.get(directory)
+            if (
+                previous
+                and mtime is not None
+                and previous.mtime == mtime
+                and not previous.subdirectories
+            ):
+                snapshot[directory] = previous
+                continue
+            files, subdirectories = {}, {}
+            for ref, is_dir, entry in self.transporter._list_remote_directory(directory):
+                if is_dir:
+                    subdirectories[ref] = entry.get('mtime')
+                else:
+                    files[ref] = (entry.get(reference_key), entry.get('size'))
+            snapshot[directory] = RemoteDirectory(mtime, files, subdirectories)
+            directories.extend(subdirectories.items())
+            previous_files = previous.files if previous else {}
+            if files == previous_files:
+                continue
+            changed.extend(
+                ref for ref, info in files.items() if previous_files.get(ref) != info
+            )
+            removed.extend(ref for ref in previous_files if ref not in files)
+        for directory, previous in self.snapshot.items():
+            if directory not in snapshot:
+                removed.extend(previous.files)
+        self.snapshot = snapshot
+        return changed, removed
+
+    def _is_current(self, resource: str) -> bool:
+        """
+        Whether the local copy of a resource is newer than the
+        remote one, and should be kept, with keep_updated.
+
+        """
+        target_dir = self.transporter.target_dir
+        local = resource if not target_dir else os.path.normpath(f'{target_dir}/{resource}')
+        try:
+            info = os.stat(local)
+        except FileNotFoundError:
+            return False
+        directory = self.snapshot.get(os.path.dirname(resource))
+        if not directory or resource not in directory.files:
+            return False
+        reference, size = directory.files[resource]
+        return not needs_transfer(
+            (resource, reference, size),
+            (resource, info.st_mtime, info.st_size),
+            keep_updated=True,
+            tolerance=self.transporter.mtime_tolerance,
+        )
+
+    def _reconcile(self) -> None:
+        click.echo(f'reconciling {self.root}')
+        self.poll()
+        self.transporter.sync()
+        self.last_reconcile = time.monotonic()
+
+    def run(self, forever: bool = True) -> None:
+        click.echo(f'following {self.root} for changes')
+        self._reconcile()
+        interval = self.interval
+        while forever:
+            time.sleep(interval)
+            if time.monotonic() - self.last_reconcile >= self.reconcile_interval:
+                self._reconcile()
+                interval = self.interval
+                continue
+            changed, removed = self.poll()
+            if not changed and not removed:
+                debug_step('no remote changes')
+                interval = min(interval * 2, self.max_interval)
+                continue
+            interval = self.interval
+            for resource in changed:
+                if self.transporter.keep_updated and self._is_current(resource):
+                    continue
+                self.transporter._transfer(resource)
+            if not self.transporter.keep_missing:
+                self.transporter._delete_many(
+                    resource for resource in removed if os.path.lexists(resource)
+                )